@@ -0,0 +1,23 @@
+from flask import Blueprint, request, jsonify
+
+from utils.batch import parse_batch_requests, run_batch
+
+batch_router = Blueprint("batch", __name__)
+
+
+# run several API requests in one round trip
+# body: {"requests": [{"method": "GET", "path": "/movies/1"}, {"method": "POST", "path": "/comments/", "body": {...}}]}
+# answers {"responses": [{"status": 200, "headers": {...}, "body": ...}, ...]} in request order
+@batch_router.route("", methods=['POST'])
+def run_requests():
+    try:
+        requests = parse_batch_requests(request.get_json(silent=True))
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    results, set_cookies = run_batch(requests)
+
+    response = jsonify({"responses": results})
+    for header in set_cookies:
+        response.headers.add("Set-Cookie", header)
+    return response, 200
@@ -4,21 +4,21 @@ from flask_login import login_required, current_user
 from database import db
 from models.movie import Movie
 from models.comment import Comment
+from utils.cache import response_cache
+from utils.changes import COMMENTS, comments_delta, next_version_statement, parse_since, tombstone_statement, tombstones
+from utils.comments import comment_count_statement, user_comments_statement
+from utils.pagination import keyset_page, parse_page_args
+from utils.serializers import rows_response
+from utils.replicas import replica_router
+from utils.shards import COMMENT_IDS, next_id_statement, shard_router
 
 comments_router = Blueprint("comments", __name__)
 
 
-def serialize_comment(comment):
-    return {
-        "id": comment.id,
-        "text": comment.text,
-        "movie_id": comment.movie_id
-    }
-
-
 # add comment
 @comments_router.route("/", methods=['POST'])
 @login_required
+@shard_router.user_shard(write=True)
 def leave_comment():
     try:
         data = request.get_json()
@@ -34,14 +34,20 @@ def leave_comment():
         if not user or not movie:
             return jsonify({"message": "User or movie not found"}), 404
 
+        # set the keys directly, appending to user.comments / movie.comments would load both collections
+        # ids stay unique across shards, each comment takes the next one of the primary's allocation
         new_comment = Comment(
-            text=text
+            id=db.session.execute(next_id_statement(COMMENT_IDS)).scalar() if shard_router.enabled else None,
+            text=text,
+            author_id=user.id,
+            movie_id=movie.id,
+            version=db.session.execute(next_version_statement(db.session, user.id)).scalar()
         )
 
         db.session.add(new_comment)
-        user.comments.append(new_comment)
-        movie.comments.append(new_comment)
+        db.session.execute(comment_count_statement(movie.id, 1))
         db.session.commit()
+        response_cache.invalidate_movie(movie_id)
 
         return jsonify({"message": "Comment is added."}), 201
 
@@ -51,8 +57,12 @@ def leave_comment():
 
 
 # get all user's comments
+# ?limit=&after= returns a keyset page
+# ?since=<version> returns only the comments written and the comment ids deleted after that version, with the new one
 @comments_router.route("/", methods=["GET"])
 @login_required
+@replica_router.read_only
+@shard_router.user_shard()
 def get_user_comments():
     try:
         user = current_user
@@ -60,12 +70,28 @@ def get_user_comments():
         if not user:
             return jsonify({"message": "User not found"}), 404
 
-        query = db.session.query(Comment).filter(user.id == Comment.author_id)
-        user_comments = query.all()
-        db.session.commit()
+        if "since" in request.args:
+            try:
+                since = parse_since(request.args["since"])
+            except ValueError as err:
+                return jsonify({"error": str(err)}), 400
+
+            version, rows, deleted = comments_delta(db.session, user.id, since)
+            return rows_response(rows, "comments", version=version, deleted=deleted), 200
+
+        if "limit" in request.args or "after" in request.args:
+            try:
+                after, limit = parse_page_args(request.args)
+            except ValueError as err:
+                return jsonify({"error": str(err)}), 400
+
+            rows, next_after = keyset_page(db.session, user_comments_statement(user.id), Comment.id, after, limit)
+            return rows_response(rows, "comments", next_after=next_after), 200
+
+        user_comments = db.session.execute(user_comments_statement(user.id)).all()
 
         if len(user_comments) > 0:
-            return jsonify([serialize_comment(comment) for comment in user_comments]), 200
+            return rows_response(user_comments), 200
         else:
             return jsonify({"message": "No comments to display"}), 200
 
@@ -77,19 +103,28 @@ def get_user_comments():
 # delete comment
 @comments_router.route("/<int:comment_id>", methods=['DELETE'])
 @login_required
+@shard_router.user_shard(write=True)
 def delete_comment(comment_id):
     try:
         user = current_user
         comment = Comment.query.get(comment_id)
 
-        if comment:
-            db.session.execute(db.delete(Comment).filter_by(author_id=user.id, id=comment.id))
-            db.session.commit()
-            return jsonify({"message": "Comment deleted."}), 200
-        else:
+        if not comment:
             return jsonify({"error": "Comment not found."}), 404
+        if comment.author_id != user.id:
+            return jsonify({"error": "Comment belongs to another user."}), 403
+
+        # the change version is taken only by a write that happens, a refused one leaves polls empty
+        version = db.session.execute(next_version_statement(db.session, user.id)).scalar()
+        deleted = db.session.execute(db.delete(Comment).filter_by(author_id=user.id, id=comment.id))
+        # a concurrent delete of the same comment already counted it
+        if deleted.rowcount:
+            db.session.execute(comment_count_statement(comment.movie_id, -1))
+            db.session.execute(tombstone_statement(db.session), tombstones(user.id, COMMENTS, [comment.id], version))
+        db.session.commit()
+        response_cache.invalidate_movie(comment.movie_id)
+        return jsonify({"message": "Comment deleted."}), 200
 
-        pass
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": str(e)}), 500
@@ -98,6 +133,7 @@ def delete_comment(comment_id):
 # edit comment
 @comments_router.route("/<int:comment_id>", methods=['PUT'])
 @login_required
+@shard_router.user_shard(write=True)
 def edit_comment(comment_id):
     try:
         data = request.get_json()
@@ -108,17 +144,21 @@ def edit_comment(comment_id):
         if "text" not in data or not data["text"].strip():
             return jsonify({"error": "Comment text is missing or empty"}), 400
 
-        if comment:
-            db.session.execute(
-                db.update(Comment)
-                .where(Comment.id == comment.id)
-                .where(Comment.author_id == user.id)
-                .values(text=text)
-            )
-            db.session.commit()
-            return jsonify({"message": "Comment successfully updated."}), 201
-        else:
+        if not comment:
             return jsonify({"error": "Comment not found."}), 404
+        if comment.author_id != user.id:
+            return jsonify({"error": "Comment belongs to another user."}), 403
+
+        version = db.session.execute(next_version_statement(db.session, user.id)).scalar()
+        db.session.execute(
+            db.update(Comment)
+            .where(Comment.id == comment.id)
+            .where(Comment.author_id == user.id)
+            .values(text=text, version=version)
+        )
+        db.session.commit()
+        response_cache.invalidate_movie(comment.movie_id)
+        return jsonify({"message": "Comment successfully updated."}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": str(e)}), 500
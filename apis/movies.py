@@ -1,72 +1,119 @@
-from flask import Blueprint, jsonify, request
-from sqlalchemy import func
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 from flask_login import login_required, current_user
-from utils.adapters import remove_special_characters
+from utils.adapters import str_to_bool
+from utils.pagination import parse_page_args, parse_offset_args, keyset_page, stream_ndjson
+from utils.search import search_movies
+from utils.ratings import apply_rating_change
+from utils.cache import response_cache
+from utils.changes import next_version_statement
+from utils.serializers import MOVIE_COLUMNS, MOVIE_DETAIL_COLUMNS, rows_response, rows_to_dicts
+from utils.batch import movies_with_comments, parse_id_list
+from utils.comments import first_comments, first_comments_of_movies, movie_comments_page
+from utils.leaderboards import (
+    TOP_RATED, TRENDING, TRENDING_WEIGHTS, board_movies, board_statement, epoch_statement, leaderboards
+)
+from utils.recommendations import (
+    interaction_weight, movies_statement, neighbors_statement, rank_neighbors, scored_movies, similarity_index
+)
+from utils.replicas import replica_router
+from utils.shards import shard_router
+from utils.suggest import title_suggestions
+from utils.write_behind import WriteBehindBusy, write_behind
 
 from database import db
 from models.movie import Movie
-from models.comment import Comment
 from models.user import user_movie
 
 movies_router = Blueprint("movies", __name__)
 
 
-def serialize_comment(comment):
-    return {
-        "id": comment.id,
-        "text": comment.text,
-        "author_id": comment.author_id
-    }
+def movie_list_cache_key():
+    # streamed listings are never cached, pages are cached per query string
+    if str_to_bool(request.args.get("stream")):
+        return None
+    return f"movies:{request.query_string.decode()}"
+
+
+def movie_cache_key(movie_id):
+    return f"movie:{movie_id}"
+
+
+def similar_movies_cache_key(movie_id):
+    return f"movie:{movie_id}:similar:{request.query_string.decode()}"
+
+
+def top_rated_cache_key():
+    # under "movies:", so the rating writes that invalidate a movie drop it too
+    return f"movies:top-rated:{request.query_string.decode()}"
+
+
+def movie_comments_cache_key(movie_id):
+    # under the movie's key prefix, so invalidate_movie drops the comment pages too
+    return f"movie:{movie_id}:comments:{request.query_string.decode()}"
 
 
 # get all movies
+# ?limit=&after= returns a keyset page, ?stream=true returns NDJSON rows streamed from the db cursor
+# ?ids=1,2,3 returns the details and first comments of those movies, in two queries whatever their number
+# (the comments one per shard)
 @movies_router.route("/", methods=['GET'])
+@response_cache.cached(movie_list_cache_key)
+@replica_router.read_only
 def get_all_movies():
     try:
-        all_movies = Movie.query.all()
+        if "ids" in request.args:
+            try:
+                movie_ids = parse_id_list(request.args["ids"])
+            except ValueError as err:
+                return jsonify({"error": str(err)}), 400
+
+            movies = db.session.execute(db.select(*MOVIE_DETAIL_COLUMNS).where(Movie.id.in_(movie_ids))).all()
+            comments = first_comments_of_movies(db.session, [movie.id for movie in movies]) if movies else []
+            found, not_found = movies_with_comments(movies, comments, movie_ids)
+            return jsonify({"movies": found, "not_found": not_found}), 200
 
-        movies_data = []
+        if str_to_bool(request.args.get("stream")):
+            statement = db.select(*MOVIE_COLUMNS).order_by(Movie.id)
+            after = request.args.get("after", type=int)
+            if after is not None:
+                statement = statement.where(Movie.id > after)
 
-        for movie in all_movies:
-            movie_data = {
-                "id": movie.id,
-                "title": movie.title,
-                "description": movie.description,
-                "rating": movie.rating,
-                "local_rating": movie.local_rating,
-                "img_url": movie.img_url
-            }
-            movies_data.append(movie_data)
+            return Response(
+                stream_with_context(stream_ndjson(db.session, statement)),
+                mimetype="application/x-ndjson"
+            )
 
-        return jsonify(movies_data), 200
+        if "limit" in request.args or "after" in request.args:
+            try:
+                after, limit = parse_page_args(request.args)
+            except ValueError as err:
+                return jsonify({"error": str(err)}), 400
+
+            rows, next_after = keyset_page(db.session, db.select(*MOVIE_COLUMNS), Movie.id, after, limit)
+            return rows_response(rows, "movies", next_after=next_after), 200
+
+        all_movies = db.session.execute(db.select(*MOVIE_COLUMNS)).all()
+
+        return rows_response(all_movies), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-# get single movie
+# get single movie with its comment count and first page of comments
 @movies_router.route("/<int:movie_id>", methods=['GET'])
+@response_cache.cached(movie_cache_key)
+@replica_router.read_only
 def get_single_movie(movie_id):
     try:
-        movie = Movie.query.get(movie_id)
+        movie = db.session.execute(db.select(*MOVIE_DETAIL_COLUMNS).where(Movie.id == movie_id)).first()
 
         if movie:
-            movie_data = {
-                "id": movie.id,
-                "title": movie.title,
-                "description": movie.description,
-                "rating": movie.rating,
-                "local_rating": movie.local_rating,
-                "img_url": movie.img_url
-
-            }
-            query = db.session.query(Comment).filter(Comment.movie_id == movie.id)
-            movie_comments = query.all()
-            db.session.commit()
+            movie_comments = first_comments(db.session, movie.id)
             if len(movie_comments) > 0:
-                return jsonify(movie_data, [serialize_comment(comment) for comment in movie_comments]), 200
+                return jsonify(movie._asdict(), rows_to_dicts(movie_comments)), 200
             else:
-                return jsonify(movie_data, {"message": "No comments to display"}), 200
+                return jsonify(movie._asdict(), {"message": "No comments to display"}), 200
 
         else:
             return jsonify({"error": "Movie not found"}), 404
@@ -75,22 +122,101 @@ def get_single_movie(movie_id):
         return jsonify({"error": str(e)}), 500
 
 
-# search for a movie
+# get a keyset page of movie's comments, ?after=<comment id>&limit=
+@movies_router.route("/<int:movie_id>/comments", methods=['GET'])
+@response_cache.cached(movie_comments_cache_key)
+@replica_router.read_only
+def get_movie_comments(movie_id):
+    try:
+        after, limit = parse_page_args(request.args)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    try:
+        rows, next_after = movie_comments_page(db.session, movie_id, after, limit)
+
+        if not rows and db.session.execute(db.select(Movie.id).where(Movie.id == movie_id)).first() is None:
+            return jsonify({"error": "Movie not found"}), 404
+
+        return rows_response(rows, "comments", next_after=next_after), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# movies most similar to this one, from the precomputed neighbors, ?limit= up to RECOMMENDATIONS_K
+@movies_router.route("/<int:movie_id>/similar", methods=['GET'])
+@response_cache.cached(similar_movies_cache_key)
+@replica_router.read_only
+def get_similar_movies(movie_id):
+    try:
+        limit = similarity_index.limit(request.args.get("limit"))
+        ranked = rank_neighbors(db.session.execute(neighbors_statement(movie_id)).all(), limit)
+
+        if ranked:
+            movies = db.session.execute(movies_statement([movie_id for movie_id, _ in ranked])).all()
+            return jsonify(scored_movies(movies, ranked)), 200
+        elif db.session.execute(db.select(Movie.id).where(Movie.id == movie_id)).first() is None:
+            return jsonify({"error": "Movie not found"}), 404
+        else:
+            return jsonify({"message": "No similar movies yet."}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# best rated movies with at least LEADERBOARD_MIN_VOTES ratings, ?limit= up to 100
+@movies_router.route("/top-rated", methods=['GET'])
+@response_cache.cached(top_rated_cache_key)
+@replica_router.read_only
+def get_top_rated_movies():
+    try:
+        rows = db.session.execute(board_statement(TOP_RATED, leaderboards.limit(request.args.get("limit")))).all()
+
+        if rows:
+            return jsonify(board_movies(rows)), 200
+        else:
+            return jsonify({"message": "No rated movies yet."}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# movies with the most watchlist activity lately, decayed by TRENDING_HALF_LIFE_HOURS, ?limit= up to 100
+# not cached, every watchlist write changes it
+@movies_router.route("/trending", methods=['GET'])
+@replica_router.read_only
+def get_trending_movies():
+    try:
+        rows = db.session.execute(board_statement(TRENDING, leaderboards.limit(request.args.get("limit")))).all()
+
+        if rows:
+            scale = leaderboards.trending_scale(db.session.execute(epoch_statement()).scalar())
+            return jsonify(board_movies(rows, scale)), 200
+        else:
+            return jsonify({"message": "No trending movies yet."}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# search for a movie, ranked by relevance
+# ?with_description=true also matches descriptions, ?limit=&offset= pages through the results
 @movies_router.route("/find", methods=['GET'])
+@replica_router.read_only
 def find_movie():
-    movie_input = remove_special_characters(request.args.get("movie_input"))
+    movie_input = request.args.get("movie_input")
+    with_description = bool(str_to_bool(request.args.get("with_description")))
 
     try:
-        movies = Movie.query.filter(func.lower(Movie.title).like(f"%{movie_input.lower()}%")).all()
-
-        if movies:
-            movie_data = [{
-                "id": movie.id,
-                "title": movie.title,
-                "description": movie.description,
-                "rating": movie.rating,
-                "local_rating": movie.local_rating,
-                "img_url": movie.img_url} for movie in movies]
+        offset, limit = parse_offset_args(request.args)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    try:
+        movie_data = search_movies(db.session, movie_input, with_description, limit, offset)
+
+        if movie_data:
             return jsonify(movie_data), 200
         else:
             return jsonify({"error": "Movie is not found"}), 404
@@ -100,9 +226,44 @@ def find_movie():
         return jsonify({"error": str(e)}), 500
 
 
+# titles starting with ?q=, best rated first, from the in-process prefix index, ?limit= up to 20
+@movies_router.route("/suggest", methods=['GET'])
+def suggest_movies():
+    query = request.args.get("q")
+
+    if not query or not query.strip():
+        return jsonify({"error": "Query is missing or empty"}), 400
+
+    try:
+        title_suggestions.refresh()
+        return jsonify(title_suggestions.suggest(query, title_suggestions.limit(request.args.get("limit")))), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# the write-behind queue is full or did not commit in time, the client should retry later
+def write_behind_busy_response(err):
+    response = jsonify({"error": str(err)})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+def queued_rating_response(outcome):
+    # outcome is None when WRITE_BEHIND_ACK=enqueue answers before the write is applied
+    if outcome is None:
+        return jsonify({"message": "Rating accepted."}), 202
+    if outcome.result == "not_found":
+        return jsonify({"error": "User or movie not found"}), 404
+    if outcome.result == "not_watched":
+        return jsonify({"error": "Movie is not watched yet."}), 400
+    return jsonify({"message": "Rating successfully added.", "average rating": outcome.local_rating}), 200
+
+
 # rate movie and update local_rating with average rating
 @movies_router.route("/<int:movie_id>", methods=['POST'])
 @login_required
+@shard_router.user_shard(write=True)
 def rate_movie(movie_id):
     try:
         data = request.get_json()
@@ -119,49 +280,40 @@ def rate_movie(movie_id):
         if not isinstance(rating, int) or rating < 1 or rating > 10:
             return jsonify({"error": "Rating must be an integer between 1 and 10"}), 400
 
-        # user can rate movie only if it is watched
-        is_already_watched = db.session.query(user_movie.c.watched).filter(
+        # user can rate movie only if it is watched, or a queued write marks it so
+        pending_watched = write_behind.pending_watched(user.id, movie_id)
+        relationship = db.session.query(user_movie.c.watched, user_movie.c.user_rating).filter(
             (user_movie.c.user_id == user.id) &
-            (user_movie.c.movie_id == movie_id) &
-            (user_movie.c.watched == True)
-        ).scalar()
+            (user_movie.c.movie_id == movie_id)
+        ).first()
 
-        if not is_already_watched:
+        if not relationship or not (relationship.watched or pending_watched):
             return jsonify({"error": "Movie is not watched yet."}), 400
 
+        if write_behind.enabled:
+            # end the read transaction first, the flusher's commit must not wait on it
+            db.session.rollback()
+            return queued_rating_response(write_behind.wait(write_behind.submit(user.id, movie_id, rating=rating)))
+
+        version = db.session.execute(next_version_statement(db.session, user.id)).scalar()
         db.session.execute(
             user_movie.update().where(
                 (user_movie.c.user_id == user.id) &
                 (user_movie.c.movie_id == movie_id)
-            ).values(user_rating=rating)
+            ).values(user_rating=rating, version=version)
         )
-        db.session.commit()
-
-        # get all ratings for the movie
-        ratings = db.session.query(user_movie.c.user_rating).filter(
-            (user_movie.c.movie_id == movie_id) &
-            (user_movie.c.user_rating.isnot(None))
-        ).all()
 
-        if not ratings:
-            return jsonify({"error": "No ratings found for this movie"}), 404
-
-        # calculate average rating
-        average_rating = db.session.query(func.avg(user_movie.c.user_rating)).filter(
-            (user_movie.c.movie_id == movie_id) &
-            (user_movie.c.user_rating.isnot(None))
-        ).scalar()
-
-        average_rating = round(average_rating, 1)
-        # update Movie table with average rating
-        db.session.execute(
-            db.update(Movie)
-            .where(Movie.id == movie_id)
-            .values(local_rating=average_rating)
-        )
+        # update running aggregates of the movie in the same transaction
+        average_rating = apply_rating_change(db.session, movie_id, relationship.user_rating, rating)
+        similarity_index.record(db.session, user.id, {movie_id: interaction_weight(relationship.user_rating)})
+        leaderboards.refresh_top_rated(db.session, [movie_id])
+        leaderboards.record_activity(db.session, {movie_id: TRENDING_WEIGHTS["rated"]})
 
         db.session.commit()
+        response_cache.invalidate_movie(movie_id)
         return jsonify({"message": "Rating successfully added.", "average rating": average_rating}), 200
+    except WriteBehindBusy as err:
+        return write_behind_busy_response(err)
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
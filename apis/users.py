@@ -1,22 +1,19 @@
 from flask import Blueprint, request, jsonify, flash, make_response
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_login import login_user, login_required, logout_user
+from flask_login import login_user, login_required, logout_user, current_user
 
 from database import db
 from models.user import User
+from utils.principal import principal_cache
+from utils.passwords import password_hasher, HasherBusy
 
 users_router = Blueprint("users", __name__)
 
 
-# convert InstrumentedList of SQLAlchemy objects into JSON
-def serialize_movie(movie):
-    return {
-        "id": movie.id,
-        "title": movie.title,
-        "description": movie.description,
-        "rating": movie.rating,
-        "img_url": movie.img_url
-    }
+# password hashing is refused when its queue is full, the client should retry later
+def hasher_busy_response(err):
+    response = jsonify({"error": str(err)})
+    response.headers["Retry-After"] = "1"
+    return response, 503
 
 
 # sign up
@@ -42,11 +39,10 @@ def create_user():
         response = make_response("Bad Request: Password cannot be empty", 400)
         return response
 
-    hash_and_salted_password = generate_password_hash(
-        password,
-        method='pbkdf2:sha256',
-        salt_length=8
-    )
+    try:
+        hash_and_salted_password = password_hasher.hash(password)
+    except HasherBusy as err:
+        return hasher_busy_response(err)
 
     # assemble  new user row
     new_user = User(
@@ -79,14 +75,24 @@ def login():
             flash("That username does not exist, please try again.", category="error")
             response = make_response("Bad Request: Username does not exist", 400)
             return response
-        elif not check_password_hash(user.password, password):
+        elif not password_hasher.verify(user.password, password):
             flash('Password incorrect, please try again.', category="error")
             response = make_response("Bad Request: Password incorrect", 400)
             return response
         else:
+            # upgrade hashes made with older parameters while the plain password is at hand
+            new_hash = password_hasher.rehash(user.password, password)
+            if new_hash:
+                user.password = new_hash
+                db.session.commit()
+
             login_user(user)
             return jsonify({"User user_id is logged in": user.id}), 201
+    except HasherBusy as err:
+        db.session.rollback()
+        return hasher_busy_response(err)
     except Exception as err:
+        db.session.rollback()
         return jsonify({"error": f"db error: '{err}'"}), 500
 
 
@@ -94,5 +100,40 @@ def login():
 @users_router.route("/logout", methods=["POST"])
 @login_required
 def logout():
+    principal_cache.evict(current_user.id)
     logout_user()
     return jsonify({"message": "Logged out successfully"}), 201
+
+
+# change password, sessions started with the old password are logged out
+@users_router.route("/password", methods=["PUT"])
+@login_required
+def change_password():
+    data = request.get_json()
+    old_password = data.get('old_password')
+    new_password = data.get('new_password')
+
+    if new_password is None or new_password.strip() == "":
+        response = make_response("Bad Request: Password cannot be empty", 400)
+        return response
+
+    try:
+        user = current_user.orm_user
+
+        if old_password is None or not password_hasher.verify(user.password, old_password):
+            response = make_response("Bad Request: Password incorrect", 400)
+            return response
+
+        user.password = password_hasher.hash(new_password)
+        user.session_version += 1
+        db.session.commit()
+
+        principal_cache.evict(user.id)
+        login_user(user)
+        return jsonify({"message": "Password changed"}), 200
+    except HasherBusy as err:
+        db.session.rollback()
+        return hasher_busy_response(err)
+    except Exception as err:
+        db.session.rollback()
+        return jsonify({"error": f"db error: '{err}'"}), 500
@@ -1,8 +1,25 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy import and_, insert
 
 from utils.adapters import str_to_bool
+from utils.ratings import apply_rating_change
+from utils.cache import response_cache
+from utils.changes import (
+    WATCHLIST, clear_tombstones_statement, next_version_statement, parse_since, tombstone_statement, tombstones,
+    watchlist_delta
+)
+from utils.serializers import rows_response
+from utils.watchlist import (
+    MAX_BATCH_SIZE, batch_results, existing_movies_statement, parse_batch_items, plan_watchlist_changes,
+    relationships_statement, similarity_changes, trending_events, watchlist_rows, watchlist_upsert_statement
+)
+from utils.leaderboards import TRENDING_WEIGHTS, leaderboards
+from utils.recommendations import (
+    interaction_weight, movies_statement, rank_recommendations, scored_movies, similarity_index
+)
+from utils.replicas import replica_router
+from utils.shards import shard_router
+from utils.write_behind import WriteBehindBusy, write_behind
 from database import db
 from models.movie import Movie
 from models.user import user_movie
@@ -10,39 +27,32 @@ from models.user import user_movie
 watchlist_router = Blueprint("watchlist", __name__)
 
 
-# convert InstrumentedList of SQLAlchemy objects into JSON
-def serialize_movie(movie):
-    return {
-        "id": movie.id,
-        "title": movie.title,
-        "description": movie.description,
-        "rating": movie.rating,
-        "local_rating": movie.local_rating,
-        "img_url": movie.img_url
-    }
-
-
 # get the list of user's movies
+# ?since=<version> returns only the entries written and the movie ids deleted after that version, with the new one
 @watchlist_router.route("/", methods=['GET'])
 @login_required
+@replica_router.read_only
+@shard_router.user_shard()
 def get_user_watchlist():
     try:
+        if "since" in request.args:
+            try:
+                since = parse_since(request.args["since"])
+            except ValueError as err:
+                return jsonify({"error": str(err)}), 400
+
+            version, entries, deleted = watchlist_delta(db.session, current_user.id, since)
+            return jsonify({"version": version, "watchlist": entries, "deleted": deleted}), 200
+
         # accept optional watched query param and parse it into bool
         is_watched = str_to_bool(request.args.get("watched"))
 
         user = current_user
 
-        query = db.session.query(Movie).join(user_movie).filter(
-            user_movie.c.user_id == user.id
-        )
-
-        if is_watched is not None:
-            query = query.filter(and_(user_movie.c.watched == is_watched))
-
-        user_watchlist = query.all()
+        user_watchlist = watchlist_rows(db.session, user.id, is_watched)
 
         if len(user_watchlist) > 0:
-            return jsonify([serialize_movie(movie) for movie in user_watchlist]), 200
+            return rows_response(user_watchlist), 200
         else:
             return jsonify({"message": "No movies in watchlist."}), 200
 
@@ -50,39 +60,85 @@ def get_user_watchlist():
         return jsonify({"error": f"db error: '{err}'"}), 500
 
 
+# "because you watched": movies similar to the user's watchlist, ?limit= up to RECOMMENDATIONS_K
+@watchlist_router.route("/recommendations", methods=['GET'])
+@login_required
+@replica_router.read_only
+@shard_router.user_shard()
+def get_recommendations():
+    try:
+        user = current_user
+        limit = similarity_index.limit(request.args.get("limit"))
+        ranked = rank_recommendations(similarity_index.user_neighbors(db.session, user.id), limit)
+
+        if ranked:
+            movies = db.session.execute(movies_statement([movie_id for movie_id, _ in ranked])).all()
+            return jsonify(scored_movies(movies, ranked)), 200
+        else:
+            return jsonify({"message": "No recommendations yet."}), 200
+
+    except Exception as err:
+        return jsonify({"error": f"db error: '{err}'"}), 500
+
+
+def apply_watchlist_changes(user_id, changes):
+    """
+    Adds movies to the user's watchlist or updates their watched flag, set-based.
+
+    Reads the existing movies and watchlist rows for all ids in one query each, then writes every row
+    with a single multi-row INSERT ... ON CONFLICT (user_id, movie_id) DO UPDATE. Does not commit.
+
+    :param changes: dict of movie_id -> watched
+    :return: (dict of movie_id -> "added" | "updated" | "not_found", list of movie ids whose rating was dropped)
+    """
+    movie_ids = list(changes)
+    existing_movies = set(db.session.execute(existing_movies_statement(movie_ids)).scalars())
+    current = db.session.execute(relationships_statement(user_id, movie_ids)).all()
+    relationships = {row.movie_id: row.user_rating for row in current}
+    watched_before = {row.movie_id for row in current if row.watched}
+
+    results, rows, ratings_removed = plan_watchlist_changes(user_id, changes, existing_movies, relationships)
+
+    if rows:
+        version = db.session.execute(next_version_statement(db.session, user_id)).scalar()
+        rows = [{**row, "version": version} for row in rows]
+
+    for movie_id, old_rating in ratings_removed.items():
+        apply_rating_change(db.session, movie_id, old_rating, None)
+    leaderboards.refresh_top_rated(db.session, list(ratings_removed))
+
+    if rows:
+        db.session.execute(watchlist_upsert_statement(db.session), rows)
+        db.session.execute(clear_tombstones_statement(user_id, WATCHLIST, [row["movie_id"] for row in rows]))
+        similarity_index.record(db.session, user_id, similarity_changes(results, ratings_removed))
+        leaderboards.record_activity(db.session, trending_events(changes, results, watched_before))
+
+    return results, list(ratings_removed)
+
+
 # add movie to 'watchlist'
 @watchlist_router.route("/", methods=["POST"])
 @login_required
+@shard_router.user_shard(write=True)
 def add_to_watchlist():
     try:
         data = request.get_json()
-        movie_id = data['movie_id']
+        movie_id = int(data['movie_id'])
         watched = data['watched']
 
         user = current_user
-        movie = Movie.query.get(movie_id)
 
         if user is None:
             return jsonify({"error": "User is not found"}), 404
-        if movie is None:
-            return jsonify({"error": "Movie is not found"}), 404
 
-        if movie in user.watchlist:
-            query = (user_movie.update().
-            where(user_movie.c.user_id == user.id).
-            where(user_movie.c.movie_id == movie_id).
-            values(
-                watched=watched
-            ))
-        else:
-            query = insert(user_movie).values(
-                user_id=user.id,
-                movie_id=movie_id,
-                watched=watched
-            )
+        results, ratings_removed = apply_watchlist_changes(user.id, {movie_id: watched})
+
+        if results[movie_id] == "not_found":
+            return jsonify({"error": "Movie is not found"}), 404
 
-        db.session.execute(query)
         db.session.commit()
+        for removed_movie_id in ratings_removed:
+            response_cache.invalidate_movie(removed_movie_id)
 
         return jsonify({"message": "Movie added to watchlist."}), 201
 
@@ -91,9 +147,39 @@ def add_to_watchlist():
         return jsonify({"error": str(e)}), 500
 
 
+# add or update many movies of the watchlist at once
+# body: {"items": [{"movie_id": 1, "watched": true}, ...]}, later items win for repeated movie ids
+@watchlist_router.route("/batch", methods=["POST"])
+@login_required
+@shard_router.user_shard(write=True)
+def batch_update_watchlist():
+    try:
+        data = request.get_json()
+        items = data.get("items") if isinstance(data, dict) else None
+
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "Items are missing or empty"}), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"At most {MAX_BATCH_SIZE} items per batch"}), 400
+
+        changes, invalid = parse_batch_items(items)
+
+        results, ratings_removed = apply_watchlist_changes(current_user.id, changes) if changes else ({}, [])
+        db.session.commit()
+        for removed_movie_id in ratings_removed:
+            response_cache.invalidate_movie(removed_movie_id)
+
+        return jsonify({"results": batch_results(items, invalid, results)}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
 # delete movie from watchlist
 @watchlist_router.route("/<int:movie_id>", methods=['DELETE'])
 @login_required
+@shard_router.user_shard(write=True)
 def delete_from_watchlist(movie_id):
     try:
         user = current_user
@@ -103,8 +189,18 @@ def delete_from_watchlist(movie_id):
             relationship = db.session.query(user_movie).filter_by(user_id=user.id, movie_id=movie_id).first()
 
             if relationship:
+                version = db.session.execute(next_version_statement(db.session, user.id)).scalar()
                 db.session.execute(db.delete(user_movie).filter_by(user_id=user.id, movie_id=movie_id))
+                db.session.execute(
+                    tombstone_statement(db.session), tombstones(user.id, WATCHLIST, [movie_id], version)
+                )
+                apply_rating_change(db.session, movie_id, relationship.user_rating, None)
+                similarity_index.record(db.session, user.id, {movie_id: interaction_weight(relationship.user_rating)})
+                if relationship.user_rating is not None:
+                    leaderboards.refresh_top_rated(db.session, [movie_id])
                 db.session.commit()
+                if relationship.user_rating is not None:
+                    response_cache.invalidate_movie(movie_id)
                 return jsonify({"message": "Movie deleted from watchlist"}), 200
             else:
                 return jsonify({"error": "Movie not found in watchlist"}), 404
@@ -112,9 +208,26 @@ def delete_from_watchlist(movie_id):
         return jsonify({"error": f"db error: '{err}'"}), 500
 
 
+# the write-behind queue is full or did not commit in time, the client should retry later
+def write_behind_busy_response(err):
+    response = jsonify({"error": str(err)})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+def queued_status_response(outcome):
+    # outcome is None when WRITE_BEHIND_ACK=enqueue answers before the write is applied
+    if outcome is None:
+        return jsonify({"message": "Status change accepted."}), 202
+    if outcome.result == "not_found":
+        return jsonify({"message": "Movie not found in watchlist"}), 404
+    return jsonify({"message": "Movie is marked as watched."}), 200
+
+
 # change movie status from 'watch later' to 'already watched'
 @watchlist_router.route("/<int:movie_id>", methods=["PUT"])
 @login_required
+@shard_router.user_shard(write=True)
 def change_movie_status(movie_id):
     try:
         movie = Movie.query.get(movie_id)
@@ -132,19 +245,28 @@ def change_movie_status(movie_id):
                 (user_movie.c.watched == True)  # Check if it's already True
             ).scalar()
 
-            if not is_already_watched:
+            if write_behind.enabled and not (is_already_watched or write_behind.pending_watched(user.id, movie_id)):
+                # end the read transaction first, the flusher's commit must not wait on it
+                db.session.rollback()
+                return queued_status_response(write_behind.wait(write_behind.submit(user.id, movie_id, watched=True)))
+
+            if not is_already_watched and not write_behind.enabled:
+                version = db.session.execute(next_version_statement(db.session, user.id)).scalar()
                 update_statement = user_movie.update().where(
                     (user_movie.c.user_id == user.id) &
                     (user_movie.c.movie_id == movie_id)
-                ).values(watched=True)
+                ).values(watched=True, version=version)
 
                 db.session.execute(update_statement)
+                leaderboards.record_activity(db.session, {movie_id: TRENDING_WEIGHTS["watched"]})
                 db.session.commit()
             else:
                 return jsonify({"message": "The movie is already marked as watched."}), 400
 
         return jsonify({"message": "Movie is marked as watched."}), 200
 
+    except WriteBehindBusy as err:
+        return write_behind_busy_response(err)
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": str(e)}), 500
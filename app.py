@@ -1,58 +1,127 @@
 import os
-from dotenv import load_dotenv
 
-from flask import Flask, render_template
+from flask import Flask, jsonify, render_template
 from flask_login import LoginManager
 
 from database import db
 from models.user import User
 from models.comment import Comment
 from models.movie import Movie
+from models.seed_checkpoint import SeedCheckpoint
 
 from apis.users import users_router
 from apis.movies import movies_router
 from apis.comments import comments_router
 from apis.watchlist import watchlist_router
+from apis.batch import batch_router
+
+from commands.data import data_cli
+from commands.leaderboards import leaderboards_cli
+from commands.ratings import ratings_cli
+from commands.recommendations import recommendations_cli
+from commands.schema import schema_cli
+from commands.seed import seed_cli
+from commands.shards import shards_cli
+from config import load_config, shard_uris
+from migrations import check_schema
+from utils.cache import response_cache
+from utils.leaderboards import leaderboards
+from utils.metrics import request_metrics
+from utils.principal import principal_cache
+from utils.recommendations import similarity_index
+from utils.replicas import replica_router
+from utils.passwords import password_hasher
+from utils.serializers import FastJSONProvider
+from utils.shards import shard_router
+from utils.slow_queries import slow_query_log
+from utils.suggest import title_suggestions
+from utils.write_behind import write_behind
 
 if os.environ.get("FLASK_ENV") == "development":
+    from dotenv import load_dotenv
     load_dotenv()
 
 
 def create_app():
     """
     Initializes DB connection, creates an app instance, registers service routers, and returns app instance.
+    Importing this module builds nothing, servers call the factory, e.g. gunicorn "app:create_app()".
 
     :return: Flask
     """
     app = Flask(__name__)
-    app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URI")
-    app.config['DEBUG'] = os.environ.get("DEBUG")
-    app.app_context().push()
+    load_config(app.config)
+
+    # orjson backed JSON encoding when it is installed
+    app.json = FastJSONProvider(app)
+
+    # Init per-request SQL instrumentation, before any DB connection is opened
+    request_metrics.init_app(app)
+    slow_query_log.init_app(app)
 
     # Init DB connection
     db.init_app(app)
     with app.app_context():
-        db.create_all()
+        check_schema(db.engine, app.config["SCHEMA_ON_START"])
+        shard_engines = {key: db.engines[key] for key in shard_uris(app.config)}
+        for engine in shard_engines.values():
+            check_schema(engine, app.config["SCHEMA_ON_START"], shard=True)
+        # Route the per-user tables to the shards of DATABASE_SHARD_URIS
+        shard_router.init_app(app, db.engine, shard_engines)
+        # Batch rating and watched writes on a flusher thread when WRITE_BEHIND is on
+        write_behind.init_app(app, db.engine)
+        # Title autocomplete, its index is built by the first /movies/suggest lookup
+        title_suggestions.init_app(app, db.engine)
+
+    # Route the read-only handlers to the replicas of DATABASE_REPLICA_URIS
+    replica_router.init_app(app)
+
+    # Init response cache of movie read endpoints
+    response_cache.init_app(app)
 
     login_manager = LoginManager()
     login_manager.init_app(app)
+    principal_cache.init_app(app)
+    password_hasher.init_app(app)
+    similarity_index.init_app(app)
+    leaderboards.init_app(app)
 
+    # resolves the session to a cached principal, the User row is only loaded when a handler needs it
     @login_manager.user_loader
     def load_user(user_id):
-        return db.get_or_404(User, user_id)
+        return principal_cache.load(user_id)
 
     # Register routes
     app.register_blueprint(users_router, url_prefix='/users')
     app.register_blueprint(movies_router, url_prefix='/movies')
     app.register_blueprint(comments_router, url_prefix='/comments')
     app.register_blueprint(watchlist_router, url_prefix='/watchlist')
+    app.register_blueprint(batch_router, url_prefix='/batch')
+
+    # Register CLI commands
+    app.cli.add_command(ratings_cli)
+    app.cli.add_command(schema_cli)
+    app.cli.add_command(seed_cli)
+    app.cli.add_command(recommendations_cli)
+    app.cli.add_command(leaderboards_cli)
+    app.cli.add_command(data_cli)
+    app.cli.add_command(shards_cli)
 
     @app.route('/', methods=['GET'])
     def home():
         return "Home page."
 
-    return app
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return request_metrics.render()
+
+    @app.route('/cache/stats', methods=['GET'])
+    def cache_stats():
+        return jsonify(response_cache.stats()), 200
 
+    @app.route('/queries/slow', methods=['GET'])
+    def slow_queries():
+        return jsonify(slow_query_log.report()), 200
+
+    return app
 
-service = create_app()
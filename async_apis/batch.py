@@ -0,0 +1,86 @@
+import json
+from urllib.parse import urlsplit
+
+from async_apis.common import JSON_MIMETYPE, json_response
+from utils.batch import FORWARDED_HEADERS, cookie_header, parse_batch_requests, update_cookies
+
+
+async def dispatch(request, method, path, body, cookies):
+    """
+    Runs one sub-request through the ASGI app in process.
+
+    :return: (status, list of (name, value) response headers, body bytes)
+    """
+    url = urlsplit(path)
+    content = json.dumps(body).encode() if body is not None and method != "GET" else b""
+    headers = [(b"host", request.headers.get("host", "localhost").encode())]
+    if content:
+        headers += [(b"content-type", JSON_MIMETYPE.encode()), (b"content-length", str(len(content)).encode())]
+    if cookies:
+        headers.append((b"cookie", cookie_header(cookies).encode()))
+
+    scope = {
+        **{key: value for key, value in request.scope.items() if key in ("asgi", "http_version", "scheme", "server",
+                                                                           "client", "root_path", "state")},
+        "type": "http",
+        "method": method,
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers
+    }
+    messages = [{"type": "http.request", "body": content, "more_body": False}]
+    sent = {"status": 500, "headers": [], "body": []}
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+            sent["headers"] = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in message["headers"]]
+        elif message["type"] == "http.response.body":
+            sent["body"].append(message.get("body", b""))
+
+    await request.app(scope, receive, send)
+    return sent["status"], sent["headers"], b"".join(sent["body"])
+
+
+def sub_response(status, headers, body):
+    content_type = next((value for name, value in headers if name.lower() == "content-type"), "")
+    forwarded = {name.lower(): name for name in FORWARDED_HEADERS}
+    return {
+        "status": status,
+        "headers": {forwarded[name.lower()]: value for name, value in headers if name.lower() in forwarded},
+        "body": json.loads(body) if content_type.startswith(JSON_MIMETYPE) and body else body.decode()
+    }
+
+
+# run several API requests in one round trip, see apis.batch
+# each sub-request runs through the app in process with its own session, the client pays one round trip
+async def run_requests(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    try:
+        requests = parse_batch_requests(data)
+    except ValueError as err:
+        return json_response(request, {"error": str(err)}, 400)
+
+    cookies = dict(request.cookies)
+    set_cookies = []
+    results = []
+    for method, path, body in requests:
+        status, headers, content = await dispatch(request, method, path, body, cookies)
+        results.append(sub_response(status, headers, content))
+
+        headers_set = [value for name, value in headers if name.lower() == "set-cookie"]
+        update_cookies(cookies, headers_set)
+        set_cookies.extend(headers_set)
+
+    response = json_response(request, {"responses": results})
+    for header in set_cookies:
+        response.headers.append("set-cookie", header)
+    return response
@@ -0,0 +1,158 @@
+from sqlalchemy import delete, select, update
+from starlette.routing import Route
+
+from async_apis.common import json_response, login_required, rows_response, user_shard
+from models.comment import Comment
+from models.movie import Movie
+from utils.cache import response_cache
+from utils.changes import (
+    COMMENTS, comments_delta_async, next_version_statement, parse_since, tombstone_statement, tombstones
+)
+from utils.comments import comment_count_statement, user_comments_statement
+from utils.pagination import keyset_statement, parse_page_args, split_page
+from utils.shards import COMMENT_IDS, next_id_statement, shard_router
+
+
+# add comment
+@login_required
+@user_shard(write=True)
+async def leave_comment(request, session, user):
+    try:
+        data = await request.json()
+
+        if "text" not in data or not data["text"].strip():
+            return json_response(request, {"error": "Comment text is missing or empty"}, 400)
+
+        movie_id = data["movie_id"]
+        text = data["text"]
+        movie = (await session.execute(select(Movie.id).where(Movie.id == movie_id))).first()
+
+        if not movie:
+            return json_response(request, {"message": "User or movie not found"}, 404)
+
+        # ids stay unique across shards, each comment takes the next one of the primary's allocation
+        comment_id = (await session.execute(next_id_statement(COMMENT_IDS))).scalar() if shard_router.enabled else None
+        version = (await session.execute(next_version_statement(session, user.id))).scalar()
+        session.add(Comment(id=comment_id, text=text, author_id=user.id, movie_id=movie.id, version=version))
+        await session.execute(comment_count_statement(movie.id, 1))
+        await session.commit()
+        response_cache.invalidate_movie(movie_id)
+
+        return json_response(request, {"message": "Comment is added."}, 201)
+
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"message": str(e)}, 500)
+
+
+# get all user's comments
+# ?limit=&after= returns a keyset page
+# ?since=<version> returns only the comments written and the comment ids deleted after that version, with the new one
+@login_required
+@user_shard()
+async def get_user_comments(request, session, user):
+    args = request.query_params
+    try:
+        if "since" in args:
+            try:
+                since = parse_since(args["since"])
+            except ValueError as err:
+                return json_response(request, {"error": str(err)}, 400)
+
+            version, rows, deleted = await comments_delta_async(session, user.id, since)
+            return rows_response(request, rows, "comments", version=version, deleted=deleted)
+
+        if "limit" in args or "after" in args:
+            try:
+                after, limit = parse_page_args(args)
+            except ValueError as err:
+                return json_response(request, {"error": str(err)}, 400)
+
+            statement = keyset_statement(user_comments_statement(user.id), Comment.id, after, limit)
+            rows, next_after = split_page((await session.execute(statement)).all(), Comment.id, limit)
+            return rows_response(request, rows, "comments", next_after=next_after)
+
+        user_comments = (await session.execute(user_comments_statement(user.id))).all()
+
+        if len(user_comments) > 0:
+            return rows_response(request, user_comments)
+        else:
+            return json_response(request, {"message": "No comments to display"})
+
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"message": str(e)}, 500)
+
+
+# delete comment
+@login_required
+@user_shard(write=True)
+async def delete_comment(request, session, user):
+    comment_id = request.path_params["comment_id"]
+    try:
+        comment = (await session.execute(
+            select(Comment.id, Comment.movie_id, Comment.author_id).where(Comment.id == comment_id)
+        )).first()
+
+        if not comment:
+            return json_response(request, {"error": "Comment not found."}, 404)
+        if comment.author_id != user.id:
+            return json_response(request, {"error": "Comment belongs to another user."}, 403)
+
+        # the change version is taken only by a write that happens, a refused one leaves polls empty
+        version = (await session.execute(next_version_statement(session, user.id))).scalar()
+        deleted = await session.execute(delete(Comment).filter_by(author_id=user.id, id=comment.id))
+        # a concurrent delete of the same comment already counted it
+        if deleted.rowcount:
+            await session.execute(comment_count_statement(comment.movie_id, -1))
+            await session.execute(tombstone_statement(session), tombstones(user.id, COMMENTS, [comment.id], version))
+        await session.commit()
+        response_cache.invalidate_movie(comment.movie_id)
+        return json_response(request, {"message": "Comment deleted."})
+
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"message": str(e)}, 500)
+
+
+# edit comment
+@login_required
+@user_shard(write=True)
+async def edit_comment(request, session, user):
+    comment_id = request.path_params["comment_id"]
+    try:
+        data = await request.json()
+        comment = (await session.execute(
+            select(Comment.id, Comment.movie_id, Comment.author_id).where(Comment.id == comment_id)
+        )).first()
+        text = data["text"]
+
+        if "text" not in data or not data["text"].strip():
+            return json_response(request, {"error": "Comment text is missing or empty"}, 400)
+
+        if not comment:
+            return json_response(request, {"error": "Comment not found."}, 404)
+        if comment.author_id != user.id:
+            return json_response(request, {"error": "Comment belongs to another user."}, 403)
+
+        version = (await session.execute(next_version_statement(session, user.id))).scalar()
+        await session.execute(
+            update(Comment)
+            .where(Comment.id == comment.id)
+            .where(Comment.author_id == user.id)
+            .values(text=text, version=version)
+        )
+        await session.commit()
+        response_cache.invalidate_movie(comment.movie_id)
+        return json_response(request, {"message": "Comment successfully updated."}, 201)
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"message": str(e)}, 500)
+
+
+routes = [
+    Route("/", leave_comment, methods=["POST"]),
+    Route("/", get_user_comments, methods=["GET"]),
+    Route("/{comment_id:int}", delete_comment, methods=["DELETE"]),
+    Route("/{comment_id:int}", edit_comment, methods=["PUT"])
+]
@@ -0,0 +1,168 @@
+from functools import wraps
+
+from itsdangerous import BadSignature
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from werkzeug.exceptions import Unauthorized
+from werkzeug.http import parse_etags
+
+from models.user import session_id
+from utils.cache import response_cache
+from utils.principal import principal_cache
+from utils.shards import ShardMoving, shard_router
+
+JSON_MIMETYPE = "application/json"
+
+
+def json_response(request, data, status=200):
+    return Response(request.app.state.json.dumps(data) + b"\n", status_code=status, media_type=JSON_MIMETYPE)
+
+
+def rows_response(request, rows, key=None, status=200, **fields):
+    body = request.app.state.json.encode_rows(rows, key, **fields)
+    return Response(body + b"\n", status_code=status, media_type=JSON_MIMETYPE)
+
+
+def text_response(text, status):
+    # what flask.make_response does with a string
+    return Response(text, status_code=status, media_type="text/html")
+
+
+# the login session is the Flask signed cookie, so a session started on either app works on the other
+def load_session(request):
+    settings = request.app.state.settings
+    cookie = request.cookies.get(settings.config["SESSION_COOKIE_NAME"])
+    serializer = request.app.state.session_serializer
+    if not cookie or serializer is None:
+        return {}
+
+    try:
+        return serializer.loads(cookie, max_age=int(settings.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+def save_session(request, response, session):
+    settings = request.app.state.settings
+    serializer = request.app.state.session_serializer
+    if serializer is None:
+        raise RuntimeError("The session is unavailable because no secret key was set.")
+
+    response.set_cookie(
+        settings.config["SESSION_COOKIE_NAME"],
+        serializer.dumps(session),
+        path=settings.config["SESSION_COOKIE_PATH"] or "/",
+        domain=settings.config["SESSION_COOKIE_DOMAIN"] or None,
+        secure=settings.config["SESSION_COOKIE_SECURE"],
+        httponly=settings.config["SESSION_COOKIE_HTTPONLY"],
+        samesite=settings.config["SESSION_COOKIE_SAMESITE"]
+    )
+
+
+def login_user(request, response, user):
+    session = load_session(request)
+    session["_user_id"] = session_id(user.id, user.session_version)
+    session["_fresh"] = True
+    save_session(request, response, session)
+
+
+def logout_user(request, response):
+    session = load_session(request)
+    for key in ("_user_id", "_fresh", "_id"):
+        session.pop(key, None)
+    save_session(request, response, session)
+
+
+async def current_user(request, session):
+    """
+    :return: UserPrincipal of the login session, or None
+    """
+    value = load_session(request).get("_user_id")
+    if value is None:
+        return None
+    return await principal_cache.load_async(value, session)
+
+
+def with_session(handler):
+    """
+    Passes an AsyncSession to the handler, closed (and rolled back unless committed) once it returns.
+    """
+
+    @wraps(handler)
+    async def wrapper(request):
+        async with request.app.state.db() as session:
+            return await handler(request, session)
+
+    return wrapper
+
+
+def login_required(handler):
+    """
+    with_session, plus the logged in UserPrincipal as third argument. Answers 401 without a login.
+    """
+
+    @wraps(handler)
+    async def wrapper(request):
+        async with request.app.state.db() as session:
+            user = await current_user(request, session)
+            if user is None:
+                return Response(Unauthorized().get_body(), status_code=401, media_type="text/html")
+            return await handler(request, session, user)
+
+    return wrapper
+
+
+def user_shard(write=False):
+    """
+    shard_router.user_shard for ASGI handlers: routes the per-user tables to the logged in user's shard,
+    with write=True answers 503 while the user's bucket is being moved. Goes below login_required.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request, session, user):
+            if shard_router.refresh_due():
+                # the bucket map is read with the sync engine, off the event loop
+                await run_in_threadpool(shard_router.bucket_map)
+            try:
+                shard_router.use(user.id, write)
+            except ShardMoving as err:
+                response = json_response(request, {"error": str(err)}, 503)
+                response.headers["Retry-After"] = shard_router.retry_after()
+                return response
+            return await handler(request, session, user)
+
+        return wrapper
+
+    return decorator
+
+
+def cached(key_func):
+    """
+    response_cache.cached for ASGI handlers: same keys, entries and ETags as the WSGI views.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            key = key_func(request) if response_cache.backend is not None else None
+            entry = response_cache.lookup(key)
+
+            if entry is not None:
+                body, status, mimetype, etag = entry.body, entry.status, entry.mimetype, entry.etag
+            else:
+                generation = response_cache.generation(key)
+                response = await handler(request)
+                if response.status_code != 200 or isinstance(response, StreamingResponse):
+                    return response
+                body, status, mimetype = response.body, response.status_code, response.media_type
+                etag = response_cache.store(key, body, status, mimetype, generation)
+
+            headers = {"ETag": f'"{etag}"'}
+            if parse_etags(request.headers.get("if-none-match")).contains(etag):
+                return Response(status_code=304, headers=headers)
+            return Response(body, status_code=status, media_type=mimetype, headers=headers)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,335 @@
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+from async_apis.common import cached, json_response, login_required, rows_response, user_shard, with_session
+from models.movie import Movie
+from models.user import user_movie
+from utils.adapters import str_to_bool
+from utils.cache import response_cache
+from utils.changes import next_version_statement
+from utils.pagination import (
+    keyset_statement, parse_offset_args, parse_page_args, split_page, stream_ndjson_async
+)
+from utils.leaderboards import (
+    TOP_RATED, TRENDING, TRENDING_WEIGHTS, board_movies, board_statement, epoch_statement, leaderboards
+)
+from utils.ratings import as_rating, rating_change_statement
+from utils.recommendations import (
+    interaction_weight, movies_statement, neighbors_statement, rank_neighbors, scored_movies, similarity_index
+)
+from utils.search import search_statement
+from utils.batch import movies_with_comments, parse_id_list
+from utils.comments import first_comments_async, first_comments_of_movies_async, movie_comments_page_async
+from utils.suggest import title_suggestions
+from utils.serializers import MOVIE_COLUMNS, MOVIE_DETAIL_COLUMNS, rows_to_dicts
+from utils.write_behind import WriteBehindBusy, write_behind
+
+
+def movie_list_cache_key(request):
+    # streamed listings are never cached, pages are cached per query string
+    if str_to_bool(request.query_params.get("stream")):
+        return None
+    return f"movies:{request.url.query}"
+
+
+def movie_cache_key(request):
+    return f"movie:{request.path_params['movie_id']}"
+
+
+def similar_movies_cache_key(request):
+    return f"movie:{request.path_params['movie_id']}:similar:{request.url.query}"
+
+
+def top_rated_cache_key(request):
+    return f"movies:top-rated:{request.url.query}"
+
+
+def movie_comments_cache_key(request):
+    return f"movie:{request.path_params['movie_id']}:comments:{request.url.query}"
+
+
+# get all movies
+# ?limit=&after= returns a keyset page, ?stream=true returns NDJSON rows streamed from the db cursor
+# ?ids=1,2,3 returns the details and first comments of those movies, in two queries whatever their number
+# (the comments one per shard)
+@cached(movie_list_cache_key)
+@with_session
+async def get_all_movies(request, session):
+    args = request.query_params
+    try:
+        if "ids" in args:
+            try:
+                movie_ids = parse_id_list(args["ids"])
+            except ValueError as err:
+                return json_response(request, {"error": str(err)}, 400)
+
+            movies = (await session.execute(select(*MOVIE_DETAIL_COLUMNS).where(Movie.id.in_(movie_ids)))).all()
+            comments = await first_comments_of_movies_async(session, [movie.id for movie in movies]) if movies else []
+            found, not_found = movies_with_comments(movies, comments, movie_ids)
+            return json_response(request, {"movies": found, "not_found": not_found})
+
+        if str_to_bool(args.get("stream")):
+            statement = select(*MOVIE_COLUMNS).order_by(Movie.id)
+            # like request.args.get("after", type=int), a malformed value is ignored
+            try:
+                statement = statement.where(Movie.id > int(args["after"]))
+            except (KeyError, ValueError):
+                pass
+
+            return StreamingResponse(
+                stream_ndjson_async(request.app.state.db, statement, request.app.state.json),
+                media_type="application/x-ndjson"
+            )
+
+        if "limit" in args or "after" in args:
+            try:
+                after, limit = parse_page_args(args)
+            except ValueError as err:
+                return json_response(request, {"error": str(err)}, 400)
+
+            result = await session.execute(keyset_statement(select(*MOVIE_COLUMNS), Movie.id, after, limit))
+            rows, next_after = split_page(result.all(), Movie.id, limit)
+            return rows_response(request, rows, "movies", next_after=next_after)
+
+        all_movies = (await session.execute(select(*MOVIE_COLUMNS))).all()
+
+        return rows_response(request, all_movies)
+
+    except Exception as e:
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# get single movie with its comment count and first page of comments
+@cached(movie_cache_key)
+@with_session
+async def get_single_movie(request, session):
+    movie_id = request.path_params["movie_id"]
+    try:
+        movie = (await session.execute(select(*MOVIE_DETAIL_COLUMNS).where(Movie.id == movie_id))).first()
+
+        if movie:
+            movie_comments = await first_comments_async(session, movie.id)
+            if len(movie_comments) > 0:
+                return json_response(request, [movie._asdict(), rows_to_dicts(movie_comments)])
+            else:
+                return json_response(request, [movie._asdict(), {"message": "No comments to display"}])
+
+        else:
+            return json_response(request, {"error": "Movie not found"}, 404)
+
+    except Exception as e:
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# get a keyset page of movie's comments, ?after=<comment id>&limit=
+@cached(movie_comments_cache_key)
+@with_session
+async def get_movie_comments(request, session):
+    movie_id = request.path_params["movie_id"]
+    try:
+        after, limit = parse_page_args(request.query_params)
+    except ValueError as err:
+        return json_response(request, {"error": str(err)}, 400)
+
+    try:
+        rows, next_after = await movie_comments_page_async(session, movie_id, after, limit)
+
+        if not rows and (await session.execute(select(Movie.id).where(Movie.id == movie_id))).first() is None:
+            return json_response(request, {"error": "Movie not found"}, 404)
+
+        return rows_response(request, rows, "comments", next_after=next_after)
+
+    except Exception as e:
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# movies most similar to this one, from the precomputed neighbors, ?limit= up to RECOMMENDATIONS_K
+@cached(similar_movies_cache_key)
+@with_session
+async def get_similar_movies(request, session):
+    movie_id = request.path_params["movie_id"]
+    try:
+        limit = similarity_index.limit(request.query_params.get("limit"))
+        ranked = rank_neighbors((await session.execute(neighbors_statement(movie_id))).all(), limit)
+
+        if ranked:
+            movies = (await session.execute(movies_statement([movie_id for movie_id, _ in ranked]))).all()
+            return json_response(request, scored_movies(movies, ranked))
+        elif (await session.execute(select(Movie.id).where(Movie.id == movie_id))).first() is None:
+            return json_response(request, {"error": "Movie not found"}, 404)
+        else:
+            return json_response(request, {"message": "No similar movies yet."})
+
+    except Exception as e:
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# best rated movies with at least LEADERBOARD_MIN_VOTES ratings, ?limit= up to 100
+@cached(top_rated_cache_key)
+@with_session
+async def get_top_rated_movies(request, session):
+    try:
+        statement = board_statement(TOP_RATED, leaderboards.limit(request.query_params.get("limit")))
+        rows = (await session.execute(statement)).all()
+
+        if rows:
+            return json_response(request, board_movies(rows))
+        else:
+            return json_response(request, {"message": "No rated movies yet."})
+
+    except Exception as e:
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# movies with the most watchlist activity lately, decayed by TRENDING_HALF_LIFE_HOURS, ?limit= up to 100
+@with_session
+async def get_trending_movies(request, session):
+    try:
+        statement = board_statement(TRENDING, leaderboards.limit(request.query_params.get("limit")))
+        rows = (await session.execute(statement)).all()
+
+        if rows:
+            scale = leaderboards.trending_scale((await session.execute(epoch_statement())).scalar())
+            return json_response(request, board_movies(rows, scale))
+        else:
+            return json_response(request, {"message": "No trending movies yet."})
+
+    except Exception as e:
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# search for a movie, ranked by relevance
+# ?with_description=true also matches descriptions, ?limit=&offset= pages through the results
+@with_session
+async def find_movie(request, session):
+    movie_input = request.query_params.get("movie_input")
+    with_description = bool(str_to_bool(request.query_params.get("with_description")))
+
+    try:
+        offset, limit = parse_offset_args(request.query_params)
+    except ValueError as err:
+        return json_response(request, {"error": str(err)}, 400)
+
+    try:
+        query = search_statement(session.bind.dialect.name, movie_input, with_description, limit, offset)
+        movie_data = [dict(row) for row in (await session.execute(*query)).mappings()] if query else []
+
+        if movie_data:
+            return json_response(request, movie_data)
+        else:
+            return json_response(request, {"error": "Movie is not found"}, 404)
+
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# titles starting with ?q=, best rated first, from the in-process prefix index, ?limit= up to 20
+async def suggest_movies(request):
+    query = request.query_params.get("q")
+
+    if not query or not query.strip():
+        return json_response(request, {"error": "Query is missing or empty"}, 400)
+
+    try:
+        # building and polling the index read the sync engine, off the event loop
+        if title_suggestions.refresh_due():
+            await run_in_threadpool(title_suggestions.refresh)
+        limit = title_suggestions.limit(request.query_params.get("limit"))
+        return json_response(request, title_suggestions.suggest(query, limit))
+
+    except Exception as e:
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# the write-behind queue is full or did not commit in time, the client should retry later
+def write_behind_busy_response(request, err):
+    response = json_response(request, {"error": str(err)}, 503)
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+def queued_rating_response(request, outcome):
+    # outcome is None when WRITE_BEHIND_ACK=enqueue answers before the write is applied
+    if outcome is None:
+        return json_response(request, {"message": "Rating accepted."}, 202)
+    if outcome.result == "not_found":
+        return json_response(request, {"error": "User or movie not found"}, 404)
+    if outcome.result == "not_watched":
+        return json_response(request, {"error": "Movie is not watched yet."}, 400)
+    return json_response(request, {"message": "Rating successfully added.", "average rating": outcome.local_rating})
+
+
+# rate movie and update local_rating with average rating
+@login_required
+@user_shard(write=True)
+async def rate_movie(request, session, user):
+    movie_id = request.path_params["movie_id"]
+    try:
+        data = await request.json()
+        movie = (await session.execute(select(Movie.id).where(Movie.id == movie_id))).first()
+        rating = data["user_rating"]
+
+        if not movie:
+            return json_response(request, {"error": "User or movie not found"}, 404)
+
+        if "user_rating" not in data or not data["user_rating"]:
+            return json_response(request, {"error": "Rating is missing or empty"}, 400)
+
+        if not isinstance(rating, int) or rating < 1 or rating > 10:
+            return json_response(request, {"error": "Rating must be an integer between 1 and 10"}, 400)
+
+        # user can rate movie only if it is watched, or a queued write marks it so
+        pending_watched = write_behind.pending_watched(user.id, movie_id)
+        relationship = (await session.execute(select(user_movie.c.watched, user_movie.c.user_rating).where(
+            (user_movie.c.user_id == user.id) &
+            (user_movie.c.movie_id == movie_id)
+        ))).first()
+
+        if not relationship or not (relationship.watched or pending_watched):
+            return json_response(request, {"error": "Movie is not watched yet."}, 400)
+
+        if write_behind.enabled:
+            # end the read transaction first, the flusher's commit must not wait on it
+            await session.rollback()
+            outcome = await write_behind.wait_async(write_behind.submit(user.id, movie_id, rating=rating))
+            return queued_rating_response(request, outcome)
+
+        version = (await session.execute(next_version_statement(session, user.id))).scalar()
+        await session.execute(
+            user_movie.update().where(
+                (user_movie.c.user_id == user.id) &
+                (user_movie.c.movie_id == movie_id)
+            ).values(user_rating=rating, version=version)
+        )
+
+        # update running aggregates of the movie in the same transaction
+        result = await session.execute(rating_change_statement(movie_id, relationship.user_rating, rating))
+        average_rating = as_rating(result.scalar())
+        await similarity_index.record_async(session, user.id, {movie_id: interaction_weight(relationship.user_rating)})
+        await leaderboards.refresh_top_rated_async(session, [movie_id])
+        await leaderboards.record_activity_async(session, {movie_id: TRENDING_WEIGHTS["rated"]})
+
+        await session.commit()
+        response_cache.invalidate_movie(movie_id)
+        return json_response(request, {"message": "Rating successfully added.", "average rating": average_rating})
+    except WriteBehindBusy as err:
+        return write_behind_busy_response(request, err)
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"error": str(e)}, 500)
+
+
+routes = [
+    Route("/", get_all_movies, methods=["GET"]),
+    Route("/find", find_movie, methods=["GET"]),
+    Route("/suggest", suggest_movies, methods=["GET"]),
+    Route("/top-rated", get_top_rated_movies, methods=["GET"]),
+    Route("/trending", get_trending_movies, methods=["GET"]),
+    Route("/{movie_id:int}", get_single_movie, methods=["GET"]),
+    Route("/{movie_id:int}", rate_movie, methods=["POST"]),
+    Route("/{movie_id:int}/comments", get_movie_comments, methods=["GET"]),
+    Route("/{movie_id:int}/similar", get_similar_movies, methods=["GET"])
+]
@@ -0,0 +1,131 @@
+from sqlalchemy import select
+from starlette.routing import Route
+
+from async_apis.common import json_response, login_required, login_user, logout_user, text_response, with_session
+from models.user import User
+from utils.passwords import HasherBusy, password_hasher
+from utils.principal import principal_cache
+
+
+# password hashing is refused when its queue is full, the client should retry later
+def hasher_busy_response(request, err):
+    response = json_response(request, {"error": str(err)}, 503)
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+# sign up
+@with_session
+async def create_user(request, session):
+    data = await request.json()
+    username = data['username']
+    password = data['password']
+
+    if username is None or username.strip() == "":
+        return text_response("Bad Request: Username cannot be empty", 400)
+
+    if password is None or password.strip() == "":
+        return text_response("Bad Request: Password cannot be empty", 400)
+
+    try:
+        hash_and_salted_password = await password_hasher.hash_async(password)
+    except HasherBusy as err:
+        return hasher_busy_response(request, err)
+
+    # assemble  new user row
+    new_user = User(
+        username=username,
+        password=hash_and_salted_password,
+        session_version=0
+    )
+
+    try:
+        session.add(new_user)
+        await session.commit()
+        response = json_response(request, {"user_id": new_user.id}, 201)
+        login_user(request, response, new_user)
+        return response
+    except Exception as err:
+        await session.rollback()
+        return json_response(request, {"error": f"db error: '{err}'"}, 500)
+
+
+# login
+@with_session
+async def login(request, session):
+    data = await request.json()
+    username = data['username']
+    password = data['password']
+
+    try:
+        user = (await session.execute(select(User).where(User.username == username))).scalar()
+
+        if not user:
+            return text_response("Bad Request: Username does not exist", 400)
+        elif not await password_hasher.verify_async(user.password, password):
+            return text_response("Bad Request: Password incorrect", 400)
+        else:
+            # upgrade hashes made with older parameters while the plain password is at hand
+            new_hash = await password_hasher.rehash_async(user.password, password)
+            if new_hash:
+                user.password = new_hash
+                await session.commit()
+
+            response = json_response(request, {"User user_id is logged in": user.id}, 201)
+            login_user(request, response, user)
+            return response
+    except HasherBusy as err:
+        await session.rollback()
+        return hasher_busy_response(request, err)
+    except Exception as err:
+        await session.rollback()
+        return json_response(request, {"error": f"db error: '{err}'"}, 500)
+
+
+# logout
+@login_required
+async def logout(request, session, user):
+    principal_cache.evict(user.id)
+    response = json_response(request, {"message": "Logged out successfully"}, 201)
+    logout_user(request, response)
+    return response
+
+
+# change password, sessions started with the old password are logged out
+@login_required
+async def change_password(request, session, user):
+    data = await request.json()
+    old_password = data.get('old_password')
+    new_password = data.get('new_password')
+
+    if new_password is None or new_password.strip() == "":
+        return text_response("Bad Request: Password cannot be empty", 400)
+
+    try:
+        orm_user = await session.get(User, user.id)
+
+        if old_password is None or not await password_hasher.verify_async(orm_user.password, old_password):
+            return text_response("Bad Request: Password incorrect", 400)
+
+        orm_user.password = await password_hasher.hash_async(new_password)
+        orm_user.session_version += 1
+        await session.commit()
+
+        principal_cache.evict(orm_user.id)
+        response = json_response(request, {"message": "Password changed"}, 200)
+        login_user(request, response, orm_user)
+        return response
+    except HasherBusy as err:
+        await session.rollback()
+        return hasher_busy_response(request, err)
+    except Exception as err:
+        await session.rollback()
+        return json_response(request, {"error": f"db error: '{err}'"}, 500)
+
+
+routes = [
+    Route("/signup", create_user, methods=["POST"]),
+    Route("/login", login, methods=["POST"]),
+    Route("/logout", logout, methods=["POST"]),
+    Route("/password", change_password, methods=["PUT"])
+]
@@ -0,0 +1,253 @@
+from sqlalchemy import delete, select
+from starlette.routing import Route
+
+from async_apis.common import json_response, login_required, rows_response, user_shard
+from models.movie import Movie
+from models.user import user_movie
+from utils.adapters import str_to_bool
+from utils.cache import response_cache
+from utils.changes import (
+    WATCHLIST, clear_tombstones_statement, next_version_statement, parse_since, tombstone_statement, tombstones,
+    watchlist_delta_async
+)
+from utils.leaderboards import TRENDING_WEIGHTS, leaderboards
+from utils.ratings import rating_change_statement
+from utils.recommendations import (
+    interaction_weight, movies_statement, rank_recommendations, scored_movies, similarity_index
+)
+from utils.write_behind import WriteBehindBusy, write_behind
+from utils.watchlist import (
+    MAX_BATCH_SIZE, batch_results, existing_movies_statement, parse_batch_items, plan_watchlist_changes,
+    relationships_statement, similarity_changes, trending_events, watchlist_rows_async, watchlist_upsert_statement
+)
+
+
+# get the list of user's movies
+# ?since=<version> returns only the entries written and the movie ids deleted after that version, with the new one
+@login_required
+@user_shard()
+async def get_user_watchlist(request, session, user):
+    try:
+        if "since" in request.query_params:
+            try:
+                since = parse_since(request.query_params["since"])
+            except ValueError as err:
+                return json_response(request, {"error": str(err)}, 400)
+
+            version, entries, deleted = await watchlist_delta_async(session, user.id, since)
+            return json_response(request, {"version": version, "watchlist": entries, "deleted": deleted})
+
+        # accept optional watched query param and parse it into bool
+        is_watched = str_to_bool(request.query_params.get("watched"))
+
+        user_watchlist = await watchlist_rows_async(session, user.id, is_watched)
+
+        if len(user_watchlist) > 0:
+            return rows_response(request, user_watchlist)
+        else:
+            return json_response(request, {"message": "No movies in watchlist."})
+
+    except Exception as err:
+        return json_response(request, {"error": f"db error: '{err}'"}, 500)
+
+
+# "because you watched": movies similar to the user's watchlist, ?limit= up to RECOMMENDATIONS_K
+@login_required
+@user_shard()
+async def get_recommendations(request, session, user):
+    try:
+        limit = similarity_index.limit(request.query_params.get("limit"))
+        ranked = rank_recommendations(await similarity_index.user_neighbors_async(session, user.id), limit)
+
+        if ranked:
+            movies = (await session.execute(movies_statement([movie_id for movie_id, _ in ranked]))).all()
+            return json_response(request, scored_movies(movies, ranked))
+        else:
+            return json_response(request, {"message": "No recommendations yet."})
+
+    except Exception as err:
+        return json_response(request, {"error": f"db error: '{err}'"}, 500)
+
+
+async def apply_watchlist_changes(session, user_id, changes):
+    """
+    apis.watchlist.apply_watchlist_changes on an AsyncSession. Does not commit.
+
+    :return: (dict of movie_id -> "added" | "updated" | "not_found", list of movie ids whose rating was dropped)
+    """
+    movie_ids = list(changes)
+    existing_movies = set((await session.execute(existing_movies_statement(movie_ids))).scalars())
+    current = (await session.execute(relationships_statement(user_id, movie_ids))).all()
+    relationships = {row.movie_id: row.user_rating for row in current}
+    watched_before = {row.movie_id for row in current if row.watched}
+
+    results, rows, ratings_removed = plan_watchlist_changes(user_id, changes, existing_movies, relationships)
+
+    if rows:
+        version = (await session.execute(next_version_statement(session, user_id))).scalar()
+        rows = [{**row, "version": version} for row in rows]
+
+    for movie_id, old_rating in ratings_removed.items():
+        await session.execute(rating_change_statement(movie_id, old_rating, None))
+    await leaderboards.refresh_top_rated_async(session, list(ratings_removed))
+
+    if rows:
+        await session.execute(watchlist_upsert_statement(session), rows)
+        await session.execute(clear_tombstones_statement(user_id, WATCHLIST, [row["movie_id"] for row in rows]))
+        await similarity_index.record_async(session, user_id, similarity_changes(results, ratings_removed))
+        await leaderboards.record_activity_async(session, trending_events(changes, results, watched_before))
+
+    return results, list(ratings_removed)
+
+
+# add movie to 'watchlist'
+@login_required
+@user_shard(write=True)
+async def add_to_watchlist(request, session, user):
+    try:
+        data = await request.json()
+        movie_id = int(data['movie_id'])
+        watched = data['watched']
+
+        results, ratings_removed = await apply_watchlist_changes(session, user.id, {movie_id: watched})
+
+        if results[movie_id] == "not_found":
+            return json_response(request, {"error": "Movie is not found"}, 404)
+
+        await session.commit()
+        for removed_movie_id in ratings_removed:
+            response_cache.invalidate_movie(removed_movie_id)
+
+        return json_response(request, {"message": "Movie added to watchlist."}, 201)
+
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# add or update many movies of the watchlist at once
+# body: {"items": [{"movie_id": 1, "watched": true}, ...]}, later items win for repeated movie ids
+@login_required
+@user_shard(write=True)
+async def batch_update_watchlist(request, session, user):
+    try:
+        data = await request.json()
+        items = data.get("items") if isinstance(data, dict) else None
+
+        if not isinstance(items, list) or not items:
+            return json_response(request, {"error": "Items are missing or empty"}, 400)
+        if len(items) > MAX_BATCH_SIZE:
+            return json_response(request, {"error": f"At most {MAX_BATCH_SIZE} items per batch"}, 400)
+
+        changes, invalid = parse_batch_items(items)
+
+        results, ratings_removed = await apply_watchlist_changes(session, user.id, changes) if changes else ({}, [])
+        await session.commit()
+        for removed_movie_id in ratings_removed:
+            response_cache.invalidate_movie(removed_movie_id)
+
+        return json_response(request, {"results": batch_results(items, invalid, results)})
+
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"error": str(e)}, 500)
+
+
+# delete movie from watchlist
+@login_required
+@user_shard(write=True)
+async def delete_from_watchlist(request, session, user):
+    movie_id = request.path_params["movie_id"]
+    try:
+        relationship = (await session.execute(select(user_movie.c.user_rating).where(
+            (user_movie.c.user_id == user.id) &
+            (user_movie.c.movie_id == movie_id)
+        ))).first()
+
+        if relationship:
+            version = (await session.execute(next_version_statement(session, user.id))).scalar()
+            await session.execute(delete(user_movie).filter_by(user_id=user.id, movie_id=movie_id))
+            await session.execute(tombstone_statement(session), tombstones(user.id, WATCHLIST, [movie_id], version))
+            await session.execute(rating_change_statement(movie_id, relationship.user_rating, None))
+            await similarity_index.record_async(
+                session, user.id, {movie_id: interaction_weight(relationship.user_rating)}
+            )
+            if relationship.user_rating is not None:
+                await leaderboards.refresh_top_rated_async(session, [movie_id])
+            await session.commit()
+            if relationship.user_rating is not None:
+                response_cache.invalidate_movie(movie_id)
+            return json_response(request, {"message": "Movie deleted from watchlist"})
+        else:
+            return json_response(request, {"error": "Movie not found in watchlist"}, 404)
+    except Exception as err:
+        return json_response(request, {"error": f"db error: '{err}'"}, 500)
+
+
+# the write-behind queue is full or did not commit in time, the client should retry later
+def write_behind_busy_response(request, err):
+    response = json_response(request, {"error": str(err)}, 503)
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+def queued_status_response(request, outcome):
+    # outcome is None when WRITE_BEHIND_ACK=enqueue answers before the write is applied
+    if outcome is None:
+        return json_response(request, {"message": "Status change accepted."}, 202)
+    if outcome.result == "not_found":
+        return json_response(request, {"message": "Movie not found in watchlist"}, 404)
+    return json_response(request, {"message": "Movie is marked as watched."})
+
+
+# change movie status from 'watch later' to 'already watched'
+@login_required
+@user_shard(write=True)
+async def change_movie_status(request, session, user):
+    movie_id = request.path_params["movie_id"]
+    try:
+        movie = (await session.execute(select(Movie.id).where(Movie.id == movie_id))).first()
+
+        if not movie:
+            return json_response(request, {"message": "User or movie not found"}, 404)
+
+        relationship = (await session.execute(select(user_movie.c.watched).where(
+            (user_movie.c.user_id == user.id) &
+            (user_movie.c.movie_id == movie_id)
+        ))).first()
+
+        if relationship:
+            if write_behind.enabled and not (relationship.watched or write_behind.pending_watched(user.id, movie_id)):
+                # end the read transaction first, the flusher's commit must not wait on it
+                await session.rollback()
+                outcome = await write_behind.wait_async(write_behind.submit(user.id, movie_id, watched=True))
+                return queued_status_response(request, outcome)
+
+            if not relationship.watched and not write_behind.enabled:
+                version = (await session.execute(next_version_statement(session, user.id))).scalar()
+                await session.execute(user_movie.update().where(
+                    (user_movie.c.user_id == user.id) &
+                    (user_movie.c.movie_id == movie_id)
+                ).values(watched=True, version=version))
+                await leaderboards.record_activity_async(session, {movie_id: TRENDING_WEIGHTS["watched"]})
+                await session.commit()
+            else:
+                return json_response(request, {"message": "The movie is already marked as watched."}, 400)
+
+        return json_response(request, {"message": "Movie is marked as watched."})
+
+    except WriteBehindBusy as err:
+        return write_behind_busy_response(request, err)
+    except Exception as e:
+        await session.rollback()
+        return json_response(request, {"message": str(e)}, 500)
+
+
+routes = [
+    Route("/", get_user_watchlist, methods=["GET"]),
+    Route("/", add_to_watchlist, methods=["POST"]),
+    Route("/batch", batch_update_watchlist, methods=["POST"]),
+    Route("/recommendations", get_recommendations, methods=["GET"]),
+    Route("/{movie_id:int}", delete_from_watchlist, methods=["DELETE"]),
+    Route("/{movie_id:int}", change_movie_status, methods=["PUT"])
+]
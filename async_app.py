@@ -0,0 +1,141 @@
+import contextlib
+import os
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+from async_apis import batch, comments, movies, users, watchlist
+from async_apis.common import json_response
+from config import engine_options, load_config, shard_uris
+from migrations import check_schema
+from utils.cache import response_cache
+from utils.passwords import password_hasher
+from utils.principal import principal_cache
+from utils.leaderboards import leaderboards
+from utils.recommendations import similarity_index
+from utils.serializers import FastJSONProvider
+from utils.shards import ShardedSession, shard_router
+from utils.slow_queries import SlowQueryScope, slow_query_log
+from utils.suggest import title_suggestions
+from utils.write_behind import write_behind
+
+if os.environ.get("FLASK_ENV") == "development":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# asyncio drivers used for DATABASE_URI, per backend
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg"
+}
+
+
+def async_database_uri(database_uri):
+    """
+    :return: database_uri with the asyncio driver of its backend, e.g. sqlite:///x.db -> sqlite+aiosqlite:///x.db
+    """
+    url = make_url(database_uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver configured for '{backend}'")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def create_async_app():
+    """
+    ASGI counterpart of create_app: serves the same routes and JSON contracts with async handlers
+    on an sqlalchemy.ext.asyncio engine. Run with: uvicorn --factory async_app:create_async_app
+
+    :return: Starlette
+    """
+    # a Flask app without routes carries the config, JSON provider and session signing of the WSGI app
+    settings = Flask(__name__)
+    load_config(settings.config)
+    settings.json = FastJSONProvider(settings)
+
+    # before any engine is created, like in create_app
+    slow_query_log.init_app(settings)
+
+    # Same schema step as create_app
+    database_uri = settings.config["SQLALCHEMY_DATABASE_URI"]
+    migration_engine = create_engine(database_uri)
+    check_schema(migration_engine, settings.config["SCHEMA_ON_START"])
+    migration_engine.dispose()
+    for uri in shard_uris(settings.config).values():
+        migration_engine = create_engine(uri)
+        check_schema(migration_engine, settings.config["SCHEMA_ON_START"], shard=True)
+        migration_engine.dispose()
+
+    # the write-behind flusher and the title index are threads, they use a sync engine of their own
+    sync_engine = create_engine(database_uri, **engine_options(settings.config, database_uri))
+    sync_shard_engines = {
+        key: create_engine(uri, **engine_options(settings.config, uri)) for key, uri in shard_uris(settings.config).items()
+    }
+    write_behind.init_app(settings, sync_engine)
+    title_suggestions.init_app(settings, sync_engine)
+    shard_router.init_app(settings, sync_engine, sync_shard_engines)
+
+    # replica binds are not routed here, every query of the ASGI app goes to the primary or the user's shard
+    engine = create_async_engine(
+        async_database_uri(database_uri),
+        **engine_options(settings.config, database_uri, poolclass=AsyncAdaptedQueuePool)
+    )
+    shard_engines = {
+        key: create_async_engine(async_database_uri(uri), **engine_options(settings.config, uri, poolclass=AsyncAdaptedQueuePool))
+        for key, uri in shard_uris(settings.config).items()
+    }
+
+    response_cache.init_app(settings)
+    principal_cache.init_app(settings)
+    password_hasher.init_app(settings)
+    similarity_index.init_app(settings)
+    leaderboards.init_app(settings)
+
+    async def home(request):
+        return Response("Home page.", media_type="text/html")
+
+    async def cache_stats(request):
+        return json_response(request, response_cache.stats())
+
+    async def slow_queries(request):
+        return json_response(request, slow_query_log.report())
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        write_behind.shutdown()
+        await engine.dispose()
+        for shard_engine in shard_engines.values():
+            await shard_engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route("/", home, methods=["GET"]),
+            Route("/cache/stats", cache_stats, methods=["GET"]),
+            Route("/queries/slow", slow_queries, methods=["GET"]),
+            Route("/batch", batch.run_requests, methods=["POST"]),
+            Mount("/users", routes=users.routes),
+            Mount("/movies", routes=movies.routes),
+            Mount("/comments", routes=comments.routes),
+            Mount("/watchlist", routes=watchlist.routes)
+        ],
+        middleware=[Middleware(SlowQueryScope)],
+        lifespan=lifespan
+    )
+    app.state.settings = settings
+    app.state.json = settings.json.encoder
+    app.state.db = async_sessionmaker(
+        engine, expire_on_commit=False, sync_session_class=ShardedSession,
+        shard_engines={key: shard_engine.sync_engine for key, shard_engine in shard_engines.items()}
+    )
+    app.state.session_serializer = SecureCookieSessionInterface().get_signing_serializer(settings)
+
+    return app
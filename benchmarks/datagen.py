@@ -0,0 +1,132 @@
+"""
+Synthetic data generator: fills a database with movies, users, watchlists and comments using bulk inserts.
+
+Run with: python -m benchmarks.datagen DATABASE_URI [--movies N] [--users N] [--interactions N] [--comments N]
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine, insert
+from werkzeug.security import generate_password_hash
+
+from migrations import refresh_comment_counts, refresh_rating_aggregates, upgrade
+from models.comment import Comment
+from models.movie import Movie
+from models.user import User, user_movie
+from utils.leaderboards import DEFAULT_MIN_VOTES, top_rated_refresh_statements
+
+BENCH_PASSWORD = "bench"
+WORDS = [
+    "dark", "night", "king", "house", "dragon", "office", "breaking", "bad", "crown", "lost",
+    "game", "thrones", "wire", "sopranos", "chernobyl", "friends", "planet", "earth", "band", "brothers",
+    "true", "detective", "mad", "men", "better", "call", "saul", "stranger", "things", "rick"
+]
+
+
+def insert_chunks(conn, table, rows, chunk_size):
+    """
+    Inserts rows from a generator in executemany chunks, so memory stays flat for any volume.
+
+    :return: number of inserted rows
+    """
+    total = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            conn.execute(insert(table), chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert(table), chunk)
+        total += len(chunk)
+    return total
+
+
+def movie_rows(rng, count):
+    for i in range(1, count + 1):
+        yield {
+            "id": i,
+            "title": f"{' '.join(rng.sample(WORDS, 3))} {i}",
+            "description": " ".join(rng.choices(WORDS, k=12)),
+            "rating": round(rng.uniform(1, 10), 1),
+            "img_url": f"/bench/{i}.jpg"
+        }
+
+
+def user_rows(count):
+    # one shared hash: hashing a million passwords would dominate the run
+    password = generate_password_hash(BENCH_PASSWORD, method="pbkdf2:sha256", salt_length=8)
+    for i in range(1, count + 1):
+        yield {"id": i, "username": f"user{i}", "password": password}
+
+
+def interaction_rows(rng, users, movies, count):
+    per_user, remainder = divmod(count, users)
+    for user_id in range(1, users + 1):
+        k = min(per_user + (user_id <= remainder), movies)
+        for movie_id in rng.sample(range(1, movies + 1), k):
+            watched = rng.random() < 0.6
+            yield {
+                "user_id": user_id,
+                "movie_id": movie_id,
+                "watched": watched,
+                "user_rating": rng.randint(1, 10) if watched and rng.random() < 0.5 else None
+            }
+
+
+def comment_rows(rng, users, movies, count):
+    for i in range(1, count + 1):
+        yield {
+            "id": i,
+            "text": " ".join(rng.choices(WORDS, k=8)),
+            "author_id": rng.randint(1, users),
+            "movie_id": rng.randint(1, movies)
+        }
+
+
+def generate(database_uri, movies=10_000, users=1_000, interactions=100_000, comments=10_000, chunk_size=10_000,
+             seed=42):
+    """
+    Creates the schema on database_uri and fills it with deterministic synthetic data.
+
+    :return: dict of table -> inserted rows
+    """
+    rng = random.Random(seed)
+    engine = create_engine(database_uri)
+    upgrade(engine)
+    counts = {}
+
+    with engine.begin() as conn:
+        for name, table, rows in [
+            ("movie", Movie.__table__, movie_rows(rng, movies)),
+            ("user", User.__table__, user_rows(users)),
+            ("user_movie", user_movie, interaction_rows(rng, users, movies, interactions)),
+            ("comment", Comment.__table__, comment_rows(rng, users, movies, comments))
+        ]:
+            started = time.perf_counter()
+            counts[name] = insert_chunks(conn, table, rows, chunk_size)
+            elapsed = time.perf_counter() - started
+            print(f"{name}: {counts[name]} rows in {elapsed:.1f}s ({counts[name] / elapsed:.0f} rows/s)")
+
+        refresh_rating_aggregates(conn)
+        refresh_comment_counts(conn)
+        for statement in top_rated_refresh_statements(DEFAULT_MIN_VOTES):
+            conn.execute(statement)
+
+    engine.dispose()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("database_uri")
+    parser.add_argument("--movies", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--interactions", type=int, default=100_000)
+    parser.add_argument("--comments", type=int, default=10_000)
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    generate(args.database_uri, args.movies, args.users, args.interactions, args.comments, args.chunk_size)
@@ -0,0 +1,98 @@
+"""
+Local stand-in for the TMDb top rated listing, to run the seeder without network access or an API key.
+
+Run with: python -m benchmarks.fake_tmdb [port] [pages]
+and point API_URL at http://127.0.0.1:<port>/3/tv/top_rated
+"""
+import hashlib
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RESULTS_PER_PAGE = 20
+
+
+class FakeTMDb:
+    def __init__(self, pages=10, fail_every=0):
+        self.pages = pages
+        # every n-th request answers 503, to exercise the seeder's retries
+        self.fail_every = fail_every
+        self.revision = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def page_payload(self, page):
+        results = [{
+            "id": (page - 1) * RESULTS_PER_PAGE + i + 1,
+            "name": f"Show {(page - 1) * RESULTS_PER_PAGE + i + 1}",
+            "overview": f"Overview of show {(page - 1) * RESULTS_PER_PAGE + i + 1}, revision {self.revision}",
+            "vote_average": round(5 + ((page * 7 + i) % 50) / 10, 1),
+            "poster_path": f"/poster{page}_{i}.jpg"
+        } for i in range(RESULTS_PER_PAGE)]
+        return {"page": page, "results": results, "total_pages": self.pages, "total_results": self.pages * RESULTS_PER_PAGE}
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                    should_fail = fake.fail_every and fake.requests % fake.fail_every == 0
+
+                if should_fail:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+
+                page = int(parse_qs(urlparse(self.path).query).get("page", ["1"])[0])
+                if page < 1 or page > fake.pages:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                body = json.dumps(fake.page_payload(page)).encode()
+                etag = f'"{hashlib.sha256(body).hexdigest()}"'
+
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def serve(port=0, pages=10, fail_every=0):
+    """
+    Starts the fake API in a background thread.
+
+    :return: (server, fake, api_url) - call server.shutdown() when done
+    """
+    fake = FakeTMDb(pages, fail_every)
+    server = ThreadingHTTPServer(("127.0.0.1", port), fake.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake, f"http://127.0.0.1:{server.server_address[1]}/3/tv/top_rated"
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    server, _, api_url = serve(port, pages)
+    print(f"Fake TMDb listening on {api_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
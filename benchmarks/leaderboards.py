@@ -0,0 +1,86 @@
+"""
+Leaderboard benchmark: top 10 by local rating as an ORDER BY over the catalog vs the maintained board,
+and the cost the board adds to a rating write, at growing catalog sizes.
+
+Run with: python -m benchmarks.leaderboards [size ...]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from migrations import upgrade
+from models.movie import Movie
+from utils.leaderboards import DEFAULT_MIN_VOTES, TOP_RATED, board_statement, leaderboards, top_rated_refresh_statements
+from utils.ratings import apply_rating_change
+from utils.serializers import MOVIE_COLUMNS
+
+REPEAT = 50
+TOP_N = 10
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def build_catalog(path, size):
+    engine = create_engine(f"sqlite:///{path}")
+    upgrade(engine)
+
+    rng = random.Random(size)
+    rows = []
+    for i in range(size):
+        rating_count = rng.randint(0, 20)
+        rating_sum = sum(rng.randint(1, 10) for _ in range(rating_count))
+        rows.append({
+            "title": f"movie {i}",
+            "description": "bench",
+            "img_url": "bench",
+            "rating_sum": rating_sum,
+            "rating_count": rating_count,
+            "local_rating": round(rating_sum / rating_count, 1) if rating_count else None
+        })
+    with engine.begin() as conn:
+        conn.execute(insert(Movie), rows)
+        for statement in top_rated_refresh_statements(DEFAULT_MIN_VOTES):
+            conn.execute(statement)
+    return engine
+
+
+def time_ms(fn, repeat=REPEAT):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def run(sizes):
+    order_by = select(*MOVIE_COLUMNS).where(Movie.rating_count >= DEFAULT_MIN_VOTES).order_by(
+        Movie.local_rating.desc(), Movie.id.desc()
+    ).limit(TOP_N)
+
+    print(f"{'movies':>10} {'order by ms':>12} {'board ms':>10} {'rate ms':>10} {'rate+board ms':>14}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = build_catalog(os.path.join(tmp, "bench.sqlite3"), size)
+            rng = random.Random(size)
+            with Session(engine) as session:
+                scan_ms = time_ms(lambda: session.execute(order_by).all())
+                board_ms = time_ms(lambda: session.execute(board_statement(TOP_RATED, TOP_N)).all())
+
+                def rate(with_board):
+                    movie_id = rng.randint(1, size)
+                    apply_rating_change(session, movie_id, None, rng.randint(1, 10))
+                    if with_board:
+                        leaderboards.refresh_top_rated(session, [movie_id])
+                    session.rollback()
+
+                rate_ms = time_ms(lambda: rate(False))
+                rate_board_ms = time_ms(lambda: rate(True))
+            engine.dispose()
+        print(f"{size:>10} {scan_ms:>12.3f} {board_ms:>10.3f} {rate_ms:>10.3f} {rate_board_ms:>14.3f}")
+
+
+if __name__ == "__main__":
+    run([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
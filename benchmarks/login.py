@@ -0,0 +1,85 @@
+"""
+Mixed load benchmark: login throughput and latency of a cheap read endpoint while logins run in parallel,
+with password hashing inline versus in the process pool.
+
+Run with: python -m benchmarks.login [--seconds S] [--login-threads N] [--read-threads N] [--hash-workers N]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from benchmarks.datagen import generate
+from benchmarks.report import percentile
+
+
+def run_mix(app, seconds, login_threads, read_threads):
+    stop = time.perf_counter() + seconds
+    logins = []
+    reads = []
+
+    def login_loop():
+        client = app.test_client()
+        while time.perf_counter() < stop:
+            response = client.post("/users/login", json={"username": "user1", "password": "bench"})
+            logins.append(response.status_code)
+
+    def read_loop():
+        client = app.test_client()
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            client.get("/movies/?limit=20")
+            reads.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(login_threads)]
+    threads += [threading.Thread(target=read_loop) for _ in range(read_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reads.sort()
+    return {
+        "logins_per_second": round(sum(status == 201 for status in logins) / seconds, 1),
+        "logins_refused": sum(status == 503 for status in logins),
+        "reads_per_second": round(len(reads) / seconds, 1),
+        "read_p50_ms": round(statistics.median(reads), 2),
+        "read_p95_ms": round(percentile(reads, 0.95), 2),
+        "read_p99_ms": round(percentile(reads, 0.99), 2)
+    }
+
+
+def main(seconds, login_threads, read_threads, hash_workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        database_uri = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+        generate(database_uri, movies=1000, users=10, interactions=100, comments=100)
+
+        os.environ["DATABASE_URI"] = database_uri
+        os.environ.setdefault("SECRET_KEY", "bench")
+        os.environ["MOVIE_CACHE_BACKEND"] = "none"
+        # datagen hashes use the old 8 character salt, keep it so logins don't rehash
+        os.environ["PASSWORD_SALT_LENGTH"] = "8"
+        from app import create_app
+        from utils.passwords import password_hasher
+        service = create_app()
+
+        for workers in (0, hash_workers):
+            service.config["PASSWORD_HASH_WORKERS"] = workers
+            password_hasher.init_app(service)
+            result = run_mix(service, seconds, login_threads, read_threads)
+            mode = "inline" if workers == 0 else f"pool of {workers}"
+            print(f"{mode:<12} " + " ".join(f"{key}={value}" for key, value in result.items()))
+        password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--login-threads", type=int, default=4)
+    parser.add_argument("--read-threads", type=int, default=4)
+    parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    main(args.seconds, args.login_threads, args.read_threads, args.hash_workers)
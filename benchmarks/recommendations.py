@@ -0,0 +1,72 @@
+"""
+Recommendations benchmark: build time and peak memory of the item-to-item neighbors, then the latency of
+the O(K) similar-movies and because-you-watched lookups on the result.
+
+Run with: python -m benchmarks.recommendations [--interactions 10000000] [--users N] [--movies N] [--k K]
+"""
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from benchmarks.datagen import generate
+from benchmarks.report import percentile
+from utils.recommendations import neighbors_statement, rank_neighbors, rank_recommendations, user_neighbors_statement
+from utils.similarity_matrix import rebuild_similarities
+
+LOOKUPS = 1000
+
+
+def time_lookups(session, statement, rank, ids, k):
+    timings = []
+    for value in ids:
+        started = time.perf_counter()
+        rank(session.execute(statement(value)).all(), k)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return f"p50 {percentile(timings, 0.5):.2f} ms, p99 {percentile(timings, 0.99):.2f} ms"
+
+
+def main(database_uri, movies, users, k, block_size):
+    engine = create_engine(database_uri)
+
+    # ru_maxrss is in KiB on Linux; tracemalloc would cover numpy too but slows the row loading several times
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stats = rebuild_similarities(engine, k, block_size)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"{stats['interactions']} interactions, {stats['movies']} movies -> {stats['pairs']} neighbors (k={k})")
+    print(f"load {stats['load_seconds']}s, compute {stats['compute_seconds']}s, write {stats['write_seconds']}s")
+    print(f"max RSS {peak / 1024:.0f} MiB ({(peak - before) / 1024:.0f} MiB above the process before the build)")
+
+    rng = random.Random(k)
+    with Session(engine) as session:
+        print("similar movies:  " + time_lookups(
+            session, neighbors_statement, rank_neighbors, [rng.randint(1, movies) for _ in range(LOOKUPS)], k))
+        print("recommendations: " + time_lookups(
+            session, user_neighbors_statement, rank_recommendations, [rng.randint(1, users) for _ in range(LOOKUPS)], k))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-uri", help="existing database filled by benchmarks.datagen")
+    parser.add_argument("--movies", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--interactions", type=int, default=10_000_000)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--block-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    if args.database_uri:
+        main(args.database_uri, args.movies, args.users, args.k, args.block_size)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            uri = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+            generate(uri, movies=args.movies, users=args.users, interactions=args.interactions, comments=0)
+            main(uri, args.movies, args.users, args.k, args.block_size)
@@ -0,0 +1,150 @@
+"""
+Replays a JSONL request log against the app in-process (Flask test client) or a running server (e.g. local gunicorn),
+then reports latency percentiles, throughput and queries per request for every endpoint.
+
+The in-process target uses the app configured by the environment, so point DATABASE_URI at a database
+filled by benchmarks.datagen. Users in the log are logged in with the benchmark password before their first request.
+
+Run with: python -m benchmarks.replay LOG [--target flask|http://127.0.0.1:8000] [--concurrency N] [--out RUN.json]
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import event
+
+from benchmarks.datagen import BENCH_PASSWORD
+from benchmarks.report import print_summary, summarize_samples
+
+ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_name(method, path):
+    # GET /movies/12?limit=5 -> GET /movies/<id>
+    return f"{method} {ID_SEGMENT.sub('/<id>', path.split('?', 1)[0])}"
+
+
+def read_log(path):
+    with open(path) as log:
+        for line in log:
+            if line.strip():
+                yield json.loads(line)
+
+
+class FlaskTarget:
+    """
+    In-process target: one test client per user, SQL statements counted through engine events.
+    """
+
+    def __init__(self, app, password=BENCH_PASSWORD):
+        from database import db
+
+        self.app = app
+        self.password = password
+        self.clients = {}
+        self.queries = 0
+
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", self._count_query)
+
+    def _count_query(self, *args):
+        self.queries += 1
+
+    def client(self, user):
+        if user not in self.clients:
+            client = self.app.test_client()
+            if user:
+                client.post("/users/login", json={"username": user, "password": self.password})
+            self.clients[user] = client
+        return self.clients[user]
+
+    def send(self, record):
+        client = self.client(record.get("user"))
+        queries_before = self.queries
+        started = time.perf_counter()
+        response = client.open(record["path"], method=record["method"], json=record.get("json"))
+        response.get_data()
+        elapsed = (time.perf_counter() - started) * 1000
+        return response.status_code, elapsed, self.queries - queries_before
+
+
+class HttpTarget:
+    """
+    Target behind a real server. Sessions are kept per thread and user; SQL statements are not visible from here.
+    """
+
+    def __init__(self, base_url, password=BENCH_PASSWORD):
+        self.base_url = base_url.rstrip("/")
+        self.password = password
+        self.local = threading.local()
+
+    def client(self, user):
+        sessions = self.local.__dict__.setdefault("sessions", {})
+        if user not in sessions:
+            session = requests.Session()
+            if user:
+                session.post(f"{self.base_url}/users/login", json={"username": user, "password": self.password})
+            sessions[user] = session
+        return sessions[user]
+
+    def send(self, record):
+        session = self.client(record.get("user"))
+        started = time.perf_counter()
+        response = session.request(record["method"], f"{self.base_url}{record['path']}", json=record.get("json"))
+        elapsed = (time.perf_counter() - started) * 1000
+        return response.status_code, elapsed, None
+
+
+def replay(target, records, concurrency=1):
+    """
+    :return: run summary, see benchmarks.report.summarize_samples
+    """
+    def run(record):
+        status, ms, queries = target.send(record)
+        return endpoint_name(record["method"], record["path"]), status, ms, queries
+
+    records = list(records)
+    # log in every user up front so logins don't count towards the replayed requests
+    if concurrency == 1:
+        for user in {record.get("user") for record in records}:
+            target.client(user)
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        samples = [run(record) for record in records]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(run, records))
+
+    return summarize_samples(samples, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("log")
+    parser.add_argument("--target", default="flask")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--password", default=BENCH_PASSWORD)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    if args.target == "flask":
+        os.environ.setdefault("SECRET_KEY", "bench")
+        from app import create_app
+        bench_target = FlaskTarget(create_app(), args.password)
+        # the test client is not thread safe
+        args.concurrency = 1
+    else:
+        bench_target = HttpTarget(args.target, args.password)
+
+    result = replay(bench_target, read_log(args.log), args.concurrency)
+    print_summary(result)
+
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(result, out, indent=2)
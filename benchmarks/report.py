@@ -0,0 +1,111 @@
+"""
+Latency, throughput and queries-per-request report of a replay run, and regression check between two runs.
+
+Run with: python -m benchmarks.report show RUN.json
+          python -m benchmarks.report compare BASELINE.json CURRENT.json [--threshold 0.1]
+"""
+import argparse
+import json
+import math
+import sys
+
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def percentile(sorted_values, fraction):
+    # nearest-rank percentile
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize_samples(samples, wall_seconds):
+    """
+    :param samples: iterable of (endpoint, status_code, milliseconds, query count or None)
+    :return: dict with per-endpoint and total stats
+    """
+    by_endpoint = {}
+    for endpoint, status, ms, queries in samples:
+        by_endpoint.setdefault(endpoint, []).append((status, ms, queries))
+        by_endpoint.setdefault("TOTAL", []).append((status, ms, queries))
+
+    summary = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        latencies = sorted(ms for _, ms, _ in rows)
+        queries = [count for _, _, count in rows if count is not None]
+        summary[endpoint] = {
+            "requests": len(rows),
+            "errors": sum(status >= 500 for status, _, _ in rows),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "throughput_rps": round(len(rows) / wall_seconds, 1) if wall_seconds else None,
+            "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None
+        }
+
+    return {"wall_seconds": round(wall_seconds, 3), "endpoints": summary}
+
+
+def print_summary(run):
+    print(f"{'endpoint':<32} {'reqs':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>9} {'q/req':>6}")
+    for endpoint, stats in run["endpoints"].items():
+        queries = stats["queries_per_request"]
+        print(f"{endpoint:<32} {stats['requests']:>7} {stats['errors']:>5} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['throughput_rps'] or 0:>9.1f} "
+              f"{queries if queries is not None else '-':>6}")
+
+
+def compare_runs(baseline, current, threshold=0.10):
+    """
+    Flags endpoints whose latency percentiles grew, or throughput fell, by more than threshold,
+    and endpoints that issue more queries per request than before.
+
+    :return: list of (endpoint, metric, baseline value, current value)
+    """
+    regressions = []
+    for endpoint, after in current["endpoints"].items():
+        before = baseline["endpoints"].get(endpoint)
+        if before is None:
+            continue
+
+        for metric in LATENCY_METRICS:
+            if before[metric] and after[metric] > before[metric] * (1 + threshold):
+                regressions.append((endpoint, metric, before[metric], after[metric]))
+
+        if before["throughput_rps"] and after["throughput_rps"] is not None \
+                and after["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            regressions.append((endpoint, "throughput_rps", before["throughput_rps"], after["throughput_rps"]))
+
+        if before["queries_per_request"] is not None and after["queries_per_request"] is not None \
+                and after["queries_per_request"] > before["queries_per_request"]:
+            regressions.append((endpoint, "queries_per_request", before["queries_per_request"],
+                                after["queries_per_request"]))
+
+    return regressions
+
+
+def load_run(path):
+    with open(path) as run_file:
+        return json.load(run_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show")
+    show.add_argument("run")
+    compare = commands.add_parser("compare")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.command == "show":
+        print_summary(load_run(args.run))
+    else:
+        found = compare_runs(load_run(args.baseline), load_run(args.current), args.threshold)
+        for endpoint, metric, before, after in found:
+            print(f"REGRESSION {endpoint} {metric}: {before} -> {after}")
+        if not found:
+            print("No regressions.")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,74 @@
+"""
+Search latency benchmark: legacy LIKE scan vs the full-text index, at growing catalog sizes.
+
+Run with: python -m benchmarks.search [size ...]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import Session
+
+from models.movie import Movie
+from migrations import upgrade
+from utils.search import search_movies
+
+WORDS = [
+    "dark", "night", "king", "house", "dragon", "office", "breaking", "bad", "crown", "lost",
+    "game", "thrones", "wire", "sopranos", "chernobyl", "friends", "planet", "earth", "band", "brothers",
+    "true", "detective", "mad", "men", "better", "call", "saul", "stranger", "things", "rick"
+]
+REPEAT = 20
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def build_catalog(path, size):
+    engine = create_engine(f"sqlite:///{path}")
+    upgrade(engine)
+
+    rng = random.Random(size)
+    with engine.begin() as conn:
+        rows = [{
+            "title": f"{' '.join(rng.sample(WORDS, 3))} {i}",
+            "description": " ".join(rng.choices(WORDS, k=12)),
+            "rating": rng.uniform(1, 10),
+            "img_url": "bench"
+        } for i in range(size)]
+        conn.execute(insert(Movie), rows)
+    return engine
+
+
+def pick_queries(session, size):
+    # selective lookups like a user typing a known title, plus a miss that matches nothing
+    rng = random.Random(size)
+    titles = [session.get(Movie, rng.randint(1, size)).title for _ in range(4)]
+    return [" ".join(title.split()[1:]) for title in titles] + ["nonexistent title"]
+
+
+def time_queries(fn, queries):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        for query in queries:
+            fn(query)
+    return (time.perf_counter() - started) / (REPEAT * len(queries)) * 1000
+
+
+def run(sizes):
+    print(f"{'movies':>10} {'like ms':>10} {'fts ms':>10}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = build_catalog(os.path.join(tmp, "bench.sqlite3"), size)
+            with Session(engine) as session:
+                queries = pick_queries(session, size)
+                like_ms = time_queries(lambda q: session.query(Movie).filter(
+                    func.lower(Movie.title).like(f"%{q}%")).limit(50).all(), queries)
+                fts_ms = time_queries(lambda q: search_movies(session, q, limit=50), queries)
+            engine.dispose()
+        print(f"{size:>10} {like_ms:>10.3f} {fts_ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    run([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,76 @@
+"""
+Serialization benchmark: rows per second of the full movie listing, from the legacy ORM objects + stdlib json path
+to column rows encoded with each JSON backend, with and without the pre-encoded fragment cache.
+
+Run with: python -m benchmarks.serialization [size ...]
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from benchmarks.datagen import generate
+from models.movie import Movie
+from utils.serializers import MOVIE_COLUMNS, RowEncoder, available_backends
+
+REPEAT = 5
+DEFAULT_SIZES = [10_000, 100_000]
+
+
+def legacy_listing(session, encoder):
+    movies = session.query(Movie).all()
+    return json.dumps([{
+        "id": movie.id,
+        "title": movie.title,
+        "description": movie.description,
+        "rating": movie.rating,
+        "local_rating": movie.local_rating,
+        "img_url": movie.img_url
+    } for movie in movies], sort_keys=True).encode()
+
+
+def row_listing(session, encoder):
+    return encoder.encode_rows(session.execute(select(*MOVIE_COLUMNS)).all())
+
+
+def rows_per_second(engine, listing, encoder, size):
+    timings = []
+    for _ in range(REPEAT):
+        # a new session each round, like a request, so the ORM path pays for hydration every time
+        with Session(engine) as session:
+            started = time.perf_counter()
+            listing(session, encoder)
+            timings.append(time.perf_counter() - started)
+    return size / statistics.median(timings)
+
+
+def run(sizes):
+    variants = [("orm + json", legacy_listing, RowEncoder("json"))]
+    for backend in available_backends():
+        variants.append((f"rows + {backend}", row_listing, RowEncoder(backend)))
+    for backend in available_backends():
+        variants.append((f"rows + {backend} + fragments", row_listing, RowEncoder(backend, max(sizes))))
+
+    print(f"{'movies':>10} {'variant':<30} {'rows/s':>12}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            database_uri = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+            generate(database_uri, movies=size, users=1, interactions=0, comments=0)
+            engine = create_engine(database_uri)
+
+            for name, listing, encoder in variants:
+                # the fragment cache is measured warm, as after the first request of a worker
+                with Session(engine) as session:
+                    listing(session, encoder)
+                print(f"{size:>10} {name:<30} {rows_per_second(engine, listing, encoder, size):>12,.0f}")
+
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    run([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,157 @@
+"""
+Serving mode benchmark: the WSGI app under gunicorn (threaded workers) against the ASGI app under uvicorn,
+driven side by side with the same read mix at high concurrency. Reports throughput and tail latency of each.
+
+Both servers share one database filled by benchmarks.datagen, with the response cache off so every request
+reaches the database. Pass --database-uri to run against Postgres instead of a temporary SQLite file.
+
+Run with: python -m benchmarks.serving [--concurrency N] [--seconds S] [--workers N] [--threads N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.datagen import WORDS, generate
+from benchmarks.replay import endpoint_name
+from benchmarks.report import print_summary, summarize_samples
+
+HOST = "127.0.0.1"
+
+
+def request_paths(rng, movies):
+    while True:
+        yield rng.choice([
+            f"/movies/?limit=20&after={rng.randint(0, movies - 20)}",
+            f"/movies/{rng.randint(1, movies)}",
+            f"/movies/find?movie_input={rng.choice(WORDS)}&limit=20"
+        ])
+
+
+async def read_response(reader):
+    # minimal HTTP/1.1 response reader: status, then a content-length or chunked body
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    chunked = False
+    keep_alive = True
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding":
+            chunked = "chunked" in value
+        elif name == "connection":
+            keep_alive = value != "close"
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def client_loop(port, paths, stop, samples):
+    reader = writer = None
+    while time.perf_counter() < stop:
+        path = next(paths)
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(HOST, port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {HOST}:{port}\r\n\r\n".encode())
+            status, keep_alive = await read_response(reader)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            status, keep_alive = 599, False
+
+        samples.append((endpoint_name("GET", path), status, (time.perf_counter() - started) * 1000, None))
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+
+    if writer is not None:
+        writer.close()
+
+
+async def drive(port, movies, concurrency, seconds):
+    rng = random.Random(port)
+    paths = request_paths(rng, movies)
+    samples = []
+    started = time.perf_counter()
+    stop = started + seconds
+    await asyncio.gather(*(client_loop(port, paths, stop, samples) for _ in range(concurrency)))
+    return summarize_samples(samples, time.perf_counter() - started)
+
+
+def start_server(command, port, env):
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            if requests.get(f"http://{HOST}:{port}/", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server did not start: {' '.join(command)}")
+
+
+def main(database_uri, movies, concurrency, seconds, workers, threads, port):
+    env = dict(os.environ, DATABASE_URI=database_uri, MOVIE_CACHE_BACKEND="none")
+    env.setdefault("SECRET_KEY", "bench")
+
+    modes = [
+        ("wsgi", [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+                  "-b", f"{HOST}:{port}", "app:create_app()"]),
+        ("asgi", [sys.executable, "-m", "uvicorn", "--factory", "async_app:create_async_app",
+                  "--workers", str(workers), "--host", HOST, "--port", str(port + 1), "--log-level", "warning"])
+    ]
+
+    runs = {}
+    for offset, (mode, command) in enumerate(modes):
+        process = start_server(command, port + offset, env)
+        try:
+            # a short warm-up, so connection pools and caches are filled before measuring
+            asyncio.run(drive(port + offset, movies, concurrency, 1))
+            runs[mode] = asyncio.run(drive(port + offset, movies, concurrency, seconds))
+        finally:
+            process.terminate()
+            process.wait()
+
+    for mode, run in runs.items():
+        print(f"\n{mode}: {concurrency} connections, {workers} workers" + (f" x {threads} threads" if mode == "wsgi" else ""))
+        print_summary(run)
+    return runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-uri", help="existing database filled by benchmarks.datagen")
+    parser.add_argument("--movies", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8700)
+    args = parser.parse_args()
+
+    if args.database_uri:
+        main(args.database_uri, args.movies, args.concurrency, args.seconds, args.workers, args.threads, args.port)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            uri = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+            generate(uri, movies=args.movies, users=100, interactions=10_000, comments=20_000)
+            main(uri, args.movies, args.concurrency, args.seconds, args.workers, args.threads, args.port)
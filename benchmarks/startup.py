@@ -0,0 +1,100 @@
+"""
+Startup benchmark: how long a fresh process takes to import the app, build it and serve its first request,
+and how long gunicorn (WSGI) and uvicorn (ASGI) take from process start to the first 200 on /.
+
+Every run is a new interpreter, so nothing is warm but the OS page cache. Reports the median and the best run.
+
+Run with: python -m benchmarks.startup [--runs N] [--database-uri URI]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.datagen import generate
+
+HOST = "127.0.0.1"
+
+# runs in the child process, timestamps are relative to the interpreter start reported by the parent
+PHASES = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+service = app.create_app()
+created = time.perf_counter()
+service.test_client().get("/movies/1")
+served = time.perf_counter()
+json.dump({"import": imported - started, "create_app": created - imported, "first_request": served - created},
+          sys.stdout)
+"""
+
+
+def time_phases(env):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", PHASES], env=env, capture_output=True, text=True, check=True)
+    phases = json.loads(output.stdout)
+    phases["process_total"] = time.perf_counter() - started
+    return phases
+
+
+def time_boot(command, port, env):
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < 30:
+            try:
+                if requests.get(f"http://{HOST}:{port}/", timeout=1).status_code == 200:
+                    return time.perf_counter() - started
+            except requests.RequestException:
+                pass
+            time.sleep(0.005)
+        raise RuntimeError(f"Server did not start: {' '.join(command)}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def print_timings(name, samples):
+    millis = sorted(sample * 1000 for sample in samples)
+    print(f"{name:<24} median {statistics.median(millis):>8.1f} ms   best {millis[0]:>8.1f} ms")
+
+
+def main(database_uri, runs, port):
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    env.setdefault("SECRET_KEY", "bench")
+
+    phases = [time_phases(env) for _ in range(runs)]
+    for name in ("import", "create_app", "first_request", "process_total"):
+        print_timings(f"in-process {name}", [run[name] for run in phases])
+
+    servers = [
+        ("gunicorn to first 200", [sys.executable, "-m", "gunicorn", "-w", "1", "-b", f"{HOST}:{port}",
+                                   "app:create_app()"]),
+        ("uvicorn to first 200", [sys.executable, "-m", "uvicorn", "--factory", "async_app:create_async_app",
+                                  "--host", HOST, "--port", str(port), "--log-level", "warning"])
+    ]
+    for name, command in servers:
+        print_timings(name, [time_boot(command, port, env) for _ in range(runs)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-uri", help="existing database filled by benchmarks.datagen")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8750)
+    args = parser.parse_args()
+
+    if args.database_uri:
+        main(args.database_uri, args.runs, args.port)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            uri = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+            generate(uri, movies=1000, users=10, interactions=100, comments=100)
+            main(uri, args.runs, args.port)
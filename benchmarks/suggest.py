@@ -0,0 +1,63 @@
+"""
+Title autocomplete benchmark: build time, memory footprint and lookup latency of the prefix index,
+at growing catalog sizes. Lookups are prefixes of 1 to 12 characters of random titles, as typed keystroke by keystroke.
+
+Run with: python -m benchmarks.suggest [size ...]
+"""
+import random
+import resource
+import sys
+import time
+
+from benchmarks.search import WORDS
+from utils.suggest import DEFAULT_LIMIT, TitleSnapshot, normalize_title
+
+LOOKUPS = 20_000
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def catalog_rows(rng, size):
+    for i in range(1, size + 1):
+        yield (
+            i,
+            f"{' '.join(rng.sample(WORDS, rng.randint(1, 3))).title()}: Season {i}",
+            round(rng.uniform(1, 10), 1),
+            round(rng.uniform(1, 10), 1) if rng.random() < 0.3 else None
+        )
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(sizes):
+    print(f"{'titles':>10} {'build s':>8} {'index MiB':>10} {'peak RSS MiB':>13} {'prefixes':>9} "
+          f"{'p50 us':>8} {'p99 us':>8} {'max us':>8}")
+    for size in sizes:
+        rng = random.Random(size)
+
+        started = time.perf_counter()
+        snapshot = TitleSnapshot(catalog_rows(rng, size))
+        build_seconds = time.perf_counter() - started
+        # peak resident size of the process so far (KiB on Linux), sizes run in increasing order
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        queries = []
+        for _ in range(LOOKUPS):
+            key = normalize_title(snapshot.titles[rng.randrange(size)])
+            queries.append(key[:rng.randint(1, 12)])
+
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            snapshot.matches(query, DEFAULT_LIMIT)
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+
+        print(f"{size:>10} {build_seconds:>8.2f} {snapshot.memory_bytes() / 2 ** 20:>10.1f} {peak / 2 ** 20:>13.1f} "
+              f"{len(snapshot.tops):>9} {percentile(samples, 0.5) * 1e6:>8.1f} {percentile(samples, 0.99) * 1e6:>8.1f} "
+              f"{samples[-1] * 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    run([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
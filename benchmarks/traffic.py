@@ -0,0 +1,58 @@
+"""
+Writes a synthetic JSONL request log that touches every endpoint of the users, movies, comments and watchlist
+blueprints, for benchmarks.replay.
+
+Each line is {"method": ..., "path": ..., "json": body or null, "user": username or null}.
+
+Run with: python -m benchmarks.traffic OUT [--requests N] [--users N] [--movies N] [--comments N]
+"""
+import argparse
+import json
+import random
+
+from benchmarks.datagen import WORDS
+
+
+def request_line(rng, users, movies, comments):
+    user = f"user{rng.randint(1, users)}"
+    movie_id = rng.randint(1, movies)
+    comment_id = rng.randint(1, comments)
+
+    # (weight, method, path, json body, needs a logged in user)
+    choices = [
+        (20, "GET", f"/movies/?limit=50&after={rng.randint(0, movies)}", None, False),
+        (20, "GET", f"/movies/{movie_id}", None, False),
+        (10, "GET", f"/movies/find?movie_input={' '.join(rng.sample(WORDS, 2))}", None, False),
+        (5, "POST", f"/movies/{movie_id}", {"user_rating": rng.randint(1, 10)}, True),
+        (10, "GET", "/watchlist/", None, True),
+        (5, "POST", "/watchlist/", {"movie_id": movie_id, "watched": rng.random() < 0.5}, True),
+        (3, "PUT", f"/watchlist/{movie_id}", None, True),
+        (2, "DELETE", f"/watchlist/{movie_id}", None, True),
+        (10, "GET", "/comments/", None, True),
+        (5, "POST", "/comments/", {"movie_id": movie_id, "text": " ".join(rng.choices(WORDS, k=6))}, True),
+        (2, "PUT", f"/comments/{comment_id}", {"text": " ".join(rng.choices(WORDS, k=6))}, True),
+        (1, "DELETE", f"/comments/{comment_id}", None, True),
+        (2, "POST", "/users/login", {"username": user, "password": "bench"}, False)
+    ]
+    _, method, path, body, needs_user = rng.choices(choices, weights=[choice[0] for choice in choices])[0]
+
+    return {"method": method, "path": path, "json": body, "user": user if needs_user else None}
+
+
+def write_log(path, requests=10_000, users=1_000, movies=10_000, comments=10_000, seed=7):
+    rng = random.Random(seed)
+    with open(path, "w") as log:
+        for _ in range(requests):
+            log.write(json.dumps(request_line(rng, users, movies, comments)) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out")
+    parser.add_argument("--requests", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--movies", type=int, default=10_000)
+    parser.add_argument("--comments", type=int, default=10_000)
+    args = parser.parse_args()
+
+    write_log(args.out, args.requests, args.users, args.movies, args.comments)
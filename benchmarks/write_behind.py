@@ -0,0 +1,105 @@
+"""
+Write-behind benchmark: rating throughput, latency and commits of concurrent voters with every rating
+committed by its request, versus queued and group committed by the flusher (acked on commit or on enqueue).
+
+Run with: python -m benchmarks.write_behind [--seconds S] [--threads N] [--interval-ms MS]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, select
+
+from benchmarks.datagen import BENCH_PASSWORD, generate
+from benchmarks.report import percentile
+from models.user import user_movie
+
+USERS = 200
+
+
+def watched_movies(database_uri):
+    engine = create_engine(database_uri)
+    with engine.connect() as conn:
+        rows = conn.execute(select(user_movie.c.user_id, user_movie.c.movie_id).where(user_movie.c.watched)).all()
+    engine.dispose()
+
+    by_user = {}
+    for user_id, movie_id in rows:
+        by_user.setdefault(user_id, []).append(movie_id)
+    return by_user
+
+
+def run_votes(app, by_user, seconds, threads):
+    stop = time.perf_counter() + seconds
+    statuses = []
+    timings = []
+    user_ids = sorted(by_user)
+
+    def vote_loop(user_id):
+        client = app.test_client()
+        client.post("/users/login", json={"username": f"user{user_id}", "password": BENCH_PASSWORD})
+        rng = random.Random(user_id)
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            response = client.post(f"/movies/{rng.choice(by_user[user_id])}", json={"user_rating": rng.randint(1, 10)})
+            timings.append((time.perf_counter() - started) * 1000)
+            statuses.append(response.status_code)
+
+    workers = [threading.Thread(target=vote_loop, args=(user_ids[index % len(user_ids)],)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    timings.sort()
+    return {
+        "votes_per_second": round(sum(status in (200, 202) for status in statuses) / seconds, 1),
+        "refused": sum(status == 503 for status in statuses),
+        "p50_ms": round(statistics.median(timings), 2),
+        "p99_ms": round(percentile(timings, 0.99), 2)
+    }
+
+
+def main(seconds, threads, interval_ms):
+    with tempfile.TemporaryDirectory() as tmp:
+        database_uri = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+        generate(database_uri, movies=1000, users=USERS, interactions=USERS * 20, comments=0)
+        by_user = watched_movies(database_uri)
+
+        os.environ["DATABASE_URI"] = database_uri
+        os.environ.setdefault("SECRET_KEY", "bench")
+        os.environ["MOVIE_CACHE_BACKEND"] = "none"
+        # datagen hashes use the old 8 character salt, keep it so logins don't rehash
+        os.environ["PASSWORD_SALT_LENGTH"] = "8"
+        from app import create_app
+        from database import db
+        from utils.metrics import request_metrics
+        from utils.write_behind import write_behind
+        service = create_app()
+
+        for mode, ack in (("off", "commit"), ("commit", "commit"), ("enqueue", "enqueue")):
+            service.config.update(WRITE_BEHIND=str(mode != "off"), WRITE_BEHIND_ACK=ack,
+                                  WRITE_BEHIND_INTERVAL_MS=interval_ms)
+            with service.app_context():
+                write_behind.init_app(service, db.engine)
+
+            batches = request_metrics.counters[("write_behind_batches_total", "write_behind")]
+            result = run_votes(service, by_user, seconds, threads)
+            write_behind.shutdown()
+            if mode != "off":
+                result["commits"] = request_metrics.counters[("write_behind_batches_total", "write_behind")] - batches
+            print(f"{mode:<8} " + " ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--interval-ms", type=int, default=50)
+    args = parser.parse_args()
+
+    main(args.seconds, args.threads, args.interval_ms)
@@ -0,0 +1,56 @@
+import click
+from flask.cli import AppGroup
+
+from database import db
+from utils.bulk_data import DATASETS, DEFAULT_CHUNK_SIZE, FORMATS, export_dataset, import_dataset
+from utils.cache import response_cache
+from utils.leaderboards import leaderboards
+
+data_cli = AppGroup("data", help="Stream movies, watchlists and comments to and from JSONL or CSV files.")
+
+
+def echo_progress(message):
+    click.echo(message, err=True)
+
+
+# flask data export movies movies.jsonl [--format csv] [--chunk-size 5000] [--resume]
+@data_cli.command("export")
+@click.argument("dataset", type=click.Choice(list(DATASETS)))
+@click.argument("path", type=click.Path(dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="File format, from the extension by default.")
+@click.option("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched and checkpointed at once.")
+@click.option("--resume", is_flag=True, help="Continue an interrupted export from its checkpoint.")
+def export_data(dataset, path, fmt, chunk_size, resume):
+    """Export a dataset ordered by primary key, checkpointing after every chunk."""
+    try:
+        stats = export_dataset(db.engine, dataset, path, fmt, chunk_size, resume, echo_progress)
+    except ValueError as err:
+        raise click.ClickException(str(err))
+    click.echo(f"Exported {stats['rows']} {dataset} rows to {path} in {stats['seconds']}s "
+               f"({stats['rows_per_second']} rows/s).")
+
+
+# flask data import movies movies.jsonl [--format csv] [--chunk-size 5000]
+@data_cli.command("import")
+@click.argument("dataset", type=click.Choice(list(DATASETS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="File format, from the extension by default.")
+@click.option("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows upserted per transaction.")
+def import_data(dataset, path, fmt, chunk_size):
+    """Upsert a dataset by primary key, then rebuild the rating aggregates and comment counts it affects."""
+    try:
+        stats = import_dataset(db.session, dataset, path, fmt, chunk_size, echo_progress)
+        if dataset != "comments":
+            leaderboards.refresh_top_rated(db.session)
+            db.session.commit()
+    except ValueError as err:
+        db.session.rollback()
+        raise click.ClickException(str(err))
+    except Exception:
+        db.session.rollback()
+        raise
+    response_cache.invalidate_all()
+    click.echo(f"Imported {stats['rows']} {dataset} rows from {path} in {stats['seconds']}s "
+               f"({stats['rows_per_second']} rows/s).")
+    if dataset == "watchlists":
+        click.echo("Run `flask recommendations build` to include the imported rows in the similar movies.")
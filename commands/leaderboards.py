@@ -0,0 +1,28 @@
+import click
+from flask.cli import AppGroup
+
+from database import db
+from utils.cache import response_cache
+from utils.leaderboards import leaderboards
+
+leaderboards_cli = AppGroup("leaderboards", help="Maintain the top rated and trending leaderboards.")
+
+
+# flask leaderboards rebuild
+@leaderboards_cli.command("rebuild")
+def rebuild():
+    """Refill the top rated board from the rating aggregates, e.g. after changing LEADERBOARD_MIN_VOTES."""
+    leaderboards.refresh_top_rated(db.session)
+    dropped = leaderboards.rebase(db.session)
+    db.session.commit()
+    response_cache.invalidate_all()
+    click.echo(f"Rebuilt the top rated board and rebased trending scores, dropped {dropped} stale entries.")
+
+
+# flask leaderboards rebase
+@leaderboards_cli.command("rebase")
+def rebase():
+    """Move the trending epoch to now and drop entries that decayed away, run it e.g. weekly."""
+    dropped = leaderboards.rebase(db.session)
+    db.session.commit()
+    click.echo(f"Rebased trending scores, dropped {dropped} stale entries.")
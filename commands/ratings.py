@@ -0,0 +1,41 @@
+import click
+from flask.cli import AppGroup
+
+from database import db
+from utils.cache import response_cache
+from utils.ratings import find_rating_mismatches, rebuild_rating_aggregates
+
+ratings_cli = AppGroup("ratings", help="Maintain the per-movie rating aggregates.")
+
+
+# flask ratings backfill
+@ratings_cli.command("backfill")
+def backfill():
+    """Rebuild rating_sum, rating_count and local_rating of every movie from user_movie."""
+    updated = rebuild_rating_aggregates(db.session)
+    db.session.commit()
+    response_cache.invalidate_all()
+    click.echo(f"Rebuilt rating aggregates for {updated} movies.")
+
+
+# flask ratings check [--fix]
+@ratings_cli.command("check")
+@click.option("--fix", is_flag=True, help="Rebuild the aggregates of inconsistent movies.")
+def check(fix):
+    """Report movies whose stored aggregates do not match user_movie."""
+    mismatches = find_rating_mismatches(db.session)
+
+    for movie_id, stored, expected in mismatches:
+        click.echo(f"movie {movie_id}: stored sum/count {stored}, expected {expected}")
+
+    if not mismatches:
+        click.echo("Rating aggregates are consistent.")
+        return
+
+    if fix:
+        rebuild_rating_aggregates(db.session, [movie_id for movie_id, _, _ in mismatches])
+        db.session.commit()
+        response_cache.invalidate_all()
+        click.echo(f"Fixed {len(mismatches)} movies.")
+    else:
+        raise SystemExit(1)
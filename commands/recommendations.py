@@ -0,0 +1,27 @@
+import click
+from flask.cli import AppGroup
+
+from database import db
+from models.user import user_movie
+from utils.cache import response_cache
+from utils.recommendations import similarity_index
+from utils.shards import shard_router
+
+recommendations_cli = AppGroup("recommendations", help="Maintain the precomputed item-to-item neighbors.")
+
+
+# flask recommendations build [--k 20] [--block-size 1024]
+@recommendations_cli.command("build")
+@click.option("--k", type=int, help="Neighbors kept per movie, RECOMMENDATIONS_K by default.")
+@click.option("--block-size", type=int, default=1024, help="Movies per block of the co-occurrence product.")
+def build(k, block_size):
+    """Rebuild the top-K similar movies of every movie from user_movie."""
+    # NumPy and SciPy are only needed here
+    from utils.similarity_matrix import rebuild_similarities
+
+    stats = rebuild_similarities(db.engine, k or similarity_index.k, block_size,
+                                 sources=shard_router.sources(user_movie.c.user_id))
+    response_cache.invalidate_all()
+    click.echo(f"Stored {stats['pairs']} neighbors of {stats['movies']} movies from {stats['interactions']} "
+               f"interactions (load {stats['load_seconds']}s, compute {stats['compute_seconds']}s, "
+               f"write {stats['write_seconds']}s).")
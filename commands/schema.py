@@ -0,0 +1,74 @@
+import click
+from flask.cli import AppGroup
+
+from database import db
+from migrations import current_version, drop_shard_foreign_keys, upgrade
+from utils.query_plans import check_query_plans
+from utils.shards import shard_router
+from utils.slow_queries import slow_query_log
+
+schema_cli = AppGroup("schema", help="Versioned schema migrations and query plan checks.")
+
+
+# flask schema upgrade
+@schema_cli.command("upgrade")
+def upgrade_schema():
+    """Apply pending schema migrations, on the primary and every shard."""
+    applied = upgrade(db.engine)
+    for version, name in applied:
+        click.echo(f"Applied {version:03d} {name}")
+    click.echo(f"Schema is at version {current_version(db.engine)}.")
+
+    for key, engine in shard_router.engines.items():
+        applied = upgrade(engine)
+        drop_shard_foreign_keys(engine)
+        for version, name in applied:
+            click.echo(f"Applied {version:03d} {name} on {key}")
+        click.echo(f"Schema of {key} is at version {current_version(engine)}.")
+
+
+# flask schema current
+@schema_cli.command("current")
+def show_current():
+    """Show the applied schema version."""
+    click.echo(current_version(db.engine))
+
+
+# flask schema explain [--verbose]
+@schema_cli.command("explain")
+@click.option("--verbose", is_flag=True, help="Print the plan of every query.")
+def explain_queries(verbose):
+    """Check via EXPLAIN that the hot endpoint queries use an index rather than a table scan."""
+    scans = 0
+    for endpoint, sql, lines, is_table_scan in check_query_plans(db.engine):
+        scans += is_table_scan
+        if is_table_scan or verbose:
+            click.echo(f"{'SCAN' if is_table_scan else 'ok  '} {endpoint}: {' '.join(sql.split())}")
+            for line in lines:
+                click.echo(f"       {line}")
+
+    if scans:
+        raise click.ClickException(f"{scans} queries scan a whole table.")
+    click.echo("All endpoint queries use an index.")
+
+
+# flask schema slow-queries [--limit 20]
+@schema_cli.command("slow-queries")
+@click.option("--limit", type=int, default=20, help="Number of statements to show.")
+def show_slow_queries(limit):
+    """Show the slowest statements of the running workers by total time, with their plans (needs METRICS_DIR)."""
+    if not slow_query_log.metrics_dir:
+        raise click.ClickException("Set METRICS_DIR for the workers and this command to share the slow query log.")
+
+    entries = slow_query_log.collect()[:limit]
+    for entry in entries:
+        endpoints = ", ".join(f"{endpoint} x{count}" for endpoint, count in entry["endpoints"].items())
+        click.echo(f"[{entry['fingerprint']}] {entry['count']}x, total {entry['total_ms']:.1f} ms, "
+                   f"max {entry['max_ms']:.1f} ms, params {entry['params']} in {endpoints}")
+        click.echo(f"    {entry['statement']}")
+        for line in entry["plan"] if entry["plan"] is not None else [entry["plan_error"]]:
+            click.echo(f"       {line}")
+    if not entries and slow_query_log.threshold <= 0:
+        click.echo("The slow query log is off, set SLOW_QUERY_MS for the workers.")
+    elif not entries:
+        click.echo(f"No statement slower than {slow_query_log.threshold * 1000:g} ms.")
@@ -0,0 +1,16 @@
+import click
+from flask.cli import AppGroup
+
+seed_cli = AppGroup("seed", help="Seed the movie catalog from the TMDb listing.")
+
+
+# flask seed movies [--force]
+@seed_cli.command("movies")
+@click.option("--force", is_flag=True, help="Fetch every page even if the catalog fingerprint is unchanged.")
+def seed_movies(force):
+    """Seed movies from API_URL, a no-op while the listing is unchanged."""
+    # imported here, so starting the app does not load the HTTP client
+    from seed import seed_if_changed
+
+    if seed_if_changed(force=force) is None:
+        raise click.ClickException("Seeding failed.")
@@ -0,0 +1,60 @@
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+
+from utils.shards import COPY_CHUNK_SIZE, Rebalancer, shard_router, sharded_tables
+
+shards_cli = AppGroup("shards", help="Inspect and rebalance the user-keyed shards of DATABASE_SHARD_URIS.")
+
+
+def require_shards():
+    if not shard_router.enabled:
+        raise click.ClickException("No shards configured, set DATABASE_SHARD_URIS.")
+
+
+# flask shards status
+@shards_cli.command("status")
+def status():
+    """Show the buckets and per-user rows of every location."""
+    require_shards()
+    bucket_map = shard_router.bucket_map(force=True)
+    owned = {}
+    for bucket in range(shard_router.buckets):
+        location, state, _ = bucket_map.get(bucket, (None, "active", None))
+        owned.setdefault(location, []).append(state)
+
+    for location in [None, *shard_router.shards]:
+        states = owned.get(location, [])
+        in_transit = len(states) - states.count("active")
+        counts = []
+        with shard_router.location_engine(location).connect() as conn:
+            for name, (table, _) in sharded_tables().items():
+                counts.append(f"{name} {conn.execute(select(func.count()).select_from(table)).scalar()}")
+        click.echo(f"{location or 'primary'}: {len(states)} buckets"
+                   + (f" ({in_transit} in transit)" if in_transit else "") + f", {', '.join(counts)} rows")
+
+
+# flask shards rebalance [--dry-run] [--step 16] [--wait SECONDS] [--chunk-size 5000]
+@shards_cli.command("rebalance")
+@click.option("--dry-run", is_flag=True, help="Only show which buckets would move.")
+@click.option("--step", type=int, default=16, help="Buckets moved at once, their users can not write meanwhile.")
+@click.option("--wait", type=float, help="Seconds for the workers to see a map change, "
+                                         "SHARD_MAP_REFRESH_SECONDS + 1 by default.")
+@click.option("--chunk-size", type=int, default=COPY_CHUNK_SIZE, help="Rows copied per insert.")
+def rebalance(dry_run, step, wait, chunk_size):
+    """Spread the buckets evenly over the shards, moving users off the primary and removed shards."""
+    require_shards()
+    rebalancer = Rebalancer(shard_router, shard_router.refresh_seconds + 1 if wait is None else wait, chunk_size,
+                            click.echo)
+    moves = rebalancer.run(step, dry_run)
+
+    if dry_run:
+        paths = {}
+        bucket_map = shard_router.bucket_map()
+        for bucket, target in moves.items():
+            source = bucket_map.get(bucket, (None, "active", None))[0]
+            paths[(source, target)] = paths.get((source, target), 0) + 1
+        for (source, target), count in paths.items():
+            click.echo(f"Would move {count} buckets from {source or 'primary'} to {target}")
+    click.echo(f"{'Planned' if dry_run else 'Moved'} {len(moves)} buckets, every shard holds "
+               f"{shard_router.buckets // len(shard_router.shards)}+ of {shard_router.buckets}.")
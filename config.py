@@ -0,0 +1,105 @@
+import os
+
+from sqlalchemy.engine import make_url
+
+from utils.adapters import str_to_bool
+from utils.metrics import TimedQueuePool
+
+
+def load_config(config):
+    """
+    Reads the service settings from the environment into config, shared by the WSGI and ASGI app factories.
+
+    :param config: app.config of a Flask app
+    """
+    config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
+    config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URI")
+    # upgrade | check | skip, see migrations.check_schema
+    config['SCHEMA_ON_START'] = os.environ.get("SCHEMA_ON_START", "upgrade")
+    config['DB_POOL_SIZE'] = os.environ.get("DB_POOL_SIZE", 5)
+    config['DB_MAX_OVERFLOW'] = os.environ.get("DB_MAX_OVERFLOW", 10)
+    config['DB_POOL_TIMEOUT'] = os.environ.get("DB_POOL_TIMEOUT", 30)
+    config['DB_POOL_RECYCLE'] = os.environ.get("DB_POOL_RECYCLE", -1)
+    config['DB_POOL_PRE_PING'] = os.environ.get("DB_POOL_PRE_PING", "false")
+    # comma separated read replica URIs, the read-only handlers are spread over them
+    config['DATABASE_REPLICA_URIS'] = os.environ.get("DATABASE_REPLICA_URIS", "")
+    config['REPLICA_STICKY_SECONDS'] = os.environ.get("REPLICA_STICKY_SECONDS", 5)
+    # comma separated shard URIs of the per-user tables (user_movie, comment), see utils.shards
+    config['DATABASE_SHARD_URIS'] = os.environ.get("DATABASE_SHARD_URIS", "")
+    config['SHARD_BUCKETS'] = os.environ.get("SHARD_BUCKETS", 256)
+    config['SHARD_MAP_REFRESH_SECONDS'] = os.environ.get("SHARD_MAP_REFRESH_SECONDS", 5)
+    config['DEBUG'] = os.environ.get("DEBUG")
+    # sqlite shares entries and invalidations between the workers and CLI commands of a host,
+    # memory only suits a single serving process
+    config['MOVIE_CACHE_BACKEND'] = os.environ.get("MOVIE_CACHE_BACKEND", "sqlite")
+    config['MOVIE_CACHE_TTL'] = os.environ.get("MOVIE_CACHE_TTL", 300)
+    config['MOVIE_CACHE_SIZE'] = os.environ.get("MOVIE_CACHE_SIZE", 1024)
+    config['MOVIE_CACHE_PATH'] = os.environ.get("MOVIE_CACHE_PATH")
+    config['METRICS_DIR'] = os.environ.get("METRICS_DIR")
+    config['N_PLUS_ONE_THRESHOLD'] = os.environ.get("N_PLUS_ONE_THRESHOLD", 5)
+    # statements slower than this are logged with their plan, unset or 0 leaves the slow query log off
+    config['SLOW_QUERY_MS'] = os.environ.get("SLOW_QUERY_MS", 0)
+    config['SLOW_QUERY_LOG_SIZE'] = os.environ.get("SLOW_QUERY_LOG_SIZE", 100)
+    config['PRINCIPAL_CACHE_TTL'] = os.environ.get("PRINCIPAL_CACHE_TTL", 60)
+    config['PRINCIPAL_CACHE_SIZE'] = os.environ.get("PRINCIPAL_CACHE_SIZE", 10000)
+    config['PASSWORD_HASH_METHOD'] = os.environ.get("PASSWORD_HASH_METHOD")
+    config['PASSWORD_SALT_LENGTH'] = os.environ.get("PASSWORD_SALT_LENGTH", 16)
+    config['PASSWORD_HASH_WORKERS'] = os.environ.get("PASSWORD_HASH_WORKERS", 2)
+    config['PASSWORD_HASH_QUEUE'] = os.environ.get("PASSWORD_HASH_QUEUE", 32)
+    config['PASSWORD_HASH_TIMEOUT'] = os.environ.get("PASSWORD_HASH_TIMEOUT", 5)
+    config['RECOMMENDATIONS_K'] = os.environ.get("RECOMMENDATIONS_K", 20)
+    # title autocomplete: poll for new movies / rebuild the whole index, see utils.suggest
+    config['SUGGEST_REFRESH_SECONDS'] = os.environ.get("SUGGEST_REFRESH_SECONDS", 5)
+    config['SUGGEST_REBUILD_SECONDS'] = os.environ.get("SUGGEST_REBUILD_SECONDS", 600)
+    config['LEADERBOARD_MIN_VOTES'] = os.environ.get("LEADERBOARD_MIN_VOTES", 3)
+    config['TRENDING_HALF_LIFE_HOURS'] = os.environ.get("TRENDING_HALF_LIFE_HOURS", 84)
+    # opt-in batching of rating and watched writes, see utils.write_behind
+    config['WRITE_BEHIND'] = os.environ.get("WRITE_BEHIND", "false")
+    config['WRITE_BEHIND_ACK'] = os.environ.get("WRITE_BEHIND_ACK", "commit")
+    config['WRITE_BEHIND_INTERVAL_MS'] = os.environ.get("WRITE_BEHIND_INTERVAL_MS", 50)
+    config['WRITE_BEHIND_BATCH_SIZE'] = os.environ.get("WRITE_BEHIND_BATCH_SIZE", 500)
+    config['WRITE_BEHIND_QUEUE_SIZE'] = os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 10000)
+    config['WRITE_BEHIND_TIMEOUT'] = os.environ.get("WRITE_BEHIND_TIMEOUT", 5)
+    config['JSON_BACKEND'] = os.environ.get("JSON_BACKEND", "auto")
+    config['JSON_FRAGMENT_CACHE_SIZE'] = os.environ.get("JSON_FRAGMENT_CACHE_SIZE", 0)
+
+    if config['SQLALCHEMY_DATABASE_URI']:
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config, config['SQLALCHEMY_DATABASE_URI'])
+    binds = {f"replica_{index}": uri for index, uri in enumerate(split_uris(config['DATABASE_REPLICA_URIS']))}
+    binds.update(shard_uris(config))
+    config['SQLALCHEMY_BINDS'] = {key: {"url": uri, **engine_options(config, uri)} for key, uri in binds.items()}
+
+
+def split_uris(value):
+    return [uri.strip() for uri in value.split(",") if uri.strip()]
+
+
+def shard_uris(config):
+    """
+    :return: dict of shard bind key -> URI of DATABASE_SHARD_URIS, in order, e.g. {"shard_0": ...}
+    """
+    return {f"shard_{index}": uri for index, uri in enumerate(split_uris(config['DATABASE_SHARD_URIS']))}
+
+
+def engine_options(config, uri, poolclass=TimedQueuePool):
+    """
+    create_engine options of the connection pool settings in config.
+
+    :param poolclass: pool used for uri, e.g. AsyncAdaptedQueuePool for asyncio engines
+    :return: dict
+    """
+    options = {"pool_pre_ping": bool(str_to_bool(str(config['DB_POOL_PRE_PING'])))}
+
+    url = make_url(uri)
+    # in-memory sqlite is a single shared connection (StaticPool), there is no pool to size
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+
+    options.update(
+        pool_size=int(config['DB_POOL_SIZE']),
+        max_overflow=int(config['DB_MAX_OVERFLOW']),
+        pool_timeout=float(config['DB_POOL_TIMEOUT']),
+        pool_recycle=int(config['DB_POOL_RECYCLE']),
+        poolclass=poolclass
+    )
+    return options
@@ -1,4 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 
-# Initialize DB instance
-db = SQLAlchemy()
+from utils.replicas import RoutingSession
+
+# Initialize DB instance, read-only handlers may route their reads to a replica bind
+db = SQLAlchemy(session_options={"class_": RoutingSession})
@@ -1,8 +1,7 @@
-from app import service
-from seed import populate_movies_from_api
+from app import create_app
 
 if __name__ == '__main__':
-    populate_movies_from_api()
-    service.run()
+    # seeding is a separate step: flask --app app seed movies
+    create_app().run()
 
     # host="0.0.0.0", port=8000
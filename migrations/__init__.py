@@ -0,0 +1,139 @@
+import importlib
+import pkgutil
+import re
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+MIGRATION_MODULE = re.compile(r"^v(\d+)_(\w+)$")
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, nullable=False)
+)
+
+
+def load_migrations():
+    """
+    Finds the migration modules of this package, named v<version>_<name>.py, each with an upgrade(conn).
+
+    :return: list of (version, name, module) ordered by version
+    """
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        match = MIGRATION_MODULE.match(module_info.name)
+        if match:
+            module = importlib.import_module(f"{__name__}.{module_info.name}")
+            migrations.append((int(match.group(1)), match.group(2), module))
+    return sorted(migrations, key=lambda migration: migration[0])
+
+
+def applied_versions(conn):
+    if not inspect(conn).has_table(schema_version.name):
+        return set()
+    return set(conn.execute(select(schema_version.c.version)).scalars())
+
+
+def upgrade(engine):
+    """
+    Applies all pending migrations, each in its own transaction together with its schema_version row.
+
+    Migrations are written to be idempotent, so a database created by an older db.create_all()
+    is brought to the same schema as a new one.
+
+    :return: list of applied (version, name)
+    """
+    applied = []
+    if not pending_migrations(engine):
+        return applied
+
+    for version, name, module in load_migrations():
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                # serialize concurrently booting workers
+                conn.execute(text("SELECT pg_advisory_xact_lock(4242)"))
+            schema_version.create(conn, checkfirst=True)
+
+            if version in applied_versions(conn):
+                continue
+
+            module.upgrade(conn)
+            conn.execute(schema_version.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+            applied.append((version, name))
+
+    return applied
+
+
+def pending_migrations(engine):
+    """
+    Schema check of the app start: one query when the schema is up to date.
+
+    :return: list of (version, name) not applied yet
+    """
+    with engine.connect() as conn:
+        versions = applied_versions(conn)
+    return [(version, name) for version, name, _ in load_migrations() if version not in versions]
+
+
+def check_schema(engine, mode="upgrade", shard=False):
+    """
+    Schema step of the app start: "upgrade" applies pending migrations, "check" only fails fast when some
+    are pending (for workers of a deploy that runs `flask schema upgrade` once beforehand), "skip" does nothing.
+
+    :param shard: engine is a shard of DATABASE_SHARD_URIS, see drop_shard_foreign_keys
+    """
+    if mode == "upgrade":
+        upgrade(engine)
+        if shard:
+            drop_shard_foreign_keys(engine)
+    elif mode == "check":
+        pending = pending_migrations(engine)
+        if pending:
+            raise RuntimeError(f"Pending schema migrations {pending}, run `flask schema upgrade`")
+    elif mode != "skip":
+        raise ValueError(f"Unknown SCHEMA_ON_START '{mode}'")
+
+
+def drop_shard_foreign_keys(engine, tables=("user_movie", "comment")):
+    """
+    A shard runs the same migrations as the primary, but the users and movies its per-user rows point to live
+    on the primary, so their foreign keys are dropped. SQLite does not enforce them, they are kept there.
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            return
+        for table in tables:
+            for foreign_key in inspect(conn).get_foreign_keys(table):
+                conn.execute(text(f'ALTER TABLE "{table}" DROP CONSTRAINT "{foreign_key["name"]}"'))
+
+
+def current_version(engine):
+    with engine.connect() as conn:
+        versions = applied_versions(conn)
+    return max(versions) if versions else None
+
+
+def has_column(conn, table, column):
+    return column in {col["name"] for col in inspect(conn).get_columns(table)}
+
+
+def has_index(conn, table, index):
+    return index in {idx["name"] for idx in inspect(conn).get_indexes(table)}
+
+
+def refresh_rating_aggregates(conn):
+    conn.execute(text("""
+        UPDATE movie SET
+            rating_sum = COALESCE((SELECT SUM(user_rating) FROM user_movie WHERE user_movie.movie_id = movie.id), 0),
+            rating_count = (SELECT COUNT(user_rating) FROM user_movie WHERE user_movie.movie_id = movie.id),
+            local_rating = (SELECT ROUND(AVG(user_rating), 1) FROM user_movie WHERE user_movie.movie_id = movie.id)
+    """))
+
+
+def refresh_comment_counts(conn):
+    conn.execute(text("""
+        UPDATE movie SET comment_count = (SELECT COUNT(*) FROM comment WHERE comment.movie_id = movie.id)
+    """))
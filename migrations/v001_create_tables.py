@@ -0,0 +1,47 @@
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, MetaData, String, Table, Text
+
+# the tables as they were before migrations existed, frozen here so a new database is built by the same steps
+# as an old one; later changes go into their own migration, never into this one
+metadata = MetaData()
+
+Table(
+    "user",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("username", String(50), unique=True, nullable=False),
+    Column("password", String(16), nullable=False)
+)
+
+Table(
+    "movie",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("title", String(250), unique=True, nullable=False),
+    Column("description", String(500), nullable=False),
+    Column("rating", Float, nullable=True),
+    Column("local_rating", Float, nullable=True),
+    Column("img_url", String(250), nullable=False)
+)
+
+Table(
+    "user_movie",
+    metadata,
+    Column("user_id", Integer, ForeignKey("user.id")),
+    Column("movie_id", Integer, ForeignKey("movie.id")),
+    Column("watched", Boolean, default=False),
+    Column("user_rating", Integer, nullable=True)
+)
+
+Table(
+    "comment",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("text", Text, nullable=False),
+    Column("author_id", Integer, ForeignKey("user.id")),
+    Column("movie_id", Integer, ForeignKey("movie.id"))
+)
+
+
+def upgrade(conn):
+    # tables that already exist are left alone, later migrations bring them up to date
+    metadata.create_all(conn)
@@ -0,0 +1,12 @@
+from sqlalchemy import text
+
+from migrations import has_column, refresh_rating_aggregates
+
+
+def upgrade(conn):
+    if has_column(conn, "movie", "rating_sum"):
+        return
+
+    conn.execute(text("ALTER TABLE movie ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text("ALTER TABLE movie ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0"))
+    refresh_rating_aggregates(conn)
@@ -0,0 +1,5 @@
+from models.seed_checkpoint import SeedCheckpoint
+
+
+def upgrade(conn):
+    SeedCheckpoint.__table__.create(conn, checkfirst=True)
@@ -0,0 +1,5 @@
+from utils.search import create_search_index
+
+
+def upgrade(conn):
+    create_search_index(conn)
@@ -0,0 +1,45 @@
+from sqlalchemy import inspect, text
+
+from migrations import refresh_rating_aggregates
+from models.user import user_movie
+
+
+def upgrade(conn):
+    if inspect(conn).get_pk_constraint("user_movie")["constrained_columns"]:
+        return
+
+    # keep one row per (user, movie): watched wins over not watched, the highest rating is kept
+    if conn.dialect.name == "sqlite":
+        # sqlite can't add a primary key to an existing table, so the table is rebuilt
+        conn.execute(text("ALTER TABLE user_movie RENAME TO user_movie_old"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_user_movie_movie_id_user_rating"))
+        user_movie.create(conn)
+        conn.execute(text("""
+            INSERT INTO user_movie (user_id, movie_id, watched, user_rating)
+            SELECT user_id, movie_id, MAX(watched), MAX(user_rating) FROM user_movie_old
+            WHERE user_id IS NOT NULL AND movie_id IS NOT NULL
+            GROUP BY user_id, movie_id
+        """))
+        conn.execute(text("DROP TABLE user_movie_old"))
+    else:
+        conn.execute(text("DELETE FROM user_movie WHERE user_id IS NULL OR movie_id IS NULL"))
+        conn.execute(text("""
+            UPDATE user_movie SET
+                watched = dedup.watched,
+                user_rating = dedup.user_rating
+            FROM (
+                SELECT user_id, movie_id, BOOL_OR(watched) AS watched, MAX(user_rating) AS user_rating
+                FROM user_movie GROUP BY user_id, movie_id HAVING COUNT(*) > 1
+            ) AS dedup
+            WHERE user_movie.user_id = dedup.user_id AND user_movie.movie_id = dedup.movie_id
+        """))
+        conn.execute(text("""
+            DELETE FROM user_movie a USING user_movie b
+            WHERE a.user_id = b.user_id AND a.movie_id = b.movie_id AND a.ctid > b.ctid
+        """))
+        conn.execute(text("ALTER TABLE user_movie ALTER COLUMN user_id SET NOT NULL"))
+        conn.execute(text("ALTER TABLE user_movie ALTER COLUMN movie_id SET NOT NULL"))
+        conn.execute(text("ALTER TABLE user_movie ADD PRIMARY KEY (user_id, movie_id)"))
+
+    # removed duplicates may have been counted in the rating aggregates
+    refresh_rating_aggregates(conn)
@@ -0,0 +1,15 @@
+from sqlalchemy import text
+
+from migrations import has_index
+
+INDEXES = [
+    ("user_movie", "ix_user_movie_movie_id_user_rating", "movie_id, user_rating"),
+    ("comment", "ix_comment_author_id", "author_id"),
+    ("comment", "ix_comment_movie_id", "movie_id")
+]
+
+
+def upgrade(conn):
+    for table, index, columns in INDEXES:
+        if not has_index(conn, table, index):
+            conn.execute(text(f'CREATE INDEX {index} ON "{table}" ({columns})'))
@@ -0,0 +1,8 @@
+from sqlalchemy import text
+
+from migrations import has_column
+
+
+def upgrade(conn):
+    if not has_column(conn, "user", "session_version"):
+        conn.execute(text('ALTER TABLE "user" ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0'))
@@ -0,0 +1,7 @@
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    # password hashes never fit the original VARCHAR(16), sqlite just doesn't enforce the length
+    if conn.dialect.name == "postgresql":
+        conn.execute(text('ALTER TABLE "user" ALTER COLUMN password TYPE VARCHAR(255)'))
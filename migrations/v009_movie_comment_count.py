@@ -0,0 +1,22 @@
+from sqlalchemy import text
+
+from migrations import has_column, has_index, refresh_comment_counts
+
+INDEXES = [
+    ("comment", "ix_comment_movie_id_id", "movie_id, id"),
+    ("comment", "ix_comment_author_id_id", "author_id, id")
+]
+# covered by the leading column of the indexes above
+REPLACED_INDEXES = ["ix_comment_movie_id", "ix_comment_author_id"]
+
+
+def upgrade(conn):
+    for table, index, columns in INDEXES:
+        if not has_index(conn, table, index):
+            conn.execute(text(f'CREATE INDEX {index} ON "{table}" ({columns})'))
+    for index in REPLACED_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+    if not has_column(conn, "movie", "comment_count"):
+        conn.execute(text("ALTER TABLE movie ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0"))
+        refresh_comment_counts(conn)
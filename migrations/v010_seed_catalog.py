@@ -0,0 +1,5 @@
+from models.seed_catalog import SeedCatalog
+
+
+def upgrade(conn):
+    SeedCatalog.__table__.create(conn, checkfirst=True)
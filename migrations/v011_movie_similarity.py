@@ -0,0 +1,6 @@
+from models.similarity import movie_norm, movie_similarity
+
+
+def upgrade(conn):
+    movie_similarity.create(conn, checkfirst=True)
+    movie_norm.create(conn, checkfirst=True)
@@ -0,0 +1,17 @@
+import time
+
+from sqlalchemy import select
+
+from models.leaderboard import leaderboard_entry, leaderboard_state
+from utils.leaderboards import DEFAULT_MIN_VOTES, TRENDING, top_rated_refresh_statements
+
+
+def upgrade(conn):
+    leaderboard_entry.create(conn, checkfirst=True)
+    leaderboard_state.create(conn, checkfirst=True)
+
+    if conn.execute(select(leaderboard_state.c.board).where(leaderboard_state.c.board == TRENDING)).first() is None:
+        conn.execute(leaderboard_state.insert().values(board=TRENDING, epoch=time.time()))
+        # `flask leaderboards rebuild` redoes this when LEADERBOARD_MIN_VOTES differs from the default
+        for statement in top_rated_refresh_statements(DEFAULT_MIN_VOTES):
+            conn.execute(statement)
@@ -0,0 +1,6 @@
+from models.shard import id_allocation, shard_bucket
+
+
+def upgrade(conn):
+    shard_bucket.create(conn, checkfirst=True)
+    id_allocation.create(conn, checkfirst=True)
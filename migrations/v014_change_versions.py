@@ -0,0 +1,31 @@
+from sqlalchemy import text
+
+from migrations import has_column, has_index
+from models.change import change_tombstone, change_version
+
+# rows written before change versions exist are version 0, a first sync (?since=0) returns them
+COLUMNS = ["user_movie", "comment"]
+INDEXES = [
+    ("user_movie", "ix_user_movie_user_id_version", "user_id, version"),
+    ("comment", "ix_comment_author_id_version", "author_id, version")
+]
+
+
+def upgrade(conn):
+    for table in COLUMNS:
+        if not has_column(conn, table, "version"):
+            conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN version INTEGER NOT NULL DEFAULT 0'))
+    for table, index, columns in INDEXES:
+        if not has_index(conn, table, index):
+            conn.execute(text(f'CREATE INDEX {index} ON "{table}" ({columns})'))
+
+    change_version.create(conn, checkfirst=True)
+    change_tombstone.create(conn, checkfirst=True)
+    # users that already have rows start at version 1, so polling with the token of their first sync is empty
+    conn.execute(text("""
+        INSERT INTO change_version (user_id, version)
+        SELECT user_id, 1 FROM (
+            SELECT user_id FROM user_movie UNION SELECT author_id FROM comment WHERE author_id IS NOT NULL
+        ) AS writers
+        WHERE user_id NOT IN (SELECT user_id FROM change_version)
+    """))
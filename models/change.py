@@ -0,0 +1,20 @@
+from database import db
+
+# per user change counter of the watchlist and comment rows, see utils.changes
+# one row per user next to the user's rows, so its lock orders the user's writes and it moves with them between shards
+change_version = db.Table(
+    "change_version",
+    db.Column("user_id", db.Integer, primary_key=True, autoincrement=False),
+    db.Column("version", db.Integer, nullable=False)
+)
+
+# deleted watchlist entries and comments, the version of their delete, read by the ?since= delta views
+# keyed by the deleted entry, so deleting and re-adding the same movie keeps one row
+change_tombstone = db.Table(
+    "change_tombstone",
+    db.Column("user_id", db.Integer, primary_key=True, autoincrement=False),
+    db.Column("kind", db.String(20), primary_key=True),
+    db.Column("key", db.Integer, primary_key=True, autoincrement=False),
+    db.Column("version", db.Integer, nullable=False),
+    db.Index("ix_change_tombstone_user_id_kind_version", "user_id", "kind", "version")
+)
@@ -2,7 +2,16 @@ from database import db
 
 
 class Comment(db.Model):
+    # comment pages are keyset pages ordered by id within one movie or author
+    __table_args__ = (
+        db.Index("ix_comment_movie_id_id", "movie_id", "id"),
+        db.Index("ix_comment_author_id_id", "author_id", "id"),
+        db.Index("ix_comment_author_id_version", "author_id", "version")
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text, nullable=False)
     author_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     movie_id = db.Column(db.Integer, db.ForeignKey("movie.id"))
+    # change version of the comment's last write, see utils.changes
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
@@ -0,0 +1,18 @@
+from database import db
+
+# maintained top-N lists, see utils.leaderboards
+# top N of a board is read off the (board, score) index, so it costs N rows whatever the catalog size
+leaderboard_entry = db.Table(
+    "leaderboard_entry",
+    db.Column("board", db.String(20), primary_key=True),
+    db.Column("movie_id", db.Integer, db.ForeignKey("movie.id"), primary_key=True),
+    db.Column("score", db.Float, nullable=False),
+    db.Index("ix_leaderboard_entry_board_score", "board", "score", "movie_id")
+)
+
+# per board epoch (unix seconds) of the time-decayed scores, scores are stored scaled to it
+leaderboard_state = db.Table(
+    "leaderboard_state",
+    db.Column("board", db.String(20), primary_key=True),
+    db.Column("epoch", db.Float, nullable=False)
+)
@@ -7,5 +7,10 @@ class Movie(db.Model):
     description = db.Column(db.String(500), nullable=False)
     rating = db.Column(db.Float, nullable=True)
     local_rating = db.Column(db.Float, nullable=True)
+    # running aggregates of user_movie.user_rating, local_rating = rating_sum / rating_count
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # number of comments, kept in step by the comment endpoints so the detail view never counts them
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     img_url = db.Column(db.String(250), nullable=False)
     comments = db.relationship("Comment", backref="parent_movie")
@@ -0,0 +1,9 @@
+from database import db
+
+
+class SeedCatalog(db.Model):
+    # fingerprint of the listing at api_url as of the last complete seeding, reruns no-op while it matches
+    api_url = db.Column(db.String(500), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    total_pages = db.Column(db.Integer, nullable=False)
+    seeded_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,9 @@
+from database import db
+
+
+class SeedCheckpoint(db.Model):
+    # one row per fetched page of the TMDb listing, so reruns can skip pages that did not change
+    page = db.Column(db.Integer, primary_key=True)
+    etag = db.Column(db.String(250), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+# Kept off db.metadata like migrations.schema_version: utils.shards reads them, and db.session's RoutingSession
+# imports utils.shards before db exists. Created by migration v013.
+metadata = MetaData()
+
+# user-keyed sharding, see utils.shards: users are hashed into buckets (user_id % SHARD_BUCKETS), a bucket lives
+# on one shard. Buckets without a row live on the primary, which is where all user rows are before sharding.
+shard_bucket = Table(
+    "shard_bucket",
+    metadata,
+    Column("bucket", Integer, primary_key=True, autoincrement=False),
+    # bind key of the shard, e.g. shard_0, NULL for the primary
+    Column("shard", String(50), nullable=True),
+    # active | moving (writes refused while the rows are copied) | draining (the old location still holds a copy)
+    Column("state", String(20), nullable=False, server_default="active"),
+    # location a draining bucket is deleted from, NULL for the primary
+    Column("source", String(50), nullable=True)
+)
+
+# next value of ids that must be unique across shards, e.g. comment ids
+id_allocation = Table(
+    "id_allocation",
+    metadata,
+    Column("name", String(50), primary_key=True),
+    Column("next_id", Integer, nullable=False)
+)
@@ -0,0 +1,17 @@
+from database import db
+
+# precomputed item-to-item neighbors, see utils.recommendations
+# dot is the weighted co-occurrence of the two movies over all watchlists, at most K rows per movie_id
+movie_similarity = db.Table(
+    "movie_similarity",
+    db.Column("movie_id", db.Integer, db.ForeignKey("movie.id"), primary_key=True),
+    db.Column("similar_movie_id", db.Integer, db.ForeignKey("movie.id"), primary_key=True),
+    db.Column("dot", db.Float, nullable=False)
+)
+
+# squared norm of each movie's weight vector, cosine = dot / sqrt(norm_sq * norm_sq)
+movie_norm = db.Table(
+    "movie_norm",
+    db.Column("movie_id", db.Integer, db.ForeignKey("movie.id"), primary_key=True),
+    db.Column("norm_sq", db.Float, nullable=False)
+)
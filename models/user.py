@@ -4,16 +4,31 @@ from flask_login import UserMixin
 
 user_movie = db.Table(
     "user_movie",
-    db.Column("user_id", db.Integer, db.ForeignKey("user.id")),
-    db.Column("movie_id", db.Integer, db.ForeignKey("movie.id")),
+    db.Column("user_id", db.Integer, db.ForeignKey("user.id"), primary_key=True),
+    db.Column("movie_id", db.Integer, db.ForeignKey("movie.id"), primary_key=True),
     db.Column("watched", db.Boolean, default=False),
-    db.Column("user_rating", db.Integer, nullable=True)
+    db.Column("user_rating", db.Integer, nullable=True),
+    # change version of the row's last write, see utils.changes
+    db.Column("version", db.Integer, nullable=False, default=0, server_default="0"),
+    # covers the per-movie rating aggregation without touching the table
+    db.Index("ix_user_movie_movie_id_user_rating", "movie_id", "user_rating"),
+    db.Index("ix_user_movie_user_id_version", "user_id", "version")
 )
 
 
+def session_id(user_id, session_version):
+    # value kept in the login session, see utils.principal
+    return f"{user_id}:{session_version}"
+
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
-    password = db.Column(db.String(16), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
+    # bumped on password change, so sessions started before it are no longer accepted
+    session_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     watchlist = db.relationship('Movie', secondary=user_movie, backref='watched_by_users')
     comments = db.relationship("Comment", backref="comment_author")
+
+    def get_id(self):
+        return session_id(self.id, self.session_version)
@@ -1,9 +1,21 @@
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 from dotenv import load_dotenv
-from flask import jsonify
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
 from database import db
 from models.movie import Movie
+from models.seed_catalog import SeedCatalog
+from models.seed_checkpoint import SeedCheckpoint
+from utils.cache import response_cache
+from utils.dialects import dialect_insert
 
 load_dotenv()
 
@@ -11,36 +23,219 @@ MOVIE_DB_API_KEY = os.environ.get("MOVIE_DB_API_KEY")
 API_URL = os.environ.get("API_URL")
 MOVIE_DB_IMAGE_URL = os.environ.get("MOVIE_DB_IMAGE_URL")
 
+SEED_MAX_PAGES = int(os.environ.get("SEED_MAX_PAGES", 20))
+SEED_WORKERS = int(os.environ.get("SEED_WORKERS", 8))
+SEED_CHUNK_SIZE = int(os.environ.get("SEED_CHUNK_SIZE", 500))
+SEED_TIMEOUT = float(os.environ.get("SEED_TIMEOUT", 10))
+
+
+def make_http_session(workers=SEED_WORKERS):
+    """
+    Pooled HTTP session that retries connection errors, 429 and 5xx with exponential backoff.
+    """
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_page(http, api_url, page, etag=None):
+    """
+    Fetches one page of the listing, sending the stored ETag so unchanged pages come back as 304.
+
+    :return: (page, status_code, payload or None, etag)
+    """
+    headers = {"If-None-Match": etag} if etag else {}
+    try:
+        response = http.get(api_url, params={"page": page}, headers=headers, timeout=SEED_TIMEOUT)
+    except requests.RequestException as err:
+        print(f"API request for page {page} failed: {err}")
+        return page, None, None, None
+
+    if response.status_code == 304:
+        return page, 304, None, etag
+    if response.status_code != 200:
+        return page, response.status_code, None, None
+    return page, 200, response.json(), response.headers.get("ETag")
+
+
+def movie_row(movie_data):
+    return {
+        "title": movie_data.get("name", ""),
+        "description": movie_data.get("overview", ""),
+        "rating": movie_data.get("vote_average", ""),
+        "img_url": f"{MOVIE_DB_IMAGE_URL}/{movie_data.get('poster_path', '')}"
+    }
+
+
+def content_hash(payload):
+    return hashlib.sha256(json.dumps(payload.get("results", []), sort_keys=True).encode()).hexdigest()
+
+
+def catalog_fingerprint(total_pages, first_page_hash):
+    return hashlib.sha256(json.dumps([total_pages, first_page_hash]).encode()).hexdigest()
+
+
+def upsert_movies(session, rows):
+    """
+    Inserts movies, updating the TMDb fields of rows whose title already exists.
+    """
+    # the same title twice in one statement would make ON CONFLICT touch a row twice
+    rows = list({row["title"]: row for row in rows}.values())
+    if not rows:
+        return 0
+
+    statement = dialect_insert(session, Movie)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Movie.title],
+        set_={
+            "description": statement.excluded.description,
+            "rating": statement.excluded.rating,
+            "img_url": statement.excluded.img_url
+        }
+    )
+    session.execute(statement, rows)
+    return len(rows)
+
+
+def save_checkpoints(session, checkpoints):
+    if not checkpoints:
+        return
 
-def populate_movies_from_api():
-    response = requests.get(API_URL)
-    data = response.json()
+    statement = dialect_insert(session, SeedCheckpoint)
+    statement = statement.on_conflict_do_update(
+        index_elements=[SeedCheckpoint.page],
+        set_={
+            "etag": statement.excluded.etag,
+            "content_hash": statement.excluded.content_hash,
+            "fetched_at": statement.excluded.fetched_at
+        }
+    )
+    session.execute(statement, checkpoints)
 
-    if response.status_code == 200:
-        for movie_data in data.get("results", []):
-            title = movie_data.get("name", "")
-            description = movie_data.get("overview", "")
-            rating = movie_data.get("vote_average", "")
-            img_url = movie_data.get("poster_path", "")
 
-            new_movie = Movie(
-                title=title,
-                description=description,
-                rating=rating,
-                img_url=f"{MOVIE_DB_IMAGE_URL}/{img_url}",
-            )
+def populate_movies_from_api(api_url=API_URL, max_pages=SEED_MAX_PAGES, workers=SEED_WORKERS,
+                             chunk_size=SEED_CHUNK_SIZE):
+    """
+    Seeds movies from the TMDb listing at api_url.
 
-            try:
-                db.session.add(new_movie)
-            except Exception as err:
-                db.session.rollback()
-                print(f"Error inserting data: {err}")
+    Pages are fetched concurrently, upserted in chunks of chunk_size rows and checkpointed together
+    with their rows, so an interrupted run resumes where it stopped and reruns skip unchanged pages.
+
+    :return: dict with seeding stats, or None if the API request failed
+    """
+    started = time.perf_counter()
+    known = {checkpoint.page: checkpoint for checkpoint in SeedCheckpoint.query.all()}
+    http = make_http_session(workers)
+
+    # the first page tells how many pages there are
+    first = fetch_page(http, api_url, 1)
+    if first[1] != 200:
+        print("API request failed")
+        return None
+
+    total_pages = min(first[2].get("total_pages", 1), max_pages)
+    stats = {"pages": total_pages, "pages_skipped": 0, "pages_failed": 0, "rows": 0}
+    rows, checkpoints = [], []
+
+    def flush():
+        stats["rows"] += upsert_movies(db.session, rows)
+        save_checkpoints(db.session, checkpoints)
+        db.session.commit()
+        rows.clear()
+        checkpoints.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pages = pool.map(
+            lambda page: fetch_page(http, api_url, page, known[page].etag if page in known else None),
+            range(2, total_pages + 1)
+        )
 
         try:
-            db.session.commit()
-            print("Database seeding complete.")
+            for page, status, payload, etag in [first, *pages]:
+                if status == 304:
+                    stats["pages_skipped"] += 1
+                    continue
+                if status != 200:
+                    stats["pages_failed"] += 1
+                    print(f"API request for page {page} failed with status {status}")
+                    continue
+
+                digest = content_hash(payload)
+                if page in known and known[page].content_hash == digest:
+                    stats["pages_skipped"] += 1
+                    continue
+
+                rows.extend(movie_row(movie_data) for movie_data in payload.get("results", []))
+                checkpoints.append({"page": page, "etag": etag, "content_hash": digest, "fetched_at": datetime.utcnow()})
+
+                if len(rows) >= chunk_size:
+                    flush()
+
+            flush()
         except Exception as err:
             db.session.rollback()
-            return jsonify({"error": f"db error: '{err}'"}), 500
+            print(f"Error inserting data: {err}")
+            return None
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_second"] = round(stats["rows"] / elapsed, 1) if elapsed else 0.0
+
+    if stats["rows"]:
+        response_cache.invalidate_all()
+
+    print(f"Database seeding complete: {stats['rows']} rows from {total_pages} pages "
+          f"({stats['pages_skipped']} unchanged, {stats['pages_failed']} failed), "
+          f"{stats['rows_per_second']} rows/s.")
+    return stats
+
+
+def seed_if_changed(api_url=API_URL, max_pages=SEED_MAX_PAGES, workers=SEED_WORKERS, chunk_size=SEED_CHUNK_SIZE,
+                    force=False):
+    """
+    Seeds movies unless the listing still matches the catalog fingerprint of the last complete run.
+
+    The fingerprint covers the page count and the content of the first page, so one conditional request
+    tells whether anything changed. Changes confined to later pages are picked up with force=True.
+
+    :return: dict with seeding stats, {"unchanged": True} for a no-op, or None if the API request failed
+    """
+    catalog = db.session.get(SeedCatalog, api_url)
+    first_checkpoint = db.session.get(SeedCheckpoint, 1)
+    etag = first_checkpoint.etag if catalog and first_checkpoint else None
+
+    _, status, payload, _ = fetch_page(make_http_session(1), api_url, 1, etag)
+    if status == 304:
+        total_pages, first_page_hash = catalog.total_pages, first_checkpoint.content_hash
+    elif status == 200:
+        total_pages, first_page_hash = payload.get("total_pages", 1), content_hash(payload)
     else:
         print("API request failed")
+        return None
+
+    fingerprint = catalog_fingerprint(min(total_pages, max_pages), first_page_hash)
+    if catalog and catalog.fingerprint == fingerprint and not force:
+        print(f"Catalog unchanged since {catalog.seeded_at:%Y-%m-%d %H:%M}, nothing to seed.")
+        return {"unchanged": True}
+
+    stats = populate_movies_from_api(api_url, max_pages, workers, chunk_size)
+    # a partial run must not be taken for an unchanged catalog next time
+    if stats and not stats["pages_failed"]:
+        db.session.merge(SeedCatalog(
+            api_url=api_url,
+            fingerprint=fingerprint,
+            total_pages=total_pages,
+            seeded_at=datetime.utcnow()
+        ))
+        db.session.commit()
+    return stats
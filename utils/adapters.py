@@ -1,5 +1,8 @@
 import re
 
+SPECIAL_CHARACTERS = re.compile(r'[^a-zA-Z0-9\s]')
+WHITESPACE = re.compile(r'\s+')
+
 
 def str_to_bool(s: str) -> bool or None:
     if s == "true" or s == "True":
@@ -11,6 +14,6 @@ def str_to_bool(s: str) -> bool or None:
 
 
 def remove_special_characters(input_string):
-    cleaned_string = re.sub(r'[^a-zA-Z0-9\s]', '', input_string)
-    cleaned_string = re.sub(r'\s+', ' ', cleaned_string)
+    cleaned_string = SPECIAL_CHARACTERS.sub('', input_string)
+    cleaned_string = WHITESPACE.sub(' ', cleaned_string)
     return cleaned_string
@@ -0,0 +1,141 @@
+from http.cookies import SimpleCookie
+
+from flask import current_app, g, request
+from werkzeug.test import EnvironBuilder
+
+MAX_IDS = 100
+MAX_BATCH_REQUESTS = 20
+BATCH_METHODS = ("GET", "POST", "PUT", "DELETE")
+# response headers a client may need from a sub-request, Set-Cookie is merged into the batch response instead
+FORWARDED_HEADERS = ("ETag", "Retry-After", "Location")
+
+
+def parse_id_list(value):
+    """
+    Reads a comma separated list of ids, e.g. ?ids=1,2,3, in order and without repeats.
+
+    :return: list of ids, raises ValueError on bad input
+    """
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(",") if part.strip()))
+    except ValueError:
+        raise ValueError("'ids' must be a comma separated list of integers")
+
+    if not ids:
+        raise ValueError("'ids' must not be empty")
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} ids per request")
+    return ids
+
+
+def movies_with_comments(movies, comments, movie_ids):
+    """
+    Nests the first comments of each movie into its detail row, in the requested order.
+
+    :param movies: detail rows of the movies that exist
+    :param comments: rows of first_comments_of_movies_statement
+    :return: (list of movie dicts with "comments", list of the ids that were not found)
+    """
+    details = {movie.id: {**movie._asdict(), "comments": []} for movie in movies}
+    for comment in comments:
+        comment = comment._asdict()
+        details[comment.pop("movie_id")]["comments"].append(comment)
+
+    found = [details[movie_id] for movie_id in movie_ids if movie_id in details]
+    return found, [movie_id for movie_id in movie_ids if movie_id not in details]
+
+
+def parse_batch_requests(data):
+    """
+    Validates the body of POST /batch: {"requests": [{"method": "GET", "path": "/movies/1", "body": {...}}, ...]}
+
+    :return: list of (method, path, body), raises ValueError on bad input
+    """
+    items = data.get("requests") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError("Requests are missing or empty")
+    if len(items) > MAX_BATCH_REQUESTS:
+        raise ValueError(f"At most {MAX_BATCH_REQUESTS} requests per batch")
+
+    parsed = []
+    for index, item in enumerate(items):
+        method = str(item.get("method", "GET")).upper() if isinstance(item, dict) else None
+        path = item.get("path") if isinstance(item, dict) else None
+
+        if method not in BATCH_METHODS:
+            raise ValueError(f"Request {index}: method must be one of {', '.join(BATCH_METHODS)}")
+        if not isinstance(path, str) or not path.startswith("/") or path.startswith("//"):
+            raise ValueError(f"Request {index}: path must be an absolute path of this API")
+        if path.split("?")[0].rstrip("/") == "/batch":
+            raise ValueError(f"Request {index}: batches can not be nested")
+        parsed.append((method, path, item.get("body")))
+    return parsed
+
+
+def cookie_header(cookies):
+    return "; ".join(f"{name}={value}" for name, value in cookies.items())
+
+
+def update_cookies(cookies, set_cookie_headers):
+    """
+    Applies the Set-Cookie headers of a sub-response to the cookies sent with the next sub-requests.
+    """
+    for header in set_cookie_headers:
+        for name, morsel in SimpleCookie(header).items():
+            if morsel["max-age"] == "0" or morsel["expires"].startswith("Thu, 01 Jan 1970"):
+                cookies.pop(name, None)
+            else:
+                cookies[name] = morsel.value
+
+
+def sub_response(response):
+    body = response.get_json(silent=True) if response.is_json else response.get_data(as_text=True)
+    headers = {name: response.headers[name] for name in FORWARDED_HEADERS if name in response.headers}
+    return {"status": response.status_code, "headers": headers, "body": body}
+
+
+def run_batch(requests):
+    """
+    Runs sub-requests one after the other through the app's full dispatch, within the current app context,
+    so they share its database session and connection, and the client pays a single round trip.
+
+    Sub-requests carry the batch request's cookies, updated by the Set-Cookie headers of the ones before,
+    e.g. a login followed by calls that need it.
+
+    :param requests: list of (method, path, body) from parse_batch_requests
+    :return: (list of sub-response dicts in request order, list of Set-Cookie headers to send back)
+    """
+    app = current_app._get_current_object()
+    cookies = dict(request.cookies)
+    set_cookies = []
+    results = []
+
+    for method, path, body in requests:
+        builder = EnvironBuilder(
+            path=path,
+            method=method,
+            base_url=request.host_url,
+            json=body if body is not None and method != "GET" else None,
+            headers={"Cookie": cookie_header(cookies)} if cookies else None,
+            environ_base={"REMOTE_ADDR": request.remote_addr}
+        )
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+
+        # the logged in user is cached on g, which the sub-requests share, so resolve it from their cookies
+        g.pop("_login_user", None)
+        with app.request_context(environ):
+            try:
+                response = app.full_dispatch_request()
+            except Exception as err:
+                response = app.make_response(app.handle_exception(err))
+            # streamed bodies are read while the sub-request context is still there
+            results.append(sub_response(response))
+
+        update_cookies(cookies, response.headers.getlist("Set-Cookie"))
+        set_cookies.extend(response.headers.getlist("Set-Cookie"))
+
+    g.pop("_login_user", None)
+    return results, set_cookies
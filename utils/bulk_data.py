@@ -0,0 +1,292 @@
+import csv
+import io
+import json
+import os
+import time
+
+from sqlalchemy import Boolean, Float, Integer, func, select, text, tuple_
+
+from migrations import refresh_comment_counts, refresh_rating_aggregates
+from models.comment import Comment
+from models.movie import Movie
+from models.user import user_movie
+from utils.adapters import str_to_bool
+from utils.comments import rebuild_comment_counts
+from utils.dialects import dialect_insert
+from utils.ratings import rebuild_rating_aggregates
+from utils.serializers import RowEncoder
+from utils.shards import shard_router
+
+FORMATS = ("jsonl", "csv")
+DEFAULT_CHUNK_SIZE = 5000
+PROGRESS_SECONDS = 2.0
+
+# exported columns per dataset, the derived ones (rating aggregates, comment_count) are rebuilt after an import
+DATASETS = {
+    "movies": (Movie.__table__, ("id", "title", "description", "rating", "img_url")),
+    "watchlists": (user_movie, ("user_id", "movie_id", "watched", "user_rating")),
+    "comments": (Comment.__table__, ("id", "text", "author_id", "movie_id"))
+}
+
+
+def file_format(path, fmt=None):
+    """
+    :return: fmt, or the format of path's extension, jsonl unless it ends with .csv
+    """
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def checkpoint_path(path):
+    return f"{path}.checkpoint"
+
+
+class Progress:
+    """
+    Counts transferred rows and reports rows per second through echo, at most every PROGRESS_SECONDS.
+    """
+
+    def __init__(self, label, echo, rows=0):
+        self.label = label
+        self.echo = echo
+        self.rows = rows
+        self.started = time.perf_counter()
+        self._resumed_rows = rows
+        self._last_report = self.started
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return (self.rows - self._resumed_rows) / elapsed if elapsed else 0.0
+
+    def add(self, rows):
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self._last_report >= PROGRESS_SECONDS:
+            self._last_report = now
+            self.echo(f"{self.label}: {self.rows} rows, {self.rate():.0f} rows/s")
+
+    def finish(self):
+        """
+        :return: dict of transfer stats
+        """
+        elapsed = time.perf_counter() - self.started
+        return {"rows": self.rows, "seconds": round(elapsed, 3), "rows_per_second": round(self.rate(), 1)}
+
+
+def export_statement(table, columns, after=None):
+    """
+    Select of the exported columns ordered by primary key, resuming after the key tuple `after`.
+    """
+    keys = list(table.primary_key.columns)
+    statement = select(*(table.c[name] for name in columns)).order_by(*keys)
+    if after is not None:
+        # row value comparison, so the composite key of user_movie seeks its primary key index too
+        statement = statement.where(tuple_(*keys) > tuple_(*after) if len(keys) > 1 else keys[0] > after[0])
+    return statement
+
+
+def encode_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def encode_lines(fmt, columns, rows, encoder):
+    """
+    :return: bytes of rows as JSON lines, or CSV records in the order of columns
+    """
+    if fmt == "jsonl":
+        return b"".join(encoder.dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows([encode_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+def csv_header(columns):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(columns)
+    return buffer.getvalue().encode()
+
+
+def read_checkpoint(path):
+    try:
+        with open(checkpoint_path(path)) as checkpoint:
+            return json.load(checkpoint)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, state):
+    # replaced atomically, a crash leaves either the previous or the new checkpoint
+    target = checkpoint_path(path)
+    with open(f"{target}.tmp", "w") as checkpoint:
+        json.dump(state, checkpoint)
+    os.replace(f"{target}.tmp", target)
+
+
+def export_dataset(engine, dataset, path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE, resume=False, echo=print):
+    """
+    Streams a dataset to a JSONL or CSV file from a server-side cursor, chunk_size rows at a time.
+
+    After each chunk the file is flushed and <path>.checkpoint records the last exported key and the file
+    offset, so resume=True truncates a partial tail and continues after that key. The checkpoint is removed
+    once the export completed.
+
+    :return: dict of transfer stats
+    """
+    check_unsharded(dataset)
+    table, columns = DATASETS[dataset]
+    fmt = file_format(path, fmt)
+    after, offset, rows = None, 0, 0
+
+    if resume:
+        state = read_checkpoint(path)
+        if state is None:
+            raise ValueError(f"No checkpoint at {checkpoint_path(path)}, nothing to resume")
+        if state["dataset"] != dataset or state["format"] != fmt:
+            raise ValueError(f"{checkpoint_path(path)} belongs to a {state['format']} export of {state['dataset']}")
+        after, offset, rows = state["after"], state["offset"], state["rows"]
+
+    encoder = RowEncoder(sort_keys=False)
+    progress = Progress(f"export {dataset}", echo, rows)
+
+    with open(path, "r+b" if resume else "wb") as output, engine.connect() as conn:
+        output.truncate(offset)
+        output.seek(offset)
+        if fmt == "csv" and offset == 0:
+            output.write(csv_header(columns))
+
+        key_indexes = [columns.index(key.name) for key in table.primary_key.columns]
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            export_statement(table, columns, after)
+        )
+        for partition in result.partitions():
+            output.write(encode_lines(fmt, columns, partition, encoder))
+            output.flush()
+            os.fsync(output.fileno())
+
+            progress.add(len(partition))
+            write_checkpoint(path, {
+                "dataset": dataset,
+                "format": fmt,
+                "after": [partition[-1][index] for index in key_indexes],
+                "offset": output.tell(),
+                "rows": progress.rows
+            })
+
+    if os.path.exists(checkpoint_path(path)):
+        os.remove(checkpoint_path(path))
+    return progress.finish()
+
+
+def decode_csv_value(column, value):
+    # empty fields are NULL for numbers and booleans, text keeps them as empty strings
+    if isinstance(column.type, (Integer, Float, Boolean)) and value == "":
+        return None
+    if isinstance(column.type, Boolean):
+        return str_to_bool(value)
+    if isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(column.type, Float):
+        return float(value)
+    return value
+
+
+def read_records(path, fmt, table, columns):
+    """
+    Yields one dict per line of a JSONL or CSV file, with exactly the given columns.
+    """
+    with open(path, newline="", encoding="utf-8") as source:
+        if fmt == "jsonl":
+            for line in source:
+                if line.strip():
+                    record = json.loads(line)
+                    yield {name: record.get(name) for name in columns}
+        else:
+            for record in csv.DictReader(source):
+                yield {name: decode_csv_value(table.c[name], record.get(name, "")) for name in columns}
+
+
+def upsert_statement(session, table, columns):
+    """
+    INSERT ... ON CONFLICT (primary key) DO UPDATE of the imported columns, executed with a chunk of records.
+    """
+    keys = [key.name for key in table.primary_key.columns]
+    statement = dialect_insert(session, table)
+    return statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: statement.excluded[name] for name in columns if name not in keys}
+    )
+
+
+def sync_id_sequence(session, table):
+    """
+    Moves a Postgres serial sequence past the imported ids, so later inserts do not collide with them.
+    """
+    if session.get_bind().dialect.name != "postgresql" or "id" not in table.c:
+        return
+    session.execute(
+        text(f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), :max_id)"),
+        {"max_id": session.execute(select(func.coalesce(func.max(table.c.id), 1))).scalar()}
+    )
+
+
+def check_unsharded(dataset):
+    """
+    Raises ValueError for the per-user datasets once they are sharded, they are streamed from the primary only.
+    """
+    if shard_router.enabled and dataset != "movies":
+        raise ValueError(f"{dataset} are spread over DATABASE_SHARD_URIS, export and import them per shard")
+
+
+def refresh_derived_columns(session, dataset):
+    """
+    Recomputes the movie columns that depend on the imported dataset. Does not commit.
+    """
+    if shard_router.enabled:
+        # the SQL refreshes only see the per-user rows left on the primary
+        rebuild_rating_aggregates(session)
+        rebuild_comment_counts(session)
+        return
+
+    conn = session.connection()
+    if dataset in ("movies", "watchlists"):
+        refresh_rating_aggregates(conn)
+    if dataset in ("movies", "comments"):
+        refresh_comment_counts(conn)
+
+
+def import_dataset(session, dataset, path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE, echo=print):
+    """
+    Upserts a JSONL or CSV file into a dataset by primary key, one executemany and commit per chunk_size records,
+    so only one chunk is held in memory. Rerunning an interrupted import is safe.
+
+    :return: dict of transfer stats
+    """
+    check_unsharded(dataset)
+    table, columns = DATASETS[dataset]
+    fmt = file_format(path, fmt)
+    statement = upsert_statement(session, table, columns)
+    progress = Progress(f"import {dataset}", echo)
+
+    chunk = []
+    for record in read_records(path, fmt, table, columns):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            session.execute(statement, chunk)
+            session.commit()
+            progress.add(len(chunk))
+            chunk = []
+    if chunk:
+        session.execute(statement, chunk)
+        progress.add(len(chunk))
+
+    sync_id_sequence(session, table)
+    refresh_derived_columns(session, dataset)
+    session.commit()
+    return progress.finish()
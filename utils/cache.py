@@ -0,0 +1,342 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, g, request
+
+DEFAULT_TTL = 300
+DEFAULT_MAXSIZE = 1024
+
+
+class CachedResponse:
+    __slots__ = ("body", "status", "mimetype", "etag")
+
+    def __init__(self, body, status, mimetype, etag):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.etag = etag
+
+
+def invalidation_scopes(key):
+    """
+    Invalidation scopes of a cache key: everything ("*") and either its movie ("movie:<id>" covers movie:<id>
+    and movie:<id>:...) or the listings ("movies" covers movies:...).
+    """
+    prefix, _, rest = key.partition(":")
+    if prefix == "movie":
+        return "*", f"movie:{rest.split(':', 1)[0]}"
+    return "*", prefix
+
+
+class LRUCache:
+    """
+    In-process LRU cache with a per-entry TTL. Only shared between threads of one worker.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # scope -> number of invalidations, never evicted
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def generation(self, scopes):
+        with self._lock:
+            return sum(self._generations.get(scope, 0) for scope in scopes)
+
+    def bump(self, scopes):
+        with self._lock:
+            for scope in scopes:
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+
+    def set(self, key, value, scopes=(), generation=None):
+        """
+        Stores value, unless generation is given and scopes were invalidated since it was read.
+        """
+        with self._lock:
+            if generation is not None and sum(self._generations.get(scope, 0) for scope in scopes) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """
+    Cache stored in a local SQLite file, so all gunicorn workers on a host share entries and invalidations.
+
+    Entries expire after the TTL, the oldest entries are evicted once maxsize is exceeded. The invalidation
+    generations live in the same file, so a worker does not store a body another worker's write invalidated.
+    """
+
+    def __init__(self, path, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, body BLOB, status INTEGER, mimetype TEXT, etag TEXT, "
+            "expires_at REAL, created_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_created_at ON response_cache (created_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache_generation (scope TEXT PRIMARY KEY, generation INTEGER)"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT body, status, mimetype, etag FROM response_cache WHERE key = ? AND expires_at >= ?",
+            (key, time.time())
+        ).fetchone()
+        return CachedResponse(*row) if row else None
+
+    def _generation(self, conn, scopes):
+        placeholders = ", ".join("?" for _ in scopes)
+        return conn.execute(
+            f"SELECT COALESCE(SUM(generation), 0) FROM response_cache_generation WHERE scope IN ({placeholders})",
+            tuple(scopes)
+        ).fetchone()[0]
+
+    def generation(self, scopes):
+        return self._generation(self._connection(), scopes)
+
+    def bump(self, scopes):
+        self._connection().executemany(
+            "INSERT INTO response_cache_generation VALUES (?, 1) "
+            "ON CONFLICT (scope) DO UPDATE SET generation = generation + 1",
+            [(scope,) for scope in scopes]
+        )
+
+    def set(self, key, value, scopes=(), generation=None):
+        """
+        Stores value, unless generation is given and scopes were invalidated since it was read.
+        """
+        now = time.time()
+        conn = self._connection()
+        # the check and the insert in one write transaction, a bump of another worker comes before or after both
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if generation is not None and self._generation(conn, scopes) != generation:
+                conn.execute("ROLLBACK")
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, value.body, value.status, value.mimetype, value.etag, now + self.ttl, now)
+            )
+
+            overflow = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.maxsize
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN "
+                    "(SELECT key FROM response_cache ORDER BY expires_at < ? DESC, created_at LIMIT ?)",
+                    (now, overflow)
+                )
+                self.evictions += overflow
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        self._connection().execute("DELETE FROM response_cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM response_cache")
+
+
+def make_etag(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caches rendered GET responses of read endpoints and answers conditional requests with 304.
+
+    Configured from MOVIE_CACHE_BACKEND ("memory", "sqlite" or "none"), MOVIE_CACHE_TTL, MOVIE_CACHE_SIZE
+    and MOVIE_CACHE_PATH. Write paths call invalidate_movie / invalidate_all after committing. Each invalidation
+    bumps a generation of what it covers, a miss reads it before rendering and its body is only stored
+    if it did not change, so a render that raced a write is answered but not cached.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        # the counters are shared by the serving threads, the sqlite backend has no lock of its own to reuse
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        backend = app.config.get("MOVIE_CACHE_BACKEND", "sqlite")
+        ttl = int(app.config.get("MOVIE_CACHE_TTL", DEFAULT_TTL))
+        maxsize = int(app.config.get("MOVIE_CACHE_SIZE", DEFAULT_MAXSIZE))
+
+        if backend == "memory":
+            self.backend = LRUCache(maxsize, ttl)
+        elif backend == "sqlite":
+            path = app.config.get("MOVIE_CACHE_PATH") or os.path.join(app.instance_path, "response_cache.sqlite3")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.backend = SQLiteCache(path, maxsize, ttl)
+        elif backend == "none":
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown MOVIE_CACHE_BACKEND '{backend}'")
+
+    def lookup(self, key):
+        """
+        :return: the stored CachedResponse for key, or None (also when key is None or caching is off)
+        """
+        if key is None or self.backend is None:
+            return None
+
+        entry = self.backend.get(key)
+        with self._lock:
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry
+
+    def generation(self, key):
+        """
+        :return: generation of the invalidations covering key, read before rendering a miss, None when key is None
+                 or caching is off
+        """
+        if key is None or self.backend is None:
+            return None
+        return self.backend.generation(invalidation_scopes(key))
+
+    def store(self, key, body, status, mimetype, generation=None):
+        """
+        Stores a rendered body under key (unless key is None), only if key was not invalidated since generation.
+
+        :return: ETag of the body
+        """
+        etag = make_etag(body)
+        if key is not None and self.backend is not None:
+            self.backend.set(key, CachedResponse(body, status, mimetype, etag), invalidation_scopes(key), generation)
+        return etag
+
+    def filling(self):
+        """
+        True while a view renders a miss whose body is stored, its reads then stay on the primary (see utils.replicas):
+        a body read from a lagging replica would be served for the whole TTL.
+        """
+        return g.get("response_cache_filling", False)
+
+    def cached(self, key_func):
+        """
+        Decorates a view: serves the stored body when present, stores successful responses otherwise.
+
+        key_func gets the view kwargs and returns a cache key, or None to bypass the cache.
+        Every response gets a strong ETag and If-None-Match is honoured either way.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = key_func(**kwargs) if self.backend is not None else None
+                entry = self.lookup(key)
+
+                if entry is not None:
+                    response = Response(entry.body, status=entry.status, mimetype=entry.mimetype)
+                    response.set_etag(entry.etag)
+                    return response.make_conditional(request)
+
+                generation = self.generation(key)
+                # a POST /batch sub-request shares g with the others, the flag is restored afterwards
+                filling = g.get("response_cache_filling", False)
+                g.response_cache_filling = key is not None
+                try:
+                    response = view(*args, **kwargs)
+                finally:
+                    g.response_cache_filling = filling
+                response = current_app.make_response(response)
+
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+
+                etag = self.store(key, response.get_data(), response.status_code, response.mimetype, generation)
+                response.set_etag(etag)
+                return response.make_conditional(request)
+
+            return wrapper
+
+        return decorator
+
+    def invalidate_movie(self, movie_id):
+        if self.backend is not None:
+            self.backend.bump([f"movie:{movie_id}", "movies"])
+            self.backend.delete(f"movie:{movie_id}")
+            self.backend.delete_prefix(f"movie:{movie_id}:")
+            self.backend.delete_prefix("movies:")
+
+    def invalidate_all(self):
+        if self.backend is not None:
+            self.backend.bump(["*"])
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "hits": hits,
+            "misses": misses,
+            "evictions": self.backend.evictions if self.backend is not None else 0
+        }
+
+
+response_cache = ResponseCache()
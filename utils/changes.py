@@ -0,0 +1,167 @@
+from sqlalchemy import delete, select
+
+from models.change import change_tombstone, change_version
+from models.comment import Comment
+from models.user import user_movie
+from utils.dialects import dialect_insert
+from utils.recommendations import movies_statement
+from utils.serializers import USER_COMMENT_COLUMNS
+
+# change_tombstone kinds
+WATCHLIST = "watchlist"
+COMMENTS = "comment"
+
+
+def parse_since(value):
+    """
+    Reads the ?since= version token of the delta views.
+
+    :return: version, raises ValueError on bad input
+    """
+    try:
+        since = int(value)
+    except ValueError:
+        raise ValueError("'since' must be a non-negative integer")
+    if since < 0:
+        raise ValueError("'since' must be a non-negative integer")
+    return since
+
+
+def next_version_statement(session, user_id):
+    """
+    Upsert of the user's change counter, returning the version of the write it is run in.
+
+    Run it first in every transaction that writes the user's watchlist or comments: its row lock makes the user's
+    writes commit in version order, so a client that read version N has seen every write up to N.
+    """
+    statement = dialect_insert(session, change_version).values(user_id=user_id, version=1)
+    return statement.on_conflict_do_update(
+        index_elements=[change_version.c.user_id],
+        set_={"version": change_version.c.version + 1}
+    ).returning(change_version.c.version)
+
+
+def tombstone_statement(session):
+    """
+    Upsert of change_tombstone rows, executed with {user_id, kind, key, version} of the deleted entries.
+    """
+    statement = dialect_insert(session, change_tombstone)
+    return statement.on_conflict_do_update(
+        index_elements=[change_tombstone.c.user_id, change_tombstone.c.kind, change_tombstone.c.key],
+        set_={"version": statement.excluded.version}
+    )
+
+
+def tombstones(user_id, kind, keys, version):
+    return [{"user_id": user_id, "kind": kind, "key": key, "version": version} for key in keys]
+
+
+def clear_tombstones_statement(user_id, kind, keys):
+    """
+    DELETE of the tombstones of entries written again, an entry is either a row or a tombstone.
+    """
+    return delete(change_tombstone).where(
+        (change_tombstone.c.user_id == user_id) &
+        (change_tombstone.c.kind == kind) &
+        (change_tombstone.c.key.in_(keys))
+    )
+
+
+def current_version_statement(user_id):
+    return select(change_version.c.version).where(change_version.c.user_id == user_id)
+
+
+def deleted_statement(user_id, kind, since):
+    return select(change_tombstone.c.key).where(
+        (change_tombstone.c.user_id == user_id) &
+        (change_tombstone.c.kind == kind) &
+        (change_tombstone.c.version > since)
+    )
+
+
+def watchlist_changes_statement(user_id, since):
+    """
+    :return: select of the user's watchlist rows written after since, all of them for a first sync (since 0)
+    """
+    statement = select(user_movie.c.movie_id, user_movie.c.watched, user_movie.c.user_rating).where(
+        user_movie.c.user_id == user_id
+    )
+    # rows written before change versions existed are version 0
+    return statement.where(user_movie.c.version > since) if since else statement
+
+
+def comment_changes_statement(user_id, since):
+    statement = select(*USER_COMMENT_COLUMNS).where(Comment.author_id == user_id)
+    return statement.where(Comment.version > since) if since else statement
+
+
+def watchlist_entries(movies, changed):
+    """
+    :param movies: movies_statement rows of the changed entries, from the primary
+    :param changed: watchlist_changes_statement rows
+    :return: list of the movie dicts with the user's watched and user_rating
+    """
+    entries = {row.movie_id: row for row in changed}
+    return [
+        {**movie._asdict(), "watched": entries[movie.id].watched, "user_rating": entries[movie.id].user_rating}
+        for movie in movies
+    ]
+
+
+# the delta views read the counter first: a poll with the current version stops after that primary key lookup,
+# otherwise the rows and tombstones come from range scans of the (user, version) indexes
+# a write committed between the reads shows up again in the next poll, never gets lost
+
+def watchlist_delta(session, user_id, since):
+    """
+    :return: (version, watchlist entries written after since, movie ids deleted after since)
+    """
+    version = session.execute(current_version_statement(user_id)).scalar() or 0
+    if version <= since:
+        return version, [], []
+
+    changed = session.execute(watchlist_changes_statement(user_id, since)).all()
+    # a first sync has nothing to delete
+    deleted = session.execute(deleted_statement(user_id, WATCHLIST, since)).scalars().all() if since else []
+    movies = session.execute(movies_statement([row.movie_id for row in changed])).all() if changed else []
+    return version, watchlist_entries(movies, changed), deleted
+
+
+async def watchlist_delta_async(session, user_id, since):
+    """
+    watchlist_delta on an AsyncSession.
+    """
+    version = (await session.execute(current_version_statement(user_id))).scalar() or 0
+    if version <= since:
+        return version, [], []
+
+    changed = (await session.execute(watchlist_changes_statement(user_id, since))).all()
+    deleted = (await session.execute(deleted_statement(user_id, WATCHLIST, since))).scalars().all() if since else []
+    movies = (await session.execute(movies_statement([row.movie_id for row in changed]))).all() if changed else []
+    return version, watchlist_entries(movies, changed), deleted
+
+
+def comments_delta(session, user_id, since):
+    """
+    :return: (version, comment rows written after since, comment ids deleted after since)
+    """
+    version = session.execute(current_version_statement(user_id)).scalar() or 0
+    if version <= since:
+        return version, [], []
+
+    changed = session.execute(comment_changes_statement(user_id, since)).all()
+    deleted = session.execute(deleted_statement(user_id, COMMENTS, since)).scalars().all() if since else []
+    return version, changed, deleted
+
+
+async def comments_delta_async(session, user_id, since):
+    """
+    comments_delta on an AsyncSession.
+    """
+    version = (await session.execute(current_version_statement(user_id))).scalar() or 0
+    if version <= since:
+        return version, [], []
+
+    changed = (await session.execute(comment_changes_statement(user_id, since))).all()
+    deleted = (await session.execute(deleted_statement(user_id, COMMENTS, since))).scalars().all() if since else []
+    return version, changed, deleted
@@ -0,0 +1,116 @@
+from sqlalchemy import bindparam, func, select, union_all, update
+
+from models.comment import Comment
+from models.movie import Movie
+from utils.pagination import keyset_statement, split_page
+from utils.serializers import MOVIE_COMMENT_COLUMNS, USER_COMMENT_COLUMNS
+from utils.shards import gather, gather_async, gather_totals
+
+# comments inlined in the movie detail view, later ones are paged from /movies/<id>/comments
+FIRST_PAGE_LIMIT = 20
+
+
+def movie_comments_statement(movie_id):
+    return select(*MOVIE_COMMENT_COLUMNS).where(Comment.movie_id == movie_id)
+
+
+def user_comments_statement(user_id):
+    return select(*USER_COMMENT_COLUMNS).where(Comment.author_id == user_id)
+
+
+def first_comments_statement(movie_id):
+    """
+    :return: select of the oldest FIRST_PAGE_LIMIT comments of a movie
+    """
+    return movie_comments_statement(movie_id).order_by(Comment.id).limit(FIRST_PAGE_LIMIT)
+
+
+def first_comments_of_movies_statement(movie_ids):
+    """
+    :return: one select of the oldest FIRST_PAGE_LIMIT comments of each movie, with their movie_id,
+             a UNION ALL of per-movie index seeks, so a movie with many comments reads no more than the others
+    """
+    pages = [
+        first_comments_statement(movie_id).add_columns(Comment.movie_id).subquery()
+        for movie_id in movie_ids
+    ]
+    return union_all(*(select(page) for page in pages))
+
+
+def comment_count_statement(movie_id, delta):
+    """
+    :return: UPDATE of movie.comment_count by delta, run in the transaction that adds (1) or deletes (-1) a comment
+    """
+    return update(Movie).where(Movie.id == movie_id).values(comment_count=Movie.comment_count + delta)
+
+
+def oldest_first(rows, limit=None):
+    """
+    Merges comment rows gathered from several shards into id order, cut to limit.
+    """
+    return sorted(rows, key=lambda row: row.id)[:limit]
+
+
+def first_pages(rows):
+    """
+    Merges first_comments_of_movies_statement rows gathered from several shards: in id order,
+    up to FIRST_PAGE_LIMIT per movie.
+    """
+    counts = {}
+    pages = []
+    for row in oldest_first(rows):
+        counts[row.movie_id] = counts.get(row.movie_id, 0) + 1
+        if counts[row.movie_id] <= FIRST_PAGE_LIMIT:
+            pages.append(row)
+    return pages
+
+
+# a movie's comments are written by users of every shard, its views gather them
+
+def first_comments(session, movie_id):
+    return oldest_first(gather(session, first_comments_statement(movie_id), "author_id"), FIRST_PAGE_LIMIT)
+
+
+async def first_comments_async(session, movie_id):
+    return oldest_first(await gather_async(session, first_comments_statement(movie_id), "author_id"), FIRST_PAGE_LIMIT)
+
+
+def first_comments_of_movies(session, movie_ids):
+    return first_pages(gather(session, first_comments_of_movies_statement(movie_ids), "author_id"))
+
+
+async def first_comments_of_movies_async(session, movie_ids):
+    return first_pages(await gather_async(session, first_comments_of_movies_statement(movie_ids), "author_id"))
+
+
+def movie_comments_page(session, movie_id, after, limit):
+    """
+    :return: (rows, next_after) of a keyset page of the movie's comments, like utils.pagination.keyset_page
+    """
+    statement = keyset_statement(movie_comments_statement(movie_id), Comment.id, after, limit)
+    return split_page(oldest_first(gather(session, statement, "author_id")), Comment.id, limit)
+
+
+async def movie_comments_page_async(session, movie_id, after, limit):
+    statement = keyset_statement(movie_comments_statement(movie_id), Comment.id, after, limit)
+    return split_page(oldest_first(await gather_async(session, statement, "author_id")), Comment.id, limit)
+
+
+def rebuild_comment_counts(session):
+    """
+    Overwrites movie.comment_count with the comments counted on every shard. Does not commit.
+
+    :return: number of movies updated
+    """
+    counts = gather_totals(
+        session, select(Comment.movie_id, func.count()).group_by(Comment.movie_id), Comment.__table__.c.author_id
+    )
+    params = [{"movie_id": movie_id, "new_count": counts.get(movie_id, [0])[0]}
+              for (movie_id,) in session.execute(select(Movie.id))]
+    if params:
+        movie = Movie.__table__
+        session.execute(
+            movie.update().where(movie.c.id == bindparam("movie_id")).values(comment_count=bindparam("new_count")),
+            params
+        )
+    return len(params)
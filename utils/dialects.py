@@ -0,0 +1,14 @@
+import importlib
+
+UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+
+def dialect_insert(session, table):
+    """
+    INSERT construct of the session's dialect, which supports on_conflict_do_update / do_nothing.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        raise NotImplementedError(f"Upserts are not supported on '{dialect}'")
+    # the engine already loaded its dialect module, importing it here keeps the other one off the import path
+    return importlib.import_module(f"sqlalchemy.dialects.{dialect}").insert(table)
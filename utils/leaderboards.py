@@ -0,0 +1,207 @@
+import logging
+import time
+
+from sqlalchemy import Float, cast, delete, insert, literal, select, update
+
+from models.leaderboard import leaderboard_entry, leaderboard_state
+from models.movie import Movie
+from utils.dialects import dialect_insert
+from utils.serializers import MOVIE_COLUMNS
+
+TOP_RATED = "top_rated"
+TRENDING = "trending"
+
+DEFAULT_MIN_VOTES = 3
+DEFAULT_HALF_LIFE_HOURS = 84
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+# trending weight of each kind of watchlist activity
+TRENDING_WEIGHTS = {"added": 1.0, "watched": 2.0, "rated": 1.0}
+# scores grow by 2x per half-life since the epoch, `flask leaderboards rebase` should run well before this
+REBASE_AFTER_HALF_LIVES = 64
+# entries decayed below this are dropped on rebase
+MIN_TRENDING_SCORE = 0.001
+
+
+def top_rated_refresh_statements(min_votes, movie_ids=None):
+    """
+    Statements that put the given movies (all when None) on the top rated board by their exact average rating,
+    or take them off it while they have fewer than min_votes ratings.
+
+    :return: list of statements, executed in order
+    """
+    clear = delete(leaderboard_entry).where(leaderboard_entry.c.board == TOP_RATED)
+    ranked = select(
+        literal(TOP_RATED), Movie.id, cast(Movie.rating_sum, Float) / Movie.rating_count
+    ).where((Movie.rating_count > 0) & (Movie.rating_count >= min_votes))
+
+    if movie_ids is not None:
+        clear = clear.where(leaderboard_entry.c.movie_id.in_(movie_ids))
+        ranked = ranked.where(Movie.id.in_(movie_ids))
+
+    return [
+        clear,
+        insert(leaderboard_entry).from_select(
+            [leaderboard_entry.c.board, leaderboard_entry.c.movie_id, leaderboard_entry.c.score], ranked
+        )
+    ]
+
+
+def epoch_statement():
+    return select(leaderboard_state.c.epoch).where(leaderboard_state.c.board == TRENDING)
+
+
+def locked_epoch_statement(exclusive=False):
+    # writers share the lock, a rebase takes it exclusively so no increment is scaled to a stale epoch
+    return epoch_statement().with_for_update(read=not exclusive)
+
+
+def trending_upsert_statement(session):
+    # additive, so concurrent writers never lose each other's activity
+    statement = dialect_insert(session, leaderboard_entry)
+    return statement.on_conflict_do_update(
+        index_elements=[leaderboard_entry.c.board, leaderboard_entry.c.movie_id],
+        set_={"score": leaderboard_entry.c.score + statement.excluded.score}
+    )
+
+
+def board_statement(board, limit):
+    """
+    :return: select of the movie columns and score of the best limit entries of board
+    """
+    return select(*MOVIE_COLUMNS, leaderboard_entry.c.score).join(
+        leaderboard_entry, leaderboard_entry.c.movie_id == Movie.id
+    ).where(
+        leaderboard_entry.c.board == board
+    ).order_by(leaderboard_entry.c.score.desc(), leaderboard_entry.c.movie_id.desc()).limit(limit)
+
+
+def decay_factor(since, until, half_life):
+    return 2 ** (-(until - since) / half_life)
+
+
+def trending_rows(events, epoch, half_life, now):
+    """
+    Forward decay: an event at now weighs 2 ** ((now - epoch) / half_life) times its weight, so older
+    activity counts half as much per half-life without ever rewriting the stored scores.
+
+    :param events: dict of movie_id -> activity weight
+    :return: rows for trending_upsert_statement
+    """
+    scale = 1 / decay_factor(epoch, now, half_life)
+    return [{"board": TRENDING, "movie_id": movie_id, "score": weight * scale} for movie_id, weight in events.items()]
+
+
+def board_movies(rows, scale=1.0):
+    """
+    :param rows: rows of board_statement
+    :param scale: factor of the stored scores, decay_factor(epoch, now, half_life) for trending
+    :return: list of movie dicts with their score, best first
+    """
+    movies = []
+    for row in rows:
+        movie = row._asdict()
+        movie["score"] = round(movie["score"] * scale, 4)
+        movies.append(movie)
+    return movies
+
+
+class Leaderboards:
+    """
+    Top rated and trending movies kept in leaderboard_entry by the write paths, in the writing transaction.
+
+    Top rated holds the movies with at least LEADERBOARD_MIN_VOTES ratings by their average. Trending sums
+    TRENDING_WEIGHTS of watchlist activity decayed with a half-life of TRENDING_HALF_LIFE_HOURS.
+    """
+
+    def __init__(self):
+        self.min_votes = DEFAULT_MIN_VOTES
+        self.half_life = DEFAULT_HALF_LIFE_HOURS * 3600
+        self.logger = logging.getLogger(__name__)
+
+    def init_app(self, app):
+        self.min_votes = int(app.config.get("LEADERBOARD_MIN_VOTES", DEFAULT_MIN_VOTES))
+        self.half_life = float(app.config.get("TRENDING_HALF_LIFE_HOURS", DEFAULT_HALF_LIFE_HOURS)) * 3600
+        self.logger = app.logger
+
+    def _trending_rows(self, events, epoch):
+        now = time.time()
+        if (now - epoch) / self.half_life > REBASE_AFTER_HALF_LIVES:
+            self.logger.warning("Trending scores are far from their epoch, run `flask leaderboards rebase`")
+        return trending_rows(events, epoch, self.half_life, now)
+
+    def refresh_top_rated(self, session, movie_ids=None):
+        """
+        Brings the top rated entries of movies whose rating aggregates changed in this transaction up to date,
+        all movies when movie_ids is None. Does not commit.
+        """
+        if movie_ids is not None and not movie_ids:
+            return
+        for statement in top_rated_refresh_statements(self.min_votes, movie_ids):
+            session.execute(statement)
+
+    async def refresh_top_rated_async(self, session, movie_ids=None):
+        """
+        refresh_top_rated on an AsyncSession.
+        """
+        if movie_ids is not None and not movie_ids:
+            return
+        for statement in top_rated_refresh_statements(self.min_votes, movie_ids):
+            await session.execute(statement)
+
+    def record_activity(self, session, events):
+        """
+        Adds watchlist activity to the trending scores. Does not commit.
+
+        :param events: dict of movie_id -> weight, see TRENDING_WEIGHTS
+        """
+        if not events:
+            return
+        epoch = session.execute(locked_epoch_statement()).scalar()
+        session.execute(trending_upsert_statement(session), self._trending_rows(events, epoch))
+
+    async def record_activity_async(self, session, events):
+        """
+        record_activity on an AsyncSession.
+        """
+        if not events:
+            return
+        epoch = (await session.execute(locked_epoch_statement())).scalar()
+        await session.execute(trending_upsert_statement(session), self._trending_rows(events, epoch))
+
+    def trending_scale(self, epoch):
+        """
+        :return: factor that turns stored trending scores into their value now
+        """
+        return decay_factor(epoch, time.time(), self.half_life)
+
+    def rebase(self, session):
+        """
+        Moves the trending epoch to now, scales the stored scores to it and drops the entries that decayed
+        below MIN_TRENDING_SCORE. Does not commit.
+
+        :return: number of dropped entries
+        """
+        now = time.time()
+        epoch = session.execute(locked_epoch_statement(exclusive=True)).scalar()
+        factor = decay_factor(epoch, now, self.half_life)
+
+        session.execute(update(leaderboard_entry).where(leaderboard_entry.c.board == TRENDING).values(
+            score=leaderboard_entry.c.score * factor
+        ))
+        session.execute(update(leaderboard_state).where(leaderboard_state.c.board == TRENDING).values(epoch=now))
+        return session.execute(delete(leaderboard_entry).where(
+            (leaderboard_entry.c.board == TRENDING) & (leaderboard_entry.c.score < MIN_TRENDING_SCORE)
+        )).rowcount
+
+    def limit(self, value):
+        """
+        :return: the requested number of entries between 1 and MAX_LIMIT, DEFAULT_LIMIT when missing or malformed
+        """
+        try:
+            return max(1, min(int(value), MAX_LIMIT))
+        except (TypeError, ValueError):
+            return DEFAULT_LIMIT
+
+
+leaderboards = Leaderboards()
@@ -0,0 +1,297 @@
+import contextvars
+import glob
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from flask import Response, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("Handler latency", LATENCY_BUCKETS),
+    "sql_queries_per_request": ("SQL statements executed per request", QUERY_BUCKETS),
+    "sql_duration_seconds_per_request": ("Total SQL time per request", LATENCY_BUCKETS),
+    "sql_rows_per_request": ("Rows fetched or affected per request", ROW_BUCKETS),
+    "db_pool_checkout_wait_seconds_per_request": ("Time spent checking out pooled connections per request",
+                                                  LATENCY_BUCKETS)
+}
+COUNTERS = {
+    "http_requests_total": "Requests served",
+    "sql_n_plus_one_warnings_total": "Requests that repeated one statement shape like an N+1 loop",
+    "db_pool_checkout_timeouts_total": "Requests that gave up waiting for a pooled connection",
+    "db_replica_requests_total": "Requests whose reads were routed to a read replica",
+    "write_behind_writes_total": "Rating and watched writes queued for write-behind",
+    "write_behind_rejected_total": "Writes refused because the write-behind queue was full",
+    "write_behind_batches_total": "Write-behind batches committed",
+    "write_behind_failed_total": "Write-behind batches that failed, their writes were not applied"
+}
+
+# literals and expanded IN lists are collapsed, so one statement run in a loop maps to one shape
+STATEMENT_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\?|%\(\w+\)s|\$\d+|:\w+")
+STATEMENT_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    __slots__ = ("queries", "sql_seconds", "rows", "shapes", "pool_wait", "pool_timeouts")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.shapes = Counter()
+        self.pool_wait = 0.0
+        self.pool_timeouts = 0
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that adds the time spent checking out a connection, pre-ping included, to the current request.
+    """
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except TimeoutError:
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.pool_timeouts += 1
+            raise
+        finally:
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.pool_wait += time.perf_counter() - started
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_snapshots(metrics_dir, prefix):
+    """
+    Loads the <prefix>_<pid>.json snapshots of the other processes in metrics_dir. Snapshots of processes that
+    exited (recycled or restarted workers) are deleted instead, their counters would stay in the totals forever.
+
+    :return: list of the loaded snapshots
+    """
+    states = []
+    for path in glob.glob(os.path.join(metrics_dir, f"{prefix}_*.json")):
+        pid = os.path.basename(path)[len(prefix) + 1:-len(".json")]
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        if not pid_alive(int(pid)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as snapshot:
+                states.append(json.load(snapshot))
+        except (OSError, ValueError):
+            continue
+    return states
+
+
+def statement_shape(statement):
+    return " ".join(STATEMENT_LITERALS.sub("?", STATEMENT_LISTS.sub("(?)", statement)).split())
+
+
+class RequestMetrics:
+    """
+    Records query count, SQL time, rows and handler latency of every request as per-endpoint histograms,
+    and serves them in the Prometheus text format.
+
+    With METRICS_DIR set, every process snapshots its metrics there and /metrics merges all snapshots,
+    so the numbers cover every gunicorn worker.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self.metrics_dir = None
+        self.n_plus_one_threshold = 5
+        self._lock = threading.Lock()
+        self._last_snapshot = 0.0
+        self._listening = False
+
+    def init_app(self, app):
+        self.metrics_dir = app.config.get("METRICS_DIR")
+        self.n_plus_one_threshold = int(app.config.get("N_PLUS_ONE_THRESHOLD", 5))
+        if self.metrics_dir:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+
+        if not self._listening:
+            # class level listeners cover every engine and bind the app creates
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            # only the pools of the app's own engines (config.engine_options), other sqlite connections are left alone
+            event.listen(TimedQueuePool, "connect", self._count_sqlite_rows)
+            self._listening = True
+
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if _request_stats.get() is not None:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = _request_stats.get()
+        if stats is None or not conn.info.get("query_started"):
+            return
+
+        stats.queries += 1
+        stats.sql_seconds += time.perf_counter() - conn.info["query_started"].pop()
+        stats.shapes[statement_shape(statement)] += 1
+        # sqlite reports -1 for selects, its fetched rows are counted by the row factory instead
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+
+    def _count_sqlite_rows(self, dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection) and dbapi_connection.row_factory is None:
+            dbapi_connection.row_factory = _counting_row_factory
+
+    def _start_request(self):
+        # a stack, the sub-requests of POST /batch run nested in the same app context and g
+        g.setdefault("request_metrics", []).append(
+            (request._get_current_object(), time.perf_counter(), _request_stats.set(RequestStats()))
+        )
+
+    def _finish_request(self, exc):
+        started = g.get("request_metrics")
+        if not started or started[-1][0] is not request._get_current_object():
+            return
+
+        _, request_started, token = started.pop()
+        stats = _request_stats.get()
+        _request_stats.reset(token)
+        endpoint = request.endpoint or "unmatched"
+        elapsed = time.perf_counter() - request_started
+
+        repeated = [(shape, count) for shape, count in stats.shapes.items() if count >= self.n_plus_one_threshold]
+        for shape, count in repeated:
+            current_app.logger.warning(f"Possible N+1 in {endpoint}: {count}x {shape}")
+
+        with self._lock:
+            self.counters[("http_requests_total", endpoint)] += 1
+            if repeated:
+                self.counters[("sql_n_plus_one_warnings_total", endpoint)] += 1
+            if stats.pool_timeouts:
+                self.counters[("db_pool_checkout_timeouts_total", endpoint)] += 1
+            self._observe("http_request_duration_seconds", endpoint, elapsed)
+            self._observe("sql_queries_per_request", endpoint, stats.queries)
+            self._observe("sql_duration_seconds_per_request", endpoint, stats.sql_seconds)
+            self._observe("sql_rows_per_request", endpoint, stats.rows)
+            self._observe("db_pool_checkout_wait_seconds_per_request", endpoint, stats.pool_wait)
+
+        self._snapshot()
+
+    def increment(self, name, endpoint):
+        with self._lock:
+            self.counters[(name, endpoint)] += 1
+
+    def _observe(self, name, endpoint, value):
+        buckets = HISTOGRAMS[name][1]
+        histogram = self.histograms.get((name, endpoint))
+        if histogram is None:
+            # cumulative bucket counts, then sum and count
+            histogram = self.histograms[(name, endpoint)] = [0] * len(buckets) + [0.0, 0]
+
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[index] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def _state(self):
+        with self._lock:
+            return {
+                "histograms": [[name, endpoint, list(values)] for (name, endpoint), values in self.histograms.items()],
+                "counters": [[name, endpoint, value] for (name, endpoint), value in self.counters.items()]
+            }
+
+    def _snapshot(self, force=False):
+        # at most one write per second per process
+        if not self.metrics_dir or (not force and time.monotonic() - self._last_snapshot < 1.0):
+            return
+        self._last_snapshot = time.monotonic()
+
+        path = os.path.join(self.metrics_dir, f"metrics_{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as snapshot:
+            json.dump(self._state(), snapshot)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self):
+        """
+        :return: merged state of this process and, with METRICS_DIR, the snapshots of all other live processes
+        """
+        states = [self._state()]
+        if self.metrics_dir:
+            states.extend(read_snapshots(self.metrics_dir, "metrics"))
+
+        histograms = {}
+        counters = Counter()
+        for state in states:
+            for name, endpoint, values in state["histograms"]:
+                merged = histograms.setdefault((name, endpoint), [0] * len(values))
+                for index, value in enumerate(values):
+                    merged[index] += value
+            for name, endpoint, value in state["counters"]:
+                counters[(name, endpoint)] += value
+
+        return histograms, counters
+
+    def render(self):
+        histograms, counters = self.collect()
+        lines = []
+
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, endpoint), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(buckets, values):
+                    lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {values[-1]}')
+                lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {values[-2]}')
+                lines.append(f'{name}_count{{endpoint="{endpoint}"}} {values[-1]}')
+
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, endpoint), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+def _counting_row_factory(cursor, row):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.rows += 1
+    return row
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,108 @@
+from utils.serializers import encode_row
+
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 500
+STREAM_CHUNK_SIZE = 1000
+
+
+def parse_page_args(args):
+    """
+    Reads keyset pagination params from request args.
+
+    :return: (after, limit) tuple, raises ValueError on bad input
+    """
+    after = args.get("after")
+    limit = args.get("limit", DEFAULT_PAGE_LIMIT)
+
+    try:
+        after = int(after) if after not in (None, "") else None
+    except ValueError:
+        raise ValueError("'after' must be an integer")
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError("'limit' must be a positive integer")
+    if limit < 1:
+        raise ValueError("'limit' must be a positive integer")
+
+    return after, min(limit, MAX_PAGE_LIMIT)
+
+
+def parse_offset_args(args):
+    """
+    Reads offset pagination params from request args, for results that are not ordered by a unique key.
+
+    :return: (offset, limit) tuple, raises ValueError on bad input
+    """
+    try:
+        offset = int(args.get("offset", 0))
+    except ValueError:
+        raise ValueError("'offset' must be an integer")
+
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        raise ValueError("'limit' must be a positive integer")
+
+    if offset < 0:
+        raise ValueError("'offset' must not be negative")
+    if limit < 1:
+        raise ValueError("'limit' must be a positive integer")
+
+    return offset, min(limit, MAX_PAGE_LIMIT)
+
+
+def keyset_statement(statement, key_column, after, limit):
+    """
+    Applies keyset pagination on key_column to a select statement.
+
+    Selects one extra row to know whether there is a next page, so no COUNT(*) is needed.
+    """
+    if after is not None:
+        statement = statement.where(key_column > after)
+    return statement.order_by(key_column).limit(limit + 1)
+
+
+def split_page(rows, key_column, limit):
+    """
+    :return: (rows, next_after) where next_after is None on the last page
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_after = getattr(rows[-1], key_column.key) if has_more else None
+
+    return rows, next_after
+
+
+def keyset_page(session, statement, key_column, after, limit):
+    """
+    Fetches one keyset page of a select statement ordered by key_column.
+
+    :return: (rows, next_after) where next_after is None on the last page
+    """
+    rows = session.execute(keyset_statement(statement, key_column, after, limit)).all()
+    return split_page(rows, key_column, limit)
+
+
+def stream_ndjson(session, statement, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields one JSON document per row, fetching rows from a server-side cursor in chunks.
+    Rows are encoded by the app's JSON provider, so they must be consumed within the app context.
+    """
+    result = session.execute(statement.execution_options(stream_results=True, yield_per=chunk_size))
+    try:
+        for partition in result.partitions():
+            yield b"".join(encode_row(row) + b"\n" for row in partition)
+    finally:
+        result.close()
+
+
+async def stream_ndjson_async(sessionmaker, statement, encoder, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    stream_ndjson for the ASGI app: owns its AsyncSession, since the body is sent after the handler returned.
+    """
+    async with sessionmaker() as session:
+        result = await session.stream(statement.execution_options(yield_per=chunk_size))
+        async for partition in result.partitions():
+            yield b"".join(encoder.encode_row(row) + b"\n" for row in partition)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"
+DEFAULT_SALT_LENGTH = 16
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def normalize_method(method):
+    # "pbkdf2:sha256" means werkzeug's default iterations, spell them out so stored hashes compare equal
+    if method.startswith("pbkdf2") and method.count(":") < 2:
+        return f"{method}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification in a bounded process pool, so the CPU cost doesn't block
+    the serving threads of a worker.
+
+    Configured from PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH, PASSWORD_HASH_WORKERS (0 hashes inline),
+    PASSWORD_HASH_QUEUE (pending operations per worker before new ones are refused) and PASSWORD_HASH_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.method = DEFAULT_METHOD
+        self.salt_length = DEFAULT_SALT_LENGTH
+        self.workers = 0
+        self.queue_depth = 32
+        self.timeout = 5.0
+        self._pool = None
+        self._pool_pid = None
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def init_app(self, app):
+        self.method = normalize_method(app.config.get("PASSWORD_HASH_METHOD") or DEFAULT_METHOD)
+        self.salt_length = int(app.config.get("PASSWORD_SALT_LENGTH", DEFAULT_SALT_LENGTH))
+        self.workers = int(app.config.get("PASSWORD_HASH_WORKERS", 0))
+        self.queue_depth = int(app.config.get("PASSWORD_HASH_QUEUE", 32))
+        self.timeout = float(app.config.get("PASSWORD_HASH_TIMEOUT", 5))
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self.logger = app.logger
+
+    def _get_pool(self):
+        # created lazily and per process, a pool inherited through a gunicorn fork is unusable.
+        # the worker already runs threads (write-behind, title index, connection pools) by then, a plain fork could
+        # copy a lock one of them holds: forkserver children fork from a clean single-threaded server instead.
+        # like spawn they import the __main__ module, a script using the pool needs an `if __name__ == "__main__"`
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver")
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args, **kwargs):
+        if not self.workers:
+            return fn(*args, **kwargs)
+
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HasherBusy("Too many pending password operations")
+        try:
+            future = self._get_pool().submit(fn, *args, **kwargs)
+        except BaseException:
+            slots.release()
+            raise
+        # the slot is held until the operation ends, a timed out one may still be running in the pool
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy("Password operation timed out")
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method, salt_length=self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        True when pwhash was made with other parameters than the configured ones.
+        """
+        if pwhash.count("$") < 2:
+            return True
+        method, salt, _ = pwhash.split("$", 2)
+        return normalize_method(method) != self.method or len(salt) != self.salt_length
+
+    def rehash(self, pwhash, password):
+        """
+        Best-effort upgrade of a hash made with older parameters, at login while the plain password is at hand.
+
+        :return: new hash, None when pwhash is up to date or the pool is busy (a later login retries)
+        """
+        if not self.needs_rehash(pwhash):
+            return None
+        try:
+            return self.hash(password)
+        except HasherBusy as err:
+            self.logger.warning(f"Password rehash skipped: {err}")
+            return None
+
+    async def rehash_async(self, pwhash, password):
+        return await asyncio.get_running_loop().run_in_executor(None, partial(self.rehash, pwhash, password))
+
+    async def hash_async(self, password):
+        # the blocking wait for the pool runs on a thread, so the event loop keeps serving
+        return await asyncio.get_running_loop().run_in_executor(None, partial(self.hash, password))
+
+    async def verify_async(self, pwhash, password):
+        return await asyncio.get_running_loop().run_in_executor(None, partial(self.verify, pwhash, password))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,122 @@
+from flask import g
+from sqlalchemy import select
+
+from database import db
+from models.user import User, session_id
+from utils.cache import LRUCache
+
+DEFAULT_TTL = 60
+DEFAULT_MAXSIZE = 10000
+
+
+class UserPrincipal:
+    """
+    Lightweight identity of the logged in user, cached between requests instead of loading the User row.
+
+    Attributes other than id, username and session_version (e.g. watchlist, comments) load the full
+    ORM User once per request.
+    """
+
+    __slots__ = ("id", "username", "session_version")
+
+    def __init__(self, id, username, session_version):
+        self.id = id
+        self.username = username
+        self.session_version = session_version
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def get_id(self):
+        return session_id(self.id, self.session_version)
+
+    def __eq__(self, other):
+        return isinstance(other, UserPrincipal) and self.get_id() == other.get_id()
+
+    def __hash__(self):
+        return hash(self.get_id())
+
+    @property
+    def orm_user(self):
+        users = g.setdefault("orm_users", {})
+        if self.id not in users:
+            users[self.id] = db.session.get(User, self.id)
+        return users[self.id]
+
+    def __getattr__(self, name):
+        # only reached for attributes that are not slots of the principal
+        return getattr(self.orm_user, name)
+
+
+def parse_session_id(value):
+    """
+    :return: (user_id, session_version), sessions from before versioning count as version 0
+    """
+    user_id, _, version = str(value).partition(":")
+    return int(user_id), int(version or 0)
+
+
+def principal_statement(user_id):
+    return select(User.id, User.username, User.session_version).where(User.id == user_id)
+
+
+class PrincipalCache:
+    """
+    TTL/LRU cache of UserPrincipal keyed by (user id, session version), configured from PRINCIPAL_CACHE_TTL
+    and PRINCIPAL_CACHE_SIZE.
+
+    Changing the password bumps the session version, so sessions started before it stop resolving.
+    Other workers notice within the TTL.
+    """
+
+    def __init__(self):
+        self.cache = LRUCache(DEFAULT_MAXSIZE, DEFAULT_TTL)
+
+    def init_app(self, app):
+        self.cache = LRUCache(
+            int(app.config.get("PRINCIPAL_CACHE_SIZE", DEFAULT_MAXSIZE)),
+            int(app.config.get("PRINCIPAL_CACHE_TTL", DEFAULT_TTL))
+        )
+
+    def _cached(self, value):
+        # (user_id, session_version, cached principal or None), raises ValueError on a malformed value
+        user_id, version = parse_session_id(value)
+        return user_id, version, self.cache.get(session_id(user_id, version))
+
+    def _remember(self, version, row):
+        if row is None or row.session_version != version:
+            return None
+
+        principal = UserPrincipal(row.id, row.username, row.session_version)
+        self.cache.set(principal.get_id(), principal)
+        return principal
+
+    def load(self, value):
+        try:
+            user_id, version, principal = self._cached(value)
+        except ValueError:
+            return None
+
+        if principal is not None:
+            return principal
+        return self._remember(version, db.session.execute(principal_statement(user_id)).first())
+
+    async def load_async(self, value, session):
+        """
+        load() for the ASGI app, reading through the given AsyncSession.
+        """
+        try:
+            user_id, version, principal = self._cached(value)
+        except ValueError:
+            return None
+
+        if principal is not None:
+            return principal
+        return self._remember(version, (await session.execute(principal_statement(user_id))).first())
+
+    def evict(self, user_id):
+        self.cache.delete_prefix(f"{user_id}:")
+
+
+principal_cache = PrincipalCache()
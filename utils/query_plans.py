@@ -0,0 +1,66 @@
+from sqlalchemy import delete, func, select, text
+
+from models.comment import Comment
+from models.movie import Movie
+from models.user import user_movie
+from utils.leaderboards import TOP_RATED, TRENDING, board_statement
+
+
+def planned_queries():
+    """
+    Representative statements of the hot endpoints, with sample parameters.
+
+    :return: list of (endpoint, statement)
+    """
+    return [
+        ("movies.get_single_movie", select(Movie).where(Movie.id == 1)),
+        ("movies.get_single_movie", select(Comment).where(Comment.movie_id == 1).order_by(Comment.id).limit(20)),
+        ("movies.get_movie_comments", select(Comment).where((Comment.movie_id == 1) & (Comment.id > 100))
+            .order_by(Comment.id).limit(51)),
+        ("movies.get_top_rated_movies", board_statement(TOP_RATED, 10)),
+        ("movies.get_trending_movies", board_statement(TRENDING, 10)),
+        ("movies.rate_movie", select(user_movie.c.watched, user_movie.c.user_rating).where(
+            (user_movie.c.user_id == 1) & (user_movie.c.movie_id == 1))),
+        ("ratings.rating_aggregates", select(func.sum(user_movie.c.user_rating), func.count(user_movie.c.user_rating))
+            .where(user_movie.c.movie_id == 1)),
+        ("watchlist.get_user_watchlist", select(Movie).join(user_movie).where(user_movie.c.user_id == 1)),
+        ("watchlist.add_to_watchlist", select(user_movie.c.movie_id, user_movie.c.user_rating).where(
+            (user_movie.c.user_id == 1) & (user_movie.c.movie_id.in_([1, 2, 3])))),
+        ("watchlist.delete_from_watchlist", delete(user_movie).where(
+            (user_movie.c.user_id == 1) & (user_movie.c.movie_id == 1))),
+        ("comments.get_user_comments", select(Comment).where((Comment.author_id == 1) & (Comment.id > 100))
+            .order_by(Comment.id).limit(51)),
+        ("comments.delete_comment", delete(Comment).where((Comment.author_id == 1) & (Comment.id == 1)))
+    ]
+
+
+def explain(conn, statement):
+    """
+    :return: (plan lines, True if the plan reads a whole table instead of seeking an index)
+    """
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+
+    if conn.dialect.name == "sqlite":
+        lines = [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+        return lines, any(line.startswith("SCAN ") for line in lines)
+
+    if conn.dialect.name == "postgresql":
+        # small tables are cheaper to scan, so ask whether the planner can avoid a seq scan at all
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        lines = [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {sql}")]
+        return lines, any("Seq Scan" in line for line in lines)
+
+    raise NotImplementedError(f"Query plans are not supported on '{conn.dialect.name}'")
+
+
+def check_query_plans(engine):
+    """
+    :return: list of (endpoint, sql, plan lines, is_table_scan)
+    """
+    results = []
+    with engine.connect() as conn:
+        for endpoint, statement in planned_queries():
+            lines, is_table_scan = explain(conn, statement)
+            results.append((endpoint, str(statement), lines, is_table_scan))
+        conn.rollback()
+    return results
@@ -0,0 +1,127 @@
+from sqlalchemy import Float, Numeric, bindparam, case, cast, func, select
+
+from models.movie import Movie
+from models.user import user_movie
+from utils.shards import gather_totals
+
+
+def rating_change_statement(movie_id, old_rating, new_rating):
+    """
+    Statement that applies a rating change to the movie's running aggregates and returns its local_rating.
+
+    Either rating may be None: None -> int is a new vote, int -> int a re-rating, int -> None a removed vote.
+    """
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    return aggregate_change_statement(movie_id, sum_delta, count_delta)
+
+
+def aggregate_change_statement(movie_id, sum_delta, count_delta):
+    """
+    Statement that adds the summed changes of any number of votes to the movie's running aggregates
+    and returns its local_rating.
+    """
+    if sum_delta == 0 and count_delta == 0:
+        return select(Movie.local_rating).where(Movie.id == movie_id)
+
+    new_sum = Movie.rating_sum + sum_delta
+    new_count = Movie.rating_count + count_delta
+
+    return (
+        Movie.__table__.update()
+        .where(Movie.id == movie_id)
+        .values(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            # Postgres only has round(numeric, int), SQLite would divide a numeric cast of an integer as integers
+            local_rating=case(
+                (new_count > 0, func.round(cast(cast(new_sum, Float) / new_count, Numeric), 1)),
+                else_=None
+            )
+        )
+        .returning(Movie.local_rating)
+    )
+
+
+def as_rating(local_rating):
+    return float(local_rating) if local_rating is not None else None
+
+
+def apply_rating_change(session, movie_id, old_rating, new_rating):
+    """
+    Updates the movie's running rating aggregates in the current transaction.
+
+    :return: new local_rating of the movie
+    """
+    return as_rating(session.execute(rating_change_statement(movie_id, old_rating, new_rating)).scalar())
+
+
+def rating_aggregates_from_source(session):
+    """
+    Recomputes (rating_sum, rating_count) per movie from user_movie, summed over every shard.
+
+    :return: dict of movie_id -> (rating_sum, rating_count)
+    """
+    statement = select(
+        user_movie.c.movie_id,
+        func.sum(user_movie.c.user_rating),
+        func.count(user_movie.c.user_rating)
+    ).where(
+        user_movie.c.user_rating.isnot(None)
+    ).group_by(user_movie.c.movie_id)
+
+    totals = gather_totals(session, statement, user_movie.c.user_id)
+    return {movie_id: (int(rating_sum), rating_count) for movie_id, (rating_sum, rating_count) in totals.items()}
+
+
+def find_rating_mismatches(session):
+    """
+    Compares the stored aggregates of every movie against user_movie.
+
+    :return: list of (movie_id, stored (sum, count), expected (sum, count))
+    """
+    expected = rating_aggregates_from_source(session)
+    mismatches = []
+
+    for movie_id, rating_sum, rating_count in session.query(Movie.id, Movie.rating_sum, Movie.rating_count):
+        should_be = expected.get(movie_id, (0, 0))
+        if (rating_sum, rating_count) != should_be:
+            mismatches.append((movie_id, (rating_sum, rating_count), should_be))
+
+    return mismatches
+
+
+def rebuild_rating_aggregates(session, movie_ids=None):
+    """
+    Overwrites rating_sum, rating_count and local_rating from user_movie, for all or the given movies.
+
+    :return: number of movies updated
+    """
+    expected = rating_aggregates_from_source(session)
+    if movie_ids is None:
+        movie_ids = [movie_id for (movie_id,) in session.query(Movie.id)]
+
+    params = []
+    for movie_id in movie_ids:
+        rating_sum, rating_count = expected.get(movie_id, (0, 0))
+        params.append({
+            "movie_id": movie_id,
+            "new_sum": rating_sum,
+            "new_count": rating_count,
+            "new_local_rating": round(rating_sum / rating_count, 1) if rating_count else None
+        })
+
+    if params:
+        movie = Movie.__table__
+        session.execute(
+            movie.update()
+            .where(movie.c.id == bindparam("movie_id"))
+            .values(
+                rating_sum=bindparam("new_sum"),
+                rating_count=bindparam("new_count"),
+                local_rating=bindparam("new_local_rating")
+            ),
+            params
+        )
+
+    return len(params)
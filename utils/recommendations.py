@@ -0,0 +1,322 @@
+import logging
+import math
+from collections import defaultdict
+
+from sqlalchemy import and_, exists, func, select
+from sqlalchemy.orm import aliased
+
+from models.movie import Movie
+from models.similarity import movie_norm, movie_similarity
+from models.user import user_movie
+from utils.dialects import dialect_insert
+from utils.serializers import MOVIE_COLUMNS
+from utils.shards import shard_router
+
+DEFAULT_K = 20
+# a write touching more movie pairs than this (e.g. a large watchlist batch) is left to the next rebuild
+INCREMENTAL_PAIR_LIMIT = 20000
+
+
+def interaction_weight(user_rating):
+    """
+    Weight of a watchlist row in the similarity vectors: 1 while unrated, user_rating / 5 once rated,
+    so a 10 counts twice as much as an unrated movie and a 1 barely at all.
+    """
+    return 1.0 if user_rating is None else user_rating / 5
+
+
+def cosine(dot, norm_sq, other_norm_sq):
+    if dot <= 0 or norm_sq <= 0 or other_norm_sq <= 0:
+        return 0.0
+    return dot / math.sqrt(norm_sq * other_norm_sq)
+
+
+def user_weights_statement(user_id):
+    return select(user_movie.c.movie_id, user_movie.c.user_rating).where(user_movie.c.user_id == user_id)
+
+
+def neighbor_counts_statement(movie_ids):
+    return select(movie_similarity.c.movie_id, func.count()).where(
+        movie_similarity.c.movie_id.in_(movie_ids)
+    ).group_by(movie_similarity.c.movie_id)
+
+
+def existing_pairs_statement(movie_ids):
+    return select(movie_similarity.c.movie_id, movie_similarity.c.similar_movie_id).where(
+        movie_similarity.c.movie_id.in_(movie_ids) &
+        movie_similarity.c.similar_movie_id.in_(movie_ids)
+    )
+
+
+def norm_upsert_statement(session):
+    # additive, so concurrent writers never lose each other's deltas
+    statement = dialect_insert(session, movie_norm)
+    return statement.on_conflict_do_update(
+        index_elements=[movie_norm.c.movie_id],
+        set_={"norm_sq": movie_norm.c.norm_sq + statement.excluded.norm_sq}
+    )
+
+
+def pair_upsert_statement(session):
+    statement = dialect_insert(session, movie_similarity)
+    return statement.on_conflict_do_update(
+        index_elements=[movie_similarity.c.movie_id, movie_similarity.c.similar_movie_id],
+        set_={"dot": movie_similarity.c.dot + statement.excluded.dot}
+    )
+
+
+def neighbors_statement(movie_id):
+    """
+    :return: select of (similar_movie_id, dot, norm_sq of movie_id, norm_sq of the neighbor), at most ~K rows
+    """
+    norm, other_norm = aliased(movie_norm), aliased(movie_norm)
+    return select(
+        movie_similarity.c.similar_movie_id, movie_similarity.c.dot, norm.c.norm_sq, other_norm.c.norm_sq
+    ).join(
+        norm, norm.c.movie_id == movie_similarity.c.movie_id
+    ).join(
+        other_norm, other_norm.c.movie_id == movie_similarity.c.similar_movie_id
+    ).where(movie_similarity.c.movie_id == movie_id)
+
+
+def user_neighbors_statement(user_id):
+    """
+    :return: select of (movie_id, user_rating, similar_movie_id, dot, norm_sq, neighbor norm_sq) for the neighbors
+             of every movie on the user's watchlist that are not on it themselves, ~K rows per watchlist movie
+    """
+    norm, other_norm = aliased(movie_norm), aliased(movie_norm)
+    watched = aliased(user_movie)
+    return select(
+        movie_similarity.c.movie_id, user_movie.c.user_rating, movie_similarity.c.similar_movie_id,
+        movie_similarity.c.dot, norm.c.norm_sq, other_norm.c.norm_sq
+    ).join(
+        user_movie, and_(user_movie.c.movie_id == movie_similarity.c.movie_id, user_movie.c.user_id == user_id)
+    ).join(
+        norm, norm.c.movie_id == movie_similarity.c.movie_id
+    ).join(
+        other_norm, other_norm.c.movie_id == movie_similarity.c.similar_movie_id
+    ).where(
+        ~exists().where((watched.c.user_id == user_id) & (watched.c.movie_id == movie_similarity.c.similar_movie_id))
+    )
+
+
+def similar_movies_statement(movie_ids):
+    """
+    :return: select of (movie_id, similar_movie_id, dot, norm_sq, neighbor norm_sq) of the neighbors of movie_ids
+    """
+    norm, other_norm = aliased(movie_norm), aliased(movie_norm)
+    return select(
+        movie_similarity.c.movie_id, movie_similarity.c.similar_movie_id, movie_similarity.c.dot,
+        norm.c.norm_sq, other_norm.c.norm_sq
+    ).join(
+        norm, norm.c.movie_id == movie_similarity.c.movie_id
+    ).join(
+        other_norm, other_norm.c.movie_id == movie_similarity.c.similar_movie_id
+    ).where(movie_similarity.c.movie_id.in_(movie_ids))
+
+
+def neighbor_rows(ratings, rows):
+    """
+    The rows of user_neighbors_statement, joined in Python when the watchlist is on a shard.
+
+    :param ratings: dict of movie_id -> user_rating of the user's watchlist
+    :param rows: similar_movies_statement rows of its movies
+    """
+    return [
+        (movie_id, ratings[movie_id], similar_movie_id, dot, norm_sq, other_norm_sq)
+        for movie_id, similar_movie_id, dot, norm_sq, other_norm_sq in rows if similar_movie_id not in ratings
+    ]
+
+
+def movies_statement(movie_ids):
+    return select(*MOVIE_COLUMNS).where(Movie.id.in_(movie_ids))
+
+
+def similarity_deltas(weights, changed):
+    """
+    Changes of the norms and dot products caused by one user's watchlist change.
+
+    :param weights: dict of movie_id -> weight of the user's watchlist rows after the change
+    :param changed: dict of movie_id -> weight of the changed rows before the change, 0 for added movies
+    :return: (dict of movie_id -> norm_sq delta, dict of (movie_id, similar_movie_id) -> dot delta)
+    """
+    norms = {}
+    pairs = {}
+    movie_ids = set(weights) | set(changed)
+
+    for movie_id, old in changed.items():
+        new = weights.get(movie_id, 0.0)
+        if new == old:
+            continue
+        norms[movie_id] = new * new - old * old
+
+        for other_id in movie_ids:
+            if other_id == movie_id:
+                continue
+            other_new = weights.get(other_id, 0.0)
+            other_old = changed.get(other_id, other_new)
+            delta = new * other_new - old * other_old
+            if delta:
+                pairs[(movie_id, other_id)] = delta
+                # pairs of two changed movies are added from both sides
+                if other_id not in changed:
+                    pairs[(other_id, movie_id)] = delta
+
+    return norms, pairs
+
+
+def plan_pair_rows(pairs, existing, counts, k):
+    """
+    Keeps the deltas of stored pairs, and of new pairs only while their movie has fewer than k neighbors,
+    so lists stay about k long between rebuilds.
+
+    :return: rows for pair_upsert_statement
+    """
+    rows = []
+    for (movie_id, similar_movie_id), delta in pairs.items():
+        if (movie_id, similar_movie_id) not in existing:
+            if delta <= 0 or counts.get(movie_id, 0) >= k:
+                continue
+            counts[movie_id] = counts.get(movie_id, 0) + 1
+        rows.append({"movie_id": movie_id, "similar_movie_id": similar_movie_id, "dot": delta})
+    return rows
+
+
+def rank_neighbors(rows, limit):
+    """
+    :param rows: rows of neighbors_statement
+    :return: list of (movie_id, score), best first
+    """
+    scored = [(similar_movie_id, cosine(dot, norm_sq, other_norm_sq))
+              for similar_movie_id, dot, norm_sq, other_norm_sq in rows]
+    return sorted([item for item in scored if item[1] > 0], key=lambda item: (-item[1], item[0]))[:limit]
+
+
+def rank_recommendations(rows, limit):
+    """
+    Scores each candidate by the similarities to the user's movies, weighted like the user's own rows.
+
+    :param rows: rows of user_neighbors_statement
+    :return: list of (movie_id, score), best first
+    """
+    scores = defaultdict(float)
+    for movie_id, user_rating, similar_movie_id, dot, norm_sq, other_norm_sq in rows:
+        scores[similar_movie_id] += interaction_weight(user_rating) * cosine(dot, norm_sq, other_norm_sq)
+    return sorted([item for item in scores.items() if item[1] > 0], key=lambda item: (-item[1], item[0]))[:limit]
+
+
+def scored_movies(rows, ranked):
+    """
+    :param rows: movie rows of movies_statement
+    :param ranked: list of (movie_id, score)
+    :return: list of movie dicts with their score, in ranked order
+    """
+    movies = {row.id: row._asdict() for row in rows}
+    return [{**movies[movie_id], "score": round(score, 4)} for movie_id, score in ranked if movie_id in movies]
+
+
+class SimilarityIndex:
+    """
+    Serves item-to-item neighbors from movie_similarity, rebuilt offline by `flask recommendations build`.
+
+    Watchlist and rating writes apply their deltas to the stored pairs in the same transaction. They update
+    pairs already stored and add new ones only while a movie has fewer than K neighbors, so scores drift
+    from the exact top-K until the next rebuild.
+    """
+
+    def __init__(self):
+        self.k = DEFAULT_K
+        self.logger = logging.getLogger(__name__)
+
+    def init_app(self, app):
+        self.k = int(app.config.get("RECOMMENDATIONS_K", DEFAULT_K))
+        # the ASGI app has no app context, so log through the app's logger directly
+        self.logger = app.logger
+
+    def _plan(self, weights, changed):
+        norms, pairs = similarity_deltas(weights, changed)
+        if len(pairs) > INCREMENTAL_PAIR_LIMIT:
+            self.logger.info(f"Skipped {len(pairs)} similarity updates, left to the next rebuild")
+            return None
+        return norms, pairs, list(set(weights) | set(changed))
+
+    def record(self, session, user_id, changed):
+        """
+        Applies a watchlist change of one user to the stored similarities. Does not commit.
+
+        :param changed: dict of movie_id -> weight of the changed watchlist rows before the change, 0 if added
+        """
+        if not changed:
+            return
+        weights = {movie_id: interaction_weight(rating)
+                   for movie_id, rating in session.execute(user_weights_statement(user_id))}
+        plan = self._plan(weights, changed)
+        if plan is None:
+            return
+        norms, pairs, movie_ids = plan
+
+        if norms:
+            session.execute(norm_upsert_statement(session),
+                            [{"movie_id": movie_id, "norm_sq": delta} for movie_id, delta in norms.items()])
+        if pairs:
+            existing = set(session.execute(existing_pairs_statement(movie_ids)).all())
+            counts = dict(session.execute(neighbor_counts_statement(movie_ids)).all())
+            rows = plan_pair_rows(pairs, existing, counts, self.k)
+            if rows:
+                session.execute(pair_upsert_statement(session), rows)
+
+    async def record_async(self, session, user_id, changed):
+        """
+        record on an AsyncSession.
+        """
+        if not changed:
+            return
+        weights = {movie_id: interaction_weight(rating)
+                   for movie_id, rating in await session.execute(user_weights_statement(user_id))}
+        plan = self._plan(weights, changed)
+        if plan is None:
+            return
+        norms, pairs, movie_ids = plan
+
+        if norms:
+            await session.execute(norm_upsert_statement(session),
+                                  [{"movie_id": movie_id, "norm_sq": delta} for movie_id, delta in norms.items()])
+        if pairs:
+            existing = set((await session.execute(existing_pairs_statement(movie_ids))).all())
+            counts = dict((await session.execute(neighbor_counts_statement(movie_ids))).all())
+            rows = plan_pair_rows(pairs, existing, counts, self.k)
+            if rows:
+                await session.execute(pair_upsert_statement(session), rows)
+
+    def user_neighbors(self, session, user_id):
+        """
+        :return: user_neighbors_statement rows of the user, in two reads when the watchlist is on a shard
+                 and the similarities on the primary
+        """
+        if not shard_router.enabled:
+            return session.execute(user_neighbors_statement(user_id)).all()
+        ratings = dict(session.execute(user_weights_statement(user_id)).all())
+        return neighbor_rows(ratings, session.execute(similar_movies_statement(list(ratings))).all()) if ratings else []
+
+    async def user_neighbors_async(self, session, user_id):
+        """
+        user_neighbors on an AsyncSession.
+        """
+        if not shard_router.enabled:
+            return (await session.execute(user_neighbors_statement(user_id))).all()
+        ratings = dict((await session.execute(user_weights_statement(user_id))).all())
+        if not ratings:
+            return []
+        return neighbor_rows(ratings, (await session.execute(similar_movies_statement(list(ratings)))).all())
+
+    def limit(self, value):
+        """
+        :return: the requested number of results between 1 and K, K when missing or malformed
+        """
+        try:
+            return max(1, min(int(value), self.k))
+        except (TypeError, ValueError):
+            return self.k
+
+
+similarity_index = SimilarityIndex()
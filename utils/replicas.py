@@ -0,0 +1,75 @@
+import random
+import time
+from functools import wraps
+
+from flask import g, request, session
+from flask_sqlalchemy.session import Session
+
+from utils.cache import response_cache
+from utils.metrics import request_metrics
+from utils.shards import shard_engine
+
+DEFAULT_STICKY_SECONDS = 5
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RoutingSession(Session):
+    """
+    db.session that sends the per-user tables to the shard chosen by utils.shards, and the reads of a request
+    marked by ReplicaRouter.read_only to its replica bind. Writes and flushes always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engine = shard_engine(self._db.engines, mapper, clause)
+            if engine is not None:
+                return engine
+
+        replica = g.get("db_replica")
+        if bind is None and replica is not None and not self._flushing and not getattr(clause, "is_dml", False):
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """
+    Spreads the read-only handlers over the replica binds of DATABASE_REPLICA_URIS.
+
+    A client that wrote something reads from the primary for the next REPLICA_STICKY_SECONDS,
+    so it sees its own writes while the replicas catch up. So do the cache misses of the cached handlers,
+    the body they render is served to every client for MOVIE_CACHE_TTL.
+    """
+
+    def __init__(self):
+        self.replicas = []
+        self.sticky_seconds = DEFAULT_STICKY_SECONDS
+
+    def init_app(self, app):
+        self.replicas = sorted(key for key in app.config.get("SQLALCHEMY_BINDS") or {} if key.startswith("replica_"))
+        self.sticky_seconds = float(app.config.get("REPLICA_STICKY_SECONDS", DEFAULT_STICKY_SECONDS))
+
+        app.before_request(self._start_request)
+        app.after_request(self._stick_to_primary)
+
+    def _start_request(self):
+        g.pop("db_replica", None)
+
+    def _stick_to_primary(self, response):
+        if self.replicas and request.method not in SAFE_METHODS and response.status_code < 400:
+            session["_primary_until"] = time.time() + self.sticky_seconds
+        return response
+
+    def read_only(self, f):
+        """
+        Routes the reads of the decorated handler, and of the response it streams, to a replica.
+        """
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if self.replicas and session.get("_primary_until", 0) <= time.time() and not response_cache.filling():
+                g.db_replica = random.choice(self.replicas)
+                request_metrics.increment("db_replica_requests_total", request.endpoint)
+            return f(*args, **kwargs)
+        return decorated
+
+
+replica_router = ReplicaRouter()
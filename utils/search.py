@@ -0,0 +1,137 @@
+from sqlalchemy import text
+
+from utils.adapters import remove_special_characters
+
+# bm25 weights for (title, description): a title hit ranks above a description hit
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+SQLITE_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS movie_fts USING fts5(
+        title, description, content='movie', content_rowid='id', tokenize='unicode61'
+    )
+    """,
+    # keep the external content index in sync with every write to movie, including the seeder
+    """
+    CREATE TRIGGER IF NOT EXISTS movie_fts_ai AFTER INSERT ON movie BEGIN
+        INSERT INTO movie_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS movie_fts_ad AFTER DELETE ON movie BEGIN
+        INSERT INTO movie_fts(movie_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS movie_fts_au AFTER UPDATE OF title, description ON movie BEGIN
+        INSERT INTO movie_fts(movie_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO movie_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """
+]
+
+POSTGRES_INDEX_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_movie_title_trgm ON movie USING gin (lower(title) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_movie_description_tsv ON movie USING gin (to_tsvector('simple', description))"
+]
+
+MOVIE_SEARCH_COLUMNS = "movie.id, movie.title, movie.description, movie.rating, movie.local_rating, movie.img_url"
+
+
+def create_search_index(conn):
+    """
+    Creates the full-text index for movie search over the given connection, if it does not exist yet.
+
+    SQLite gets an FTS5 table kept in sync by triggers, Postgres gets trigram and tsvector GIN indexes.
+    Other dialects fall back to LIKE scans in search_movies.
+    """
+    dialect = conn.dialect.name
+
+    if dialect == "sqlite":
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'movie_fts'")
+        ).scalar()
+        for statement in SQLITE_INDEX_DDL:
+            conn.execute(text(statement))
+        # index movies that were inserted before the fts table existed
+        if not exists:
+            conn.execute(text("INSERT INTO movie_fts(movie_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for statement in POSTGRES_INDEX_DDL:
+            conn.execute(text(statement))
+
+
+def _fts5_match_expression(terms, with_description):
+    # every term must match as a word prefix, quoted so user input is never parsed as fts syntax
+    expression = " ".join(f'"{term}"*' for term in terms)
+    if with_description:
+        return f"({expression})"
+    return f"{{title}} : ({expression})"
+
+
+def search_statement(dialect, movie_input, with_description=False, limit=50, offset=0):
+    """
+    Builds the movie search query for the given dialect name.
+
+    :return: (statement, params), or None when the input has nothing to search for
+    """
+    cleaned = remove_special_characters(movie_input or "").strip().lower()
+    terms = cleaned.split()
+    if not terms:
+        return None
+
+    params = {"limit": limit, "offset": offset}
+
+    if dialect == "sqlite":
+        statement = text(f"""
+            SELECT {MOVIE_SEARCH_COLUMNS}
+            FROM movie_fts JOIN movie ON movie.id = movie_fts.rowid
+            WHERE movie_fts MATCH :match
+            ORDER BY bm25(movie_fts, {TITLE_WEIGHT}, {DESCRIPTION_WEIGHT}), movie.id
+            LIMIT :limit OFFSET :offset
+        """)
+        params["match"] = _fts5_match_expression(terms, with_description)
+    elif dialect == "postgresql":
+        description_filter = ""
+        description_rank = ""
+        if with_description:
+            description_filter = "OR to_tsvector('simple', movie.description) @@ plainto_tsquery('simple', :query)"
+            description_rank = "+ ts_rank(to_tsvector('simple', movie.description), plainto_tsquery('simple', :query))"
+        statement = text(f"""
+            SELECT {MOVIE_SEARCH_COLUMNS}
+            FROM movie
+            WHERE lower(movie.title) LIKE :pattern {description_filter}
+            ORDER BY similarity(lower(movie.title), :query) {description_rank} DESC, movie.id
+            LIMIT :limit OFFSET :offset
+        """)
+        params["query"] = cleaned
+        params["pattern"] = f"%{cleaned}%"
+    else:
+        description_filter = "OR lower(movie.description) LIKE :pattern" if with_description else ""
+        statement = text(f"""
+            SELECT {MOVIE_SEARCH_COLUMNS}
+            FROM movie
+            WHERE lower(movie.title) LIKE :pattern {description_filter}
+            ORDER BY movie.id
+            LIMIT :limit OFFSET :offset
+        """)
+        params["pattern"] = f"%{cleaned}%"
+
+    return statement, params
+
+
+def search_movies(session, movie_input, with_description=False, limit=50, offset=0):
+    """
+    Searches movies by title (and optionally description), best matches first.
+
+    :return: list of movie dicts
+    """
+    query = search_statement(session.get_bind().dialect.name, movie_input, with_description, limit, offset)
+    if query is None:
+        return []
+
+    return [dict(row) for row in session.execute(*query).mappings()]
@@ -0,0 +1,158 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+from flask import current_app, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+from models.comment import Comment
+from models.movie import Movie
+from utils.cache import LRUCache
+
+# columns of the JSON documents, selected as plain rows without hydrating ORM objects
+MOVIE_COLUMNS = (
+    Movie.id,
+    Movie.title,
+    Movie.description,
+    Movie.rating,
+    Movie.local_rating,
+    Movie.img_url
+)
+MOVIE_DETAIL_COLUMNS = MOVIE_COLUMNS + (Movie.comment_count,)
+MOVIE_COMMENT_COLUMNS = (Comment.id, Comment.text, Comment.author_id)
+USER_COMMENT_COLUMNS = (Comment.id, Comment.text, Comment.movie_id)
+
+# fragments are keyed by the row values, a changed row simply misses, so entries never need to expire
+FRAGMENT_TTL = 24 * 60 * 60
+
+
+def available_backends():
+    return ["orjson", "json"] if orjson is not None else ["json"]
+
+
+class RowEncoder:
+    """
+    Encodes JSON to bytes with orjson when it is installed, and can reuse pre-encoded result rows.
+
+    Output matches Flask's default provider: sorted keys, compact separators, and dates, decimals and uuids
+    go through the same default().
+    """
+
+    def __init__(self, backend="auto", fragment_cache_size=0, sort_keys=True):
+        if backend == "auto":
+            backend = available_backends()[0]
+        if backend not in available_backends():
+            raise ValueError(f"Unknown or unavailable JSON_BACKEND '{backend}'")
+
+        self.backend = backend
+        self.sort_keys = sort_keys
+        self.fragments = LRUCache(fragment_cache_size, FRAGMENT_TTL) if fragment_cache_size > 0 else None
+        if backend == "orjson":
+            self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+            if sort_keys:
+                self._options |= orjson.OPT_SORT_KEYS
+
+    def dumps(self, obj):
+        """
+        :return: compact UTF-8 encoded JSON of obj
+        """
+        if self.backend == "orjson":
+            try:
+                return orjson.dumps(obj, default=DefaultJSONProvider.default, option=self._options)
+            except orjson.JSONEncodeError:
+                # e.g. integers over 64 bits, which the stdlib encoder handles
+                pass
+        return json.dumps(
+            obj, default=DefaultJSONProvider.default, sort_keys=self.sort_keys, separators=(",", ":")
+        ).encode()
+
+    def encode_row(self, row):
+        """
+        :return: encoded JSON object of a result row, from the fragment cache when it is enabled
+        """
+        if self.fragments is None:
+            return self.dumps(row._asdict())
+
+        key = (row._fields, tuple(row))
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            fragment = self.dumps(row._asdict())
+            self.fragments.set(key, fragment)
+        return fragment
+
+    def encode_rows(self, rows, key=None, **fields):
+        """
+        :return: encoded JSON array of result rows, or with key the object {key: [...], **fields}
+        """
+        if self.fragments is None:
+            body = self.dumps([row._asdict() for row in rows])
+        else:
+            body = b"[" + b",".join(self.encode_row(row) for row in rows) + b"]"
+
+        if key:
+            members = {**fields, key: None}
+            names = sorted(members) if self.sort_keys else members
+            body = b"{" + b",".join(
+                self.dumps(name) + b":" + (body if name == key else self.dumps(fields[name]))
+                for name in names
+            ) + b"}"
+        return body
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by a RowEncoder, configured from JSON_BACKEND ("auto", "orjson" or "json")
+    and JSON_FRAGMENT_CACHE_SIZE (encoded rows kept per worker, 0 disables the fragment cache).
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.encoder = RowEncoder(
+            app.config.get("JSON_BACKEND") or "auto",
+            int(app.config.get("JSON_FRAGMENT_CACHE_SIZE") or 0),
+            self.sort_keys
+        )
+
+    @property
+    def pretty(self):
+        return self.compact is False or (self.compact is None and self._app.debug)
+
+    def dumps(self, obj, **kwargs):
+        if not kwargs:
+            return self.encoder.dumps(obj).decode()
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if self.pretty:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encoder.dumps(obj) + b"\n", mimetype=self.mimetype)
+
+
+def rows_to_dicts(rows):
+    return [row._asdict() for row in rows]
+
+
+def encode_row(row):
+    provider = current_app.json
+    if isinstance(provider, FastJSONProvider):
+        return provider.encoder.encode_row(row)
+    return provider.dumps(row._asdict()).encode()
+
+
+def rows_response(rows, key=None, **fields):
+    """
+    JSON response of result rows, as an array or, with key, as an object {key: [...], **fields}.
+
+    Rows are written as pre-encoded bytes when the app uses FastJSONProvider.
+    """
+    provider = current_app.json
+    if not isinstance(provider, FastJSONProvider) or provider.pretty:
+        return jsonify({key: rows_to_dicts(rows), **fields} if key else rows_to_dicts(rows))
+
+    body = provider.encoder.encode_rows(rows, key, **fields)
+    return current_app.response_class(body + b"\n", mimetype=provider.mimetype)
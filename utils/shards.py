@@ -0,0 +1,497 @@
+import asyncio
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import jsonify
+from flask_login import current_user
+from sqlalchemy import case, delete, func, insert, inspect, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
+
+from models.shard import id_allocation, shard_bucket
+from utils.dialects import dialect_insert
+
+DEFAULT_BUCKETS = 256
+DEFAULT_REFRESH_SECONDS = 5
+COPY_CHUNK_SIZE = 5000
+ACTIVE, MOVING, DRAINING = "active", "moving", "draining"
+COMMENT_IDS = "comment"
+
+# the per-user tables and the column holding the user id their rows are sharded by
+# the change counters and tombstones of utils.changes live next to the rows they version
+SHARDED_TABLES = {"user_movie": "user_id", "comment": "author_id", "change_version": "user_id",
+                  "change_tombstone": "user_id"}
+
+# location of the per-user rows the current request works with: a shard bind key, None for the primary
+_UNROUTED = object()
+_location = ContextVar("db_shard", default=_UNROUTED)
+
+
+class ShardMoving(Exception):
+    """
+    The user's bucket is being moved to another shard by `flask shards rebalance`, its writes are refused meanwhile.
+    """
+
+
+def sharded_tables():
+    """
+    :return: dict of table name -> (table, user id column) of the per-user tables
+    """
+    # looked up on use, db.session's RoutingSession imports this module before the models are defined
+    from database import db
+    return {name: (db.metadata.tables[name], db.metadata.tables[name].c[column]) for name, column in SHARDED_TABLES.items()}
+
+
+def touches_user_data(mapper, clause):
+    if mapper is not None and inspect(mapper).local_table.name in SHARDED_TABLES:
+        return True
+    if clause is None:
+        return False
+    return any(getattr(table, "name", None) in SHARDED_TABLES for table in find_tables(clause, include_crud=True))
+
+
+def shard_engine(engines, mapper, clause):
+    """
+    get_bind step of the sessions: statements of the per-user tables go to the shard chosen for the request.
+
+    :param engines: bind key -> engine of the session
+    :return: engine of the shard, None for the primary (or when the statement does not touch per-user tables)
+    """
+    if not shard_router.enabled or not touches_user_data(mapper, clause):
+        return None
+    location = _location.get()
+    if location is _UNROUTED:
+        raise RuntimeError("Per-user tables queried without choosing a shard, see shard_router.use and gather")
+    return engines[location] if location is not None else None
+
+
+class ShardedSession(Session):
+    """
+    Session routing the per-user tables like RoutingSession, for the ASGI app, the write-behind flusher and commands.
+
+    :param shard_engines: bind key -> engine, shard_router.engines by default,
+                          the sync_engine of each shard's AsyncEngine for an AsyncSession
+    """
+
+    def __init__(self, *args, shard_engines=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard_engines = shard_engines
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engine = shard_engine(self.shard_engines or shard_router.engines, mapper, clause)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def next_id_statement(name):
+    """
+    :return: UPDATE of id_allocation handing out the next id of name, returned as "id"
+    """
+    return (
+        update(id_allocation)
+        .where(id_allocation.c.name == name)
+        .values(next_id=id_allocation.c.next_id + 1)
+        .returning((id_allocation.c.next_id - 1).label("id"))
+    )
+
+
+def bucket_clause(column, buckets, bucket_ids):
+    return (column % buckets).in_(sorted(bucket_ids))
+
+
+class ShardRouter:
+    """
+    User-keyed sharding of the per-user tables (user_movie, comment) over the DATABASE_SHARD_URIS databases.
+
+    Users are hashed into SHARD_BUCKETS buckets by id, the shard_bucket map on the primary says which shard holds
+    a bucket (buckets without a row are still on the primary), and every process re-reads it every
+    SHARD_MAP_REFRESH_SECONDS. Handlers decorated with user_shard route the per-user tables of db.session to the
+    logged in user's shard, everything else (movies, users, leaderboards, similarities) stays on the primary.
+    Reads across users, a movie's comments or the rating aggregates, gather the rows of every location.
+
+    Without shards configured every location is the primary and nothing is routed.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.engines = {}
+        self.buckets = DEFAULT_BUCKETS
+        self.refresh_seconds = DEFAULT_REFRESH_SECONDS
+        # bucket -> (location, state, source) of the mapped buckets
+        self._map = {}
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    @property
+    def shards(self):
+        return list(self.engines)
+
+    def init_app(self, app, engine, engines):
+        """
+        :param engine: sync engine of the primary, which holds the bucket map
+        :param engines: shard bind key -> sync engine, in DATABASE_SHARD_URIS order
+        """
+        self.engine = engine
+        self.engines = dict(engines)
+        self.buckets = int(app.config.get("SHARD_BUCKETS", DEFAULT_BUCKETS))
+        self.refresh_seconds = float(app.config.get("SHARD_MAP_REFRESH_SECONDS", DEFAULT_REFRESH_SECONDS))
+        self._map = {}
+        self._next_refresh = 0.0
+
+        app.before_request(self._start_request)
+        app.register_error_handler(ShardMoving, self.moving_response)
+        if self.enabled:
+            self.reserve_ids()
+
+    def _start_request(self):
+        # threads of a WSGI server serve one request after the other, nothing is routed until a handler chooses
+        _location.set(_UNROUTED)
+
+    def retry_after(self):
+        # a moved bucket takes writes again once the workers re-read the map
+        return str(max(1, math.ceil(self.refresh_seconds)))
+
+    def moving_response(self, err):
+        response = jsonify({"error": str(err)})
+        response.headers["Retry-After"] = self.retry_after()
+        return response, 503
+
+    def refresh_due(self):
+        return self.enabled and time.monotonic() >= self._next_refresh
+
+    def bucket_map(self, force=False):
+        """
+        :return: dict of bucket -> (location, state, source) of the buckets that have a row
+        """
+        if force or time.monotonic() >= self._next_refresh:
+            with self.engine.connect() as conn:
+                rows = conn.execute(select(shard_bucket)).all()
+            unknown = {row.shard for row in rows if row.shard is not None} - set(self.engines)
+            if unknown:
+                raise RuntimeError(f"Buckets live on {sorted(unknown)}, which DATABASE_SHARD_URIS does not configure")
+            with self._lock:
+                self._map = {row.bucket: (row.shard, row.state, row.source) for row in rows}
+                self._next_refresh = time.monotonic() + self.refresh_seconds
+        return self._map
+
+    def bucket(self, user_id):
+        return user_id % self.buckets
+
+    def location(self, user_id, write=False):
+        """
+        :return: bind key of the shard holding the user's rows, None for the primary.
+                 Raises ShardMoving for a write while the user's bucket is being moved.
+        """
+        location, state, _ = self.bucket_map().get(self.bucket(user_id), (None, ACTIVE, None))
+        if write and state == MOVING:
+            raise ShardMoving("The user's data is being moved to another shard, retry shortly")
+        return location
+
+    def use(self, user_id, write=False):
+        """
+        Routes the per-user tables to the user's shard for the rest of the request (or asyncio task).
+        """
+        _location.set(self.location(user_id, write) if self.enabled else None)
+
+    @contextmanager
+    def routed_to(self, location):
+        token = _location.set(location)
+        try:
+            yield
+        finally:
+            _location.reset(token)
+
+    def locations(self):
+        """
+        :return: every location that may hold per-user rows: the shards, and the primary while buckets are left there
+        """
+        if not self.enabled:
+            return [None]
+        bucket_map = self.bucket_map()
+        on_primary = len(bucket_map) < self.buckets or any(
+            location is None or (state == DRAINING and source is None) for location, state, source in bucket_map.values()
+        )
+        return ([None] if on_primary else []) + self.shards
+
+    def location_engine(self, location):
+        return self.engines[location] if location is not None else self.engine
+
+    def sources(self, column):
+        """
+        :param column: user id column of the table to read
+        :return: list of (engine, criterion) to read every row of a per-user table once, e.g. for a rebuild
+        """
+        return [(self.location_engine(location), self.ownership_clause(location, column)) for location in self.locations()]
+
+    def foreign_buckets(self, location):
+        """
+        :return: buckets whose rows at location are a copy of a move in progress, owned by another location
+        """
+        return {
+            bucket for bucket, (owner, state, _) in self.bucket_map().items() if state != ACTIVE and owner != location
+        }
+
+    def ownership_clause(self, location, column):
+        """
+        :return: criterion keeping the rows location owns, None when it owns all it holds
+        """
+        foreign = self.foreign_buckets(location) if self.enabled else ()
+        return ~bucket_clause(column, self.buckets, foreign) if foreign else None
+
+    def user_shard(self, write=False):
+        """
+        Routes the per-user tables of the decorated handler to the logged in user's shard. With write=True it
+        answers 503 while the user's bucket is being moved. Goes below login_required.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                self.use(current_user.id, write)
+                return f(*args, **kwargs)
+            return decorated
+        return decorator
+
+    def reserve_ids(self):
+        """
+        Moves the comment id allocation past the ids of every location, so ids handed out are unique across shards,
+        including the ids of comments written before sharding.
+        """
+        comment, _ = sharded_tables()["comment"]
+        highest = 0
+        for location in self.locations():
+            with self.location_engine(location).connect() as conn:
+                highest = max(highest, conn.execute(select(func.max(comment.c.id))).scalar() or 0)
+
+        with Session(self.engine) as session:
+            statement = dialect_insert(session, id_allocation).values(name=COMMENT_IDS, next_id=highest + 1)
+            session.execute(statement.on_conflict_do_update(
+                index_elements=[id_allocation.c.name],
+                set_={"next_id": case(
+                    (id_allocation.c.next_id < statement.excluded.next_id, statement.excluded.next_id),
+                    else_=id_allocation.c.next_id
+                )}
+            ))
+            session.commit()
+
+
+def gather(session, statement, user_key):
+    """
+    Runs a select of per-user rows on every location and concatenates the rows, leaving out the copies of
+    buckets in transit that another location owns.
+
+    :param user_key: name of the row attribute holding the user id
+    """
+    rows = []
+    for location in shard_router.locations():
+        with shard_router.routed_to(location):
+            rows.extend(_owned(location, session.execute(statement, bind_arguments=_clause(statement)).all(), user_key))
+    return rows
+
+
+async def gather_async(session, statement, user_key):
+    """
+    gather on an AsyncSession.
+    """
+    if shard_router.refresh_due():
+        # the bucket map is read with the sync engine, off the event loop
+        await asyncio.to_thread(shard_router.bucket_map)
+    rows = []
+    for location in shard_router.locations():
+        with shard_router.routed_to(location):
+            rows.extend(_owned(location, (await session.execute(
+                statement, bind_arguments=_clause(statement)
+            )).all(), user_key))
+    return rows
+
+
+def _clause(statement):
+    # the ORM does not hand a UNION of ORM columns to get_bind, e.g. first_comments_of_movies_statement
+    return {"clause": statement}
+
+
+def _owned(location, rows, user_key):
+    foreign = shard_router.foreign_buckets(location) if shard_router.enabled else ()
+    if not foreign:
+        return rows
+    return [row for row in rows if getattr(row, user_key) is None
+            or shard_router.bucket(getattr(row, user_key)) not in foreign]
+
+
+def gather_totals(session, statement, user_column):
+    """
+    Runs a grouped aggregate select of (key, *sums) on every location and adds the sums up per key,
+    e.g. the rating sum and count of each movie over all shards.
+
+    :param user_column: user id column of the aggregated table, to leave out the copies of buckets in transit
+    :return: dict of key -> list of sums
+    """
+    totals = {}
+    for location in shard_router.locations():
+        criterion = shard_router.ownership_clause(location, user_column)
+        scoped = statement.where(criterion) if criterion is not None else statement
+        with shard_router.routed_to(location):
+            for key, *values in session.execute(scoped):
+                total = totals.setdefault(key, [0] * len(values))
+                for index, value in enumerate(values):
+                    total[index] += value or 0
+    return totals
+
+
+def plan_rebalance(bucket_map, shards, buckets):
+    """
+    Spreads the buckets evenly over the shards, moving as few as possible: a bucket stays where it is
+    while its shard is under its share, the rest, including the buckets still on the primary, move.
+
+    :param bucket_map: dict of bucket -> (location, state, source)
+    :return: dict of bucket -> target shard of the buckets that move
+    """
+    quota = {shard: buckets // len(shards) + (index < buckets % len(shards)) for index, shard in enumerate(shards)}
+    load = dict.fromkeys(shards, 0)
+    movers = []
+    for bucket in range(buckets):
+        owner = bucket_map.get(bucket, (None, ACTIVE, None))[0]
+        if owner in load and load[owner] < quota[owner]:
+            load[owner] += 1
+        else:
+            movers.append(bucket)
+
+    moves = {}
+    for bucket in movers:
+        target = next(shard for shard in shards if load[shard] < quota[shard])
+        load[target] += 1
+        moves[bucket] = target
+    return moves
+
+
+class Rebalancer:
+    """
+    Moves buckets between locations for `flask shards rebalance`, a step of buckets at a time:
+
+    1. the buckets are marked moving: workers refuse their writes once they re-read the map, reads continue
+    2. their rows are copied from the source to the target
+    3. the map points them to the target and marks them draining: other locations ignore their copies
+    4. the source copy is deleted and the buckets are active again
+
+    Between the map changes it waits for every worker to have re-read the map. An interrupted run
+    is picked up by the next: draining buckets are finished, moving ones are moved again.
+    """
+
+    def __init__(self, router, wait, chunk_size=COPY_CHUNK_SIZE, echo=print):
+        self.router = router
+        self.wait = wait
+        self.chunk_size = chunk_size
+        self.echo = echo
+
+    def _set_buckets(self, bucket_ids, location, state, source=None):
+        with self.router.engine.begin() as conn:
+            conn.execute(delete(shard_bucket).where(shard_bucket.c.bucket.in_(sorted(bucket_ids))))
+            conn.execute(insert(shard_bucket), [
+                {"bucket": bucket, "shard": location, "state": state, "source": source} for bucket in sorted(bucket_ids)
+            ])
+
+    def _wait_for_workers(self):
+        if self.wait:
+            time.sleep(self.wait)
+
+    def _delete(self, location, bucket_ids):
+        deleted = 0
+        with self.router.location_engine(location).begin() as conn:
+            for table, column in sharded_tables().values():
+                deleted += conn.execute(delete(table).where(bucket_clause(column, self.router.buckets, bucket_ids))).rowcount
+        return deleted
+
+    def _copy(self, source, target, bucket_ids):
+        copied = 0
+        source_engine, target_engine = self.router.location_engine(source), self.router.location_engine(target)
+        with source_engine.connect() as reader, target_engine.begin() as writer:
+            for table, column in sharded_tables().values():
+                clause = bucket_clause(column, self.router.buckets, bucket_ids)
+                # leftovers of an interrupted copy
+                writer.execute(delete(table).where(clause))
+                result = reader.execution_options(stream_results=True, yield_per=self.chunk_size).execute(
+                    select(table).where(clause)
+                )
+                for partition in result.partitions():
+                    writer.execute(insert(table), [row._asdict() for row in partition])
+                    copied += len(partition)
+        return copied
+
+    def finish_drains(self, bucket_map):
+        sources = {}
+        for bucket, (location, state, source) in bucket_map.items():
+            if state == DRAINING:
+                sources.setdefault((location, source), set()).add(bucket)
+        for (location, source), bucket_ids in sources.items():
+            self._delete(source, bucket_ids)
+            self._set_buckets(bucket_ids, location, ACTIVE)
+            self.echo(f"Finished draining {len(bucket_ids)} buckets from {source or 'primary'}")
+
+    def move(self, source, target, bucket_ids, stale_copies=False):
+        """
+        :param stale_copies: the buckets were left moving by an interrupted run, other locations may hold copies
+        :return: number of rows moved
+        """
+        self._set_buckets(bucket_ids, source, MOVING)
+        self._wait_for_workers()
+        if stale_copies:
+            for location in self.router.locations():
+                if location not in (source, target):
+                    self._delete(location, bucket_ids)
+
+        copied = self._copy(source, target, bucket_ids)
+        self._set_buckets(bucket_ids, target, DRAINING, source)
+        self._wait_for_workers()
+        self._delete(source, bucket_ids)
+        self._set_buckets(bucket_ids, target, ACTIVE)
+        return copied
+
+    def run(self, step, dry_run=False):
+        """
+        :param step: buckets moved at once, their users can not write meanwhile
+        :return: dict of bucket -> target of the planned moves
+        """
+        bucket_map = self.router.bucket_map(force=True)
+        moves = plan_rebalance(bucket_map, self.router.shards, self.router.buckets)
+        if dry_run:
+            return moves
+
+        self.finish_drains(bucket_map)
+        bucket_map = self.router.bucket_map(force=True)
+        interrupted = {bucket for bucket, (_, state, _) in bucket_map.items() if state == MOVING}
+
+        # interrupted moves of buckets the plan keeps in place only need the copies elsewhere removed
+        staying = interrupted - set(moves)
+        for location in self.router.locations() if staying else ():
+            copies = {bucket for bucket in staying if bucket_map[bucket][0] != location}
+            if copies:
+                self._delete(location, copies)
+        for bucket in staying:
+            self._set_buckets({bucket}, bucket_map[bucket][0], ACTIVE)
+
+        groups = {}
+        for bucket, target in sorted(moves.items()):
+            source = bucket_map.get(bucket, (None, ACTIVE, None))[0]
+            groups.setdefault((source, target), []).append(bucket)
+
+        for (source, target), bucket_ids in groups.items():
+            for start in range(0, len(bucket_ids), step):
+                chunk = set(bucket_ids[start:start + step])
+                copied = self.move(source, target, chunk, stale_copies=bool(chunk & interrupted))
+                self.echo(f"Moved {len(chunk)} buckets ({copied} rows) from {source or 'primary'} to {target}")
+
+        self.router.bucket_map(force=True)
+        self.router.reserve_ids()
+        return moves
+
+
+shard_router = ShardRouter()
@@ -0,0 +1,140 @@
+"""
+Offline build of the item-to-item neighbors in movie_similarity, with NumPy/SciPy sparse matrices.
+
+Only the `flask recommendations build` command and benchmarks.recommendations import this module,
+so serving never loads NumPy.
+"""
+import time
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import delete, func, insert, select
+
+from models.similarity import movie_norm, movie_similarity
+from models.user import user_movie
+
+READ_CHUNK_SIZE = 100_000
+WRITE_CHUNK_SIZE = 10_000
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def load_interactions(conn, chunk_size=READ_CHUNK_SIZE, criterion=None):
+    """
+    Reads user_movie in chunks into arrays.
+
+    :param criterion: optional filter of the rows read, e.g. utils.shards ownership_clause
+
+    :return: (user ids, movie ids, weights) as numpy arrays, weights as in utils.recommendations.interaction_weight
+    """
+    users, movies, ratings = [], [], []
+    statement = select(user_movie.c.user_id, user_movie.c.movie_id, func.coalesce(user_movie.c.user_rating, 0))
+    if criterion is not None:
+        statement = statement.where(criterion)
+    result = conn.execution_options(yield_per=chunk_size).execute(statement)
+    for partition in result.partitions():
+        # np.array on Row objects goes through the sequence protocol per row, fromiter is ~10x faster
+        chunk = np.fromiter((value for row in partition for value in row), np.int64, 3 * len(partition)).reshape(-1, 3)
+        users.append(chunk[:, 0])
+        movies.append(chunk[:, 1])
+        ratings.append(chunk[:, 2])
+
+    if not users:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64)
+    ratings = np.concatenate(ratings)
+    return np.concatenate(users), np.concatenate(movies), np.where(ratings == 0, 1.0, ratings / 5)
+
+
+def top_neighbors(users, movies, weights, k, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Cosine top-k neighbors of every movie from the sparse user x movie weight matrix.
+
+    The movie x movie product is computed one block of block_size columns at a time and cut to the top k
+    of each column right away, so memory stays at one block of co-occurrences however large the catalog is.
+
+    :return: (movie ids, squared norms, list of (movie_id, similar_movie_id, dot) arrays per block)
+    """
+    movie_ids, movie_index = np.unique(movies, return_inverse=True)
+    _, user_index = np.unique(users, return_inverse=True)
+
+    matrix = sparse.csr_matrix((weights, (user_index, movie_index)), shape=(user_index.max(initial=-1) + 1,
+                                                                            len(movie_ids)))
+    by_movie = matrix.T.tocsr()
+    by_column = matrix.tocsc()
+    norms_sq = np.asarray(by_movie.multiply(by_movie).sum(axis=1)).ravel()
+
+    blocks = []
+    for start in range(0, len(movie_ids), block_size):
+        stop = min(start + block_size, len(movie_ids))
+        dots = (by_movie @ by_column[:, start:stop]).tocsc()
+
+        seeds, similar, values = [], [], []
+        for column in range(stop - start):
+            seed = start + column
+            rows = dots.indices[dots.indptr[column]:dots.indptr[column + 1]]
+            column_dots = dots.data[dots.indptr[column]:dots.indptr[column + 1]]
+            keep = rows != seed
+            rows, column_dots = rows[keep], column_dots[keep]
+            if len(rows) > k:
+                scores = column_dots / np.sqrt(norms_sq[rows] * norms_sq[seed])
+                best = np.argpartition(-scores, k - 1)[:k]
+                rows, column_dots = rows[best], column_dots[best]
+            seeds.append(np.full(len(rows), seed))
+            similar.append(rows)
+            values.append(column_dots)
+
+        if seeds:
+            blocks.append((movie_ids[np.concatenate(seeds)], movie_ids[np.concatenate(similar)],
+                           np.concatenate(values)))
+
+    return movie_ids, norms_sq, blocks
+
+
+def insert_chunks(conn, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= WRITE_CHUNK_SIZE:
+            conn.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert(table), chunk)
+
+
+def rebuild_similarities(engine, k, block_size=DEFAULT_BLOCK_SIZE, sources=None):
+    """
+    Replaces movie_similarity and movie_norm with the exact top-k neighbors of the current user_movie,
+    in one transaction so readers switch from the old neighbors to the new ones at commit.
+
+    :param sources: list of (engine, criterion) user_movie is read from, e.g. the shards, engine by default
+    :return: dict with build stats
+    """
+    started = time.perf_counter()
+    parts = []
+    for source, criterion in sources or [(engine, None)]:
+        with source.connect() as conn:
+            parts.append(load_interactions(conn, criterion=criterion))
+    users, movies, weights = (np.concatenate(arrays) for arrays in zip(*parts))
+    loaded = time.perf_counter()
+
+    movie_ids, norms_sq, blocks = top_neighbors(users, movies, weights, k, block_size)
+    computed = time.perf_counter()
+
+    with engine.begin() as conn:
+        conn.execute(delete(movie_similarity))
+        conn.execute(delete(movie_norm))
+        insert_chunks(conn, movie_norm, (
+            {"movie_id": int(movie_id), "norm_sq": float(norm_sq)} for movie_id, norm_sq in zip(movie_ids, norms_sq)
+        ))
+        insert_chunks(conn, movie_similarity, (
+            {"movie_id": int(seed), "similar_movie_id": int(similar), "dot": float(dot)}
+            for seeds, similar_ids, dots in blocks for seed, similar, dot in zip(seeds, similar_ids, dots)
+        ))
+
+    return {
+        "interactions": len(users),
+        "movies": len(movie_ids),
+        "pairs": sum(len(seeds) for seeds, _, _ in blocks),
+        "load_seconds": round(loaded - started, 3),
+        "compute_seconds": round(computed - loaded, 3),
+        "write_seconds": round(time.perf_counter() - computed, 3)
+    }
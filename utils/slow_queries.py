@@ -0,0 +1,259 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.metrics import read_snapshots, statement_shape
+
+# off unless SLOW_QUERY_MS is set, the EXPLAIN of a slow statement costs its request another round trip
+DEFAULT_THRESHOLD_MS = 0
+DEFAULT_LOG_SIZE = 100
+# only these are explained, EXPLAIN of DDL, PRAGMA or SAVEPOINT fails or means nothing
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+# the ASGI scope of the current request, its "endpoint" is filled in by the router once the route matched
+_asgi_scope = contextvars.ContextVar("slow_query_asgi_scope", default=None)
+
+
+def current_endpoint():
+    """
+    :return: endpoint of the running request, e.g. movies.get_single_movie on both apps, the thread name outside
+             of requests, e.g. write-behind or MainThread for CLI commands
+    """
+    if has_request_context():
+        return request.endpoint or "unmatched"
+
+    scope = _asgi_scope.get()
+    if scope is not None:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        return f"{endpoint.__module__.rsplit('.', 1)[-1]}.{endpoint.__name__}"
+    return threading.current_thread().name
+
+
+def parameter_shape(parameters):
+    """
+    Types of the bound parameters in order, runs of one type collapsed, e.g. (int, str, int x20),
+    so a slow query can be told apart by its inputs without logging their values.
+    """
+    values = parameters.values() if isinstance(parameters, dict) else parameters or ()
+    runs = []
+    for value in values:
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return "(" + ", ".join(name if count == 1 else f"{name} x{count}" for name, count in runs) + ")"
+
+
+def fingerprint(shape):
+    return hashlib.sha1(shape.encode()).hexdigest()[:12]
+
+
+def explain_sql(conn, statement, parameters):
+    """
+    Plan of an executed statement with its own bound parameters, on the connection that ran it.
+
+    :return: list of plan lines
+    """
+    if conn.dialect.name == "sqlite":
+        return [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+    # plain EXPLAIN only plans, the statement is not run a second time
+    # a failed statement aborts the whole transaction on Postgres, the savepoint keeps the request's own one usable
+    savepoint = conn.begin_nested() if conn.in_transaction() else None
+    try:
+        plan = [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)]
+    except Exception:
+        if savepoint is not None:
+            savepoint.rollback()
+        raise
+    if savepoint is not None:
+        savepoint.commit()
+    return plan
+
+
+class SlowQueryScope:
+    """
+    ASGI middleware that makes the scope of the current request visible to the slow query log,
+    so statements of the async app are attributed to their endpoint too.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        token = _asgi_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _asgi_scope.reset(token)
+
+
+class SlowQueryLog:
+    """
+    Logs every statement slower than SLOW_QUERY_MS (off by default) with its endpoint, parameter types, duration and query plan,
+    and aggregates them per statement fingerprint (the statement_shape of utils.metrics) for /queries/slow.
+
+    The plan is captured with EXPLAIN (EXPLAIN QUERY PLAN on SQLite) the first time a fingerprint is slow,
+    on the same connection, in a savepoint of its transaction, and with the same parameters. Only the SLOW_QUERY_LOG_SIZE most recently slow
+    fingerprints are kept. With METRICS_DIR set every process snapshots its log there, like utils.metrics,
+    so the endpoint and `flask schema slow-queries` cover every worker.
+    """
+
+    def __init__(self):
+        self.threshold = DEFAULT_THRESHOLD_MS / 1000
+        self.size = DEFAULT_LOG_SIZE
+        self.metrics_dir = None
+        self.logger = logging.getLogger(__name__)
+        # fingerprint -> entry dict, least recently slow first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_snapshot = 0.0
+        self._listening = False
+
+    def init_app(self, app):
+        self.threshold = float(app.config.get("SLOW_QUERY_MS", DEFAULT_THRESHOLD_MS)) / 1000
+        self.size = int(app.config.get("SLOW_QUERY_LOG_SIZE", DEFAULT_LOG_SIZE))
+        self.metrics_dir = app.config.get("METRICS_DIR")
+        self.logger = app.logger
+        if self.metrics_dir:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+
+        if self.threshold > 0 and not self._listening:
+            # class level listeners cover every engine, the async ones included
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            self._listening = True
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # the execution context lives exactly as long as the statement, no bookkeeping is left behind on errors
+        if context is not None:
+            context.slow_query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "slow_query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        # the EXPLAIN of a slow statement is not recorded itself
+        if elapsed >= self.threshold and not conn.info.get("slow_query_explaining"):
+            self.record(conn, statement, parameters, executemany, elapsed)
+
+    def _plan(self, conn, statement, parameters, executemany):
+        if executemany:
+            return None, "not explained, executemany"
+        if not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return None, "not explained, not a query"
+
+        conn.info["slow_query_explaining"] = True
+        try:
+            return explain_sql(conn, statement, parameters), None
+        except Exception as err:
+            return None, f"EXPLAIN failed: {err}"
+        finally:
+            conn.info["slow_query_explaining"] = False
+
+    def record(self, conn, statement, parameters, executemany, elapsed):
+        shape = statement_shape(statement)
+        key = fingerprint(shape)
+        endpoint = current_endpoint()
+        params = parameter_shape(parameters[0] if executemany and parameters else parameters)
+        milliseconds = elapsed * 1000
+
+        with self._lock:
+            entry = self._entries.get(key)
+        plan, plan_error = (entry["plan"], entry["plan_error"]) if entry is not None else \
+            self._plan(conn, statement, parameters, executemany)
+
+        with self._lock:
+            known = key in self._entries
+            entry = self._entries.pop(key, None) or {
+                "fingerprint": key,
+                "statement": shape,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "endpoints": {},
+                "plan": plan,
+                "plan_error": plan_error
+            }
+            entry["count"] += 1
+            entry["total_ms"] += milliseconds
+            entry["max_ms"] = max(entry["max_ms"], milliseconds)
+            entry["last_ms"] = milliseconds
+            entry["last_seen"] = time.time()
+            entry["params"] = params
+            entry["endpoints"][endpoint] = entry["endpoints"].get(endpoint, 0) + 1
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+        self.logger.warning(
+            f"Slow query {milliseconds:.1f} ms in {endpoint} [{key}] params {params}: {' '.join(statement.split())}"
+            + "".join(f"\n    {line}" for line in (plan if plan is not None else [plan_error]))
+        )
+        # a new fingerprint is written out right away, repeats at most once per second
+        self._snapshot(force=not known)
+
+    def _state(self):
+        with self._lock:
+            return [dict(entry, endpoints=dict(entry["endpoints"])) for entry in self._entries.values()]
+
+    def _snapshot(self, force=False):
+        if not self.metrics_dir or (not force and time.monotonic() - self._last_snapshot < 1.0):
+            return
+        self._last_snapshot = time.monotonic()
+
+        path = os.path.join(self.metrics_dir, f"slow_queries_{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as snapshot:
+            json.dump(self._state(), snapshot)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self):
+        """
+        :return: list of entry dicts of this process and, with METRICS_DIR, of all other live processes,
+                 merged per fingerprint and most total time first
+        """
+        states = [self._state()]
+        if self.metrics_dir:
+            states.extend(read_snapshots(self.metrics_dir, "slow_queries"))
+
+        merged = {}
+        for state in states:
+            for entry in state:
+                current = merged.get(entry["fingerprint"])
+                if current is None:
+                    merged[entry["fingerprint"]] = dict(entry, endpoints=dict(entry["endpoints"]))
+                    continue
+                current["count"] += entry["count"]
+                current["total_ms"] += entry["total_ms"]
+                current["max_ms"] = max(current["max_ms"], entry["max_ms"])
+                for endpoint, count in entry["endpoints"].items():
+                    current["endpoints"][endpoint] = current["endpoints"].get(endpoint, 0) + count
+                if entry["last_seen"] > current["last_seen"]:
+                    current.update(last_seen=entry["last_seen"], last_ms=entry["last_ms"], params=entry["params"])
+                if current["plan"] is None and entry["plan"] is not None:
+                    current.update(plan=entry["plan"], plan_error=None)
+
+        entries = sorted(merged.values(), key=lambda entry: entry["total_ms"], reverse=True)
+        for entry in entries:
+            entry["total_ms"] = round(entry["total_ms"], 3)
+            entry["max_ms"] = round(entry["max_ms"], 3)
+            entry["last_ms"] = round(entry["last_ms"], 3)
+        return entries
+
+    def report(self):
+        return {"threshold_ms": self.threshold * 1000, "queries": self.collect()}
+
+
+slow_query_log = SlowQueryLog()
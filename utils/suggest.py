@@ -0,0 +1,304 @@
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from sqlalchemy import select
+
+from models.movie import Movie
+from utils.adapters import remove_special_characters
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 20
+DEFAULT_REFRESH_SECONDS = 5
+DEFAULT_REBUILD_SECONDS = 600
+# prefixes matching more titles than this have their top MAX_LIMIT precomputed, shorter ranges are scanned
+SCAN_LIMIT = 256
+# new movies kept beside the snapshot before a rebuild folds them in
+DELTA_LIMIT = 1024
+# keys only hold [a-z0-9 ] after normalization, so every key starting with a prefix sorts below prefix + this
+KEY_UPPER_BOUND = "\uffff"
+NO_RATING = -1.0
+# the ASCII characters remove_special_characters drops, i.e. all but letters, digits and whitespace
+ASCII_SPECIAL_CHARACTERS = {code: None for code in range(128) if not chr(code).isalnum() and not chr(code).isspace()}
+
+
+def normalize_title(title):
+    """
+    Search key of a title: the normalization of utils.adapters.remove_special_characters, lower cased.
+    """
+    title = title or ""
+    if title.isascii():
+        # same result without the two regex passes, which dominate building the index
+        return " ".join(title.translate(ASCII_SPECIAL_CHARACTERS).split()).lower()
+    return remove_special_characters(title).strip().lower()
+
+
+def normalize_prefix(query):
+    # a trailing space is kept, "star " completes "star wars" but not "starship"
+    return remove_special_characters(query or "").lstrip().lower()
+
+
+def _score(value):
+    # ratings are stored with -1.0 for NULL, below every real rating
+    return NO_RATING if value is None else value
+
+
+def _rating(value):
+    return None if value == NO_RATING else value
+
+
+def rank_key(movie_id, rating, local_rating):
+    """
+    Sort key of a suggestion: best TMDb rating first, then best local rating, then oldest movie.
+    """
+    return -_score(rating), -_score(local_rating), movie_id
+
+
+class TitleSnapshot:
+    """
+    Immutable prefix index of movie titles: normalized titles in a sorted list, searched with bisect.
+
+    Matches of a prefix are a contiguous range of the list. Ranges of up to SCAN_LIMIT titles are ranked by
+    scanning them, larger ranges read the top MAX_LIMIT precomputed for their prefix, so a lookup costs
+    O(log n + SCAN_LIMIT) whatever the prefix.
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: iterable of (id, title, rating, local_rating)
+        """
+        ids, titles, ratings, local_ratings = [list(column) for column in zip(*rows)] or [[], [], [], []]
+        keys = [normalize_title(title) for title in titles]
+        by_key = sorted(range(len(keys)), key=keys.__getitem__)
+
+        self.keys = list(map(keys.__getitem__, by_key))
+        self.ids = array("q", map(ids.__getitem__, by_key))
+        self.titles = list(map(titles.__getitem__, by_key))
+        self.ratings = array("d", (_score(ratings[index]) for index in by_key))
+        self.local_ratings = array("d", (_score(local_ratings[index]) for index in by_key))
+        self.high_water = max(self.ids, default=0)
+        del ids, titles, ratings, local_ratings, keys, by_key
+
+        # rank_key order by stable sorts on the columns, least significant first
+        order = sorted(range(len(self.keys)), key=self.ids.__getitem__)
+        order.sort(key=self.local_ratings.__getitem__, reverse=True)
+        order.sort(key=self.ratings.__getitem__, reverse=True)
+        self.rank = array("l", bytes(array("l").itemsize * len(order)))
+        for rank, position in enumerate(order):
+            self.rank[position] = rank
+        self.tops = self._top_positions(order)
+
+    def _top_positions(self, order):
+        # a range of more than SCAN_LIMIT keys holds two keys SCAN_LIMIT // 2 apart, one of them at a multiple of
+        # that step, so the common prefixes of those pairs cover every prefix that needs its top precomputed
+        step = SCAN_LIMIT // 2
+        heavy = set()
+        for position in range(0, len(self.keys) - step, step):
+            common = os.path.commonprefix((self.keys[position], self.keys[position + step]))
+            # the set is closed under prefixes, when the longest is in so are the shorter ones
+            if common and common not in heavy:
+                heavy.update(common[:length] for length in range(1, len(common) + 1))
+
+        tops = {prefix: [] for prefix in heavy}
+        unfilled = len(tops)
+        for position in order:
+            if not unfilled:
+                break
+            key = self.keys[position]
+            for length in range(1, len(key) + 1):
+                bucket = tops.get(key[:length])
+                if bucket is None:
+                    break
+                if len(bucket) < MAX_LIMIT:
+                    bucket.append(position)
+                    unfilled -= len(bucket) == MAX_LIMIT
+        return {prefix: tuple(bucket) for prefix, bucket in tops.items()}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def entry(self, position):
+        return self.ids[position], self.titles[position], _rating(self.ratings[position]), \
+            _rating(self.local_ratings[position])
+
+    def matches(self, prefix, limit):
+        """
+        :return: up to limit (id, title, rating, local_rating) of titles starting with prefix, best ranked first
+        """
+        low = bisect_left(self.keys, prefix)
+        high = bisect_left(self.keys, prefix + KEY_UPPER_BOUND, low)
+        if high - low > SCAN_LIMIT and prefix in self.tops:
+            positions = self.tops[prefix][:limit]
+        else:
+            positions = heapq.nsmallest(limit, range(low, high), key=self.rank.__getitem__)
+        return [self.entry(position) for position in positions]
+
+    def memory_bytes(self):
+        """
+        :return: approximate bytes held by the snapshot, strings and containers included
+        """
+        total = sum(sys.getsizeof(column) for column in (
+            self.keys, self.ids, self.titles, self.ratings, self.local_ratings, self.rank, self.tops
+        ))
+        total += sum(sys.getsizeof(key) for key in self.keys)
+        total += sum(sys.getsizeof(title) for title in self.titles)
+        total += sum(sys.getsizeof(prefix) + sys.getsizeof(top) for prefix, top in self.tops.items())
+        return total
+
+
+def suggestion_rows_statement(after=None, limit=None):
+    """
+    :return: select of (id, title, rating, local_rating) by id, of the movies after id `after`
+    """
+    statement = select(Movie.id, Movie.title, Movie.rating, Movie.local_rating).order_by(Movie.id)
+    if after is not None:
+        statement = statement.where(Movie.id > after)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+class TitleSuggestions:
+    """
+    In-process title autocomplete of /movies/suggest, one TitleSnapshot per worker built on the first lookup.
+
+    Every SUGGEST_REFRESH_SECONDS a lookup polls the movies inserted since (one range read of the primary key,
+    e.g. by the seeder or `flask data import`) into a small sorted delta. A background thread rebuilds the
+    snapshot when the delta exceeds DELTA_LIMIT or every SUGGEST_REBUILD_SECONDS, which also picks up changed
+    ratings and titles and deleted movies.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.refresh_seconds = DEFAULT_REFRESH_SECONDS
+        self.rebuild_seconds = DEFAULT_REBUILD_SECONDS
+        self.logger = logging.getLogger(__name__)
+        self._snapshot = None
+        # sorted (key, id, title, rating, local_rating) of movies inserted after the snapshot was read
+        self._delta = []
+        self._built_at = 0.0
+        self._build_seconds = 0.0
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+        self._first_build = threading.Lock()
+        self._rebuilding = False
+
+    def init_app(self, app, engine):
+        """
+        :param engine: sync engine the index is read with
+        """
+        self.engine = engine
+        self.refresh_seconds = float(app.config.get("SUGGEST_REFRESH_SECONDS", DEFAULT_REFRESH_SECONDS))
+        self.rebuild_seconds = float(app.config.get("SUGGEST_REBUILD_SECONDS", DEFAULT_REBUILD_SECONDS))
+        self.logger = app.logger
+
+    def _read_snapshot(self):
+        started = time.perf_counter()
+        with self.engine.connect() as conn:
+            snapshot = TitleSnapshot(conn.execute(suggestion_rows_statement()))
+        return snapshot, time.perf_counter() - started
+
+    def _install(self, snapshot, build_seconds):
+        with self._lock:
+            self._snapshot = snapshot
+            self._delta = [entry for entry in self._delta if entry[1] > snapshot.high_water]
+            self._built_at = time.monotonic()
+            self._build_seconds = build_seconds
+            self._next_poll = self._built_at + self.refresh_seconds
+
+    def _rebuild(self):
+        try:
+            self._install(*self._read_snapshot())
+        except Exception:
+            self.logger.exception("Rebuilding the title suggestions failed")
+        finally:
+            self._rebuilding = False
+
+    def _start_rebuild(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, name="title-suggestions", daemon=True).start()
+
+    def refresh_due(self):
+        return self._snapshot is None or time.monotonic() >= self._next_poll
+
+    def refresh(self):
+        """
+        Builds the snapshot on first use, then polls newly inserted movies at most every SUGGEST_REFRESH_SECONDS.
+        """
+        if self._snapshot is None:
+            # the first lookups of a worker wait for one build instead of each building their own
+            with self._first_build:
+                if self._snapshot is None:
+                    self._install(*self._read_snapshot())
+            return
+
+        if time.monotonic() < self._next_poll:
+            return
+        with self._lock:
+            self._next_poll = time.monotonic() + self.refresh_seconds
+            high_water = max([self._snapshot.high_water, *(entry[1] for entry in self._delta)])
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(suggestion_rows_statement(high_water, DELTA_LIMIT)).all()
+
+        with self._lock:
+            delta = list(self._delta)
+            for movie_id, title, rating, local_rating in rows:
+                # a rebuild that finished meanwhile may already hold the row
+                if movie_id > self._snapshot.high_water:
+                    insort(delta, (normalize_title(title), movie_id, title, rating, local_rating))
+            self._delta = delta
+
+        if len(self._delta) >= DELTA_LIMIT or time.monotonic() - self._built_at >= self.rebuild_seconds:
+            self._start_rebuild()
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """
+        :return: list of up to limit movie dicts whose normalized title starts with the normalized query
+        """
+        prefix = normalize_prefix(query)
+        snapshot, delta = self._snapshot, self._delta
+        if not prefix or snapshot is None:
+            return []
+
+        matches = snapshot.matches(prefix, limit)
+        if delta:
+            low = bisect_left(delta, (prefix,))
+            high = bisect_left(delta, (prefix + KEY_UPPER_BOUND,), low)
+            matches = sorted(matches + [entry[1:] for entry in delta[low:high]], key=lambda match: rank_key(
+                match[0], match[2], match[3]
+            ))[:limit]
+
+        return [
+            {"id": movie_id, "title": title, "rating": rating, "local_rating": local_rating}
+            for movie_id, title, rating, local_rating in matches
+        ]
+
+    def limit(self, value):
+        """
+        :return: the requested number of suggestions between 1 and MAX_LIMIT, DEFAULT_LIMIT when missing or malformed
+        """
+        try:
+            return max(1, min(int(value), MAX_LIMIT))
+        except (TypeError, ValueError):
+            return DEFAULT_LIMIT
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "titles": len(snapshot) if snapshot is not None else 0,
+            "delta": len(self._delta),
+            "precomputed_prefixes": len(snapshot.tops) if snapshot is not None else 0,
+            "build_seconds": round(self._build_seconds, 3)
+        }
+
+
+title_suggestions = TitleSuggestions()
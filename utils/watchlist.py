@@ -0,0 +1,166 @@
+from sqlalchemy import case, select
+
+from models.movie import Movie
+from models.user import user_movie
+from utils.dialects import dialect_insert
+from utils.leaderboards import TRENDING_WEIGHTS
+from utils.recommendations import interaction_weight, movies_statement
+from utils.serializers import MOVIE_COLUMNS
+from utils.shards import shard_router
+
+MAX_BATCH_SIZE = 500
+
+
+def parse_batch_items(items):
+    """
+    Validates the items of a batch watchlist update, later items win for repeated movie ids.
+
+    :return: (dict of movie_id -> watched, dict of item index -> error)
+    """
+    changes = {}
+    invalid = {}
+    for index, item in enumerate(items):
+        movie_id = item.get("movie_id") if isinstance(item, dict) else None
+        watched = item.get("watched") if isinstance(item, dict) else None
+
+        if not isinstance(movie_id, int) or isinstance(movie_id, bool) or not isinstance(watched, bool):
+            invalid[index] = "movie_id must be an integer and watched a boolean"
+        else:
+            changes[movie_id] = watched
+    return changes, invalid
+
+
+def batch_results(items, invalid, results):
+    """
+    :return: per item result list of a batch watchlist update, in request order
+    """
+    response = []
+    for index, item in enumerate(items):
+        if index in invalid:
+            response.append({"index": index, "result": "invalid", "error": invalid[index]})
+        else:
+            response.append({"index": index, "movie_id": item["movie_id"], "result": results[item["movie_id"]]})
+    return response
+
+
+def watchlist_statement(user_id, watched=None):
+    """
+    :return: select of the MOVIE_COLUMNS of the user's watchlist, of the watched or unwatched ones only when given
+    """
+    statement = select(*MOVIE_COLUMNS).join(user_movie).where(user_movie.c.user_id == user_id)
+    if watched is not None:
+        statement = statement.where(user_movie.c.watched == watched)
+    return statement
+
+
+def watchlist_ids_statement(user_id, watched=None):
+    statement = select(user_movie.c.movie_id).where(user_movie.c.user_id == user_id)
+    if watched is not None:
+        statement = statement.where(user_movie.c.watched == watched)
+    return statement
+
+
+def watchlist_rows(session, user_id, watched=None):
+    """
+    :return: watchlist_statement rows, in two reads when the watchlist is on a shard and the movies on the primary
+    """
+    if not shard_router.enabled:
+        return session.execute(watchlist_statement(user_id, watched)).all()
+    movie_ids = session.execute(watchlist_ids_statement(user_id, watched)).scalars().all()
+    return session.execute(movies_statement(movie_ids)).all() if movie_ids else []
+
+
+async def watchlist_rows_async(session, user_id, watched=None):
+    """
+    watchlist_rows on an AsyncSession.
+    """
+    if not shard_router.enabled:
+        return (await session.execute(watchlist_statement(user_id, watched))).all()
+    movie_ids = (await session.execute(watchlist_ids_statement(user_id, watched))).scalars().all()
+    return (await session.execute(movies_statement(movie_ids))).all() if movie_ids else []
+
+
+def existing_movies_statement(movie_ids):
+    return select(Movie.id).where(Movie.id.in_(movie_ids))
+
+
+def relationships_statement(user_id, movie_ids):
+    return select(user_movie.c.movie_id, user_movie.c.user_rating, user_movie.c.watched).where(
+        (user_movie.c.user_id == user_id) &
+        (user_movie.c.movie_id.in_(movie_ids))
+    )
+
+
+def plan_watchlist_changes(user_id, changes, existing_movies, relationships):
+    """
+    Decides what a set of watchlist changes does, without touching the database.
+
+    :param changes: dict of movie_id -> watched
+    :param existing_movies: set of the movie ids that exist
+    :param relationships: dict of movie_id -> user_rating of the user's current watchlist rows
+    :return: (dict of movie_id -> "added" | "updated" | "not_found", rows to upsert,
+              dict of movie_id -> rating that an unwatch drops)
+    """
+    results = {}
+    rows = []
+    ratings_removed = {}
+
+    for movie_id, watched in changes.items():
+        if movie_id not in existing_movies:
+            results[movie_id] = "not_found"
+            continue
+
+        if movie_id in relationships:
+            # an unwatched movie can't keep its rating
+            old_rating = relationships[movie_id]
+            if not watched and old_rating is not None:
+                ratings_removed[movie_id] = old_rating
+            results[movie_id] = "updated"
+        else:
+            results[movie_id] = "added"
+
+        rows.append({"user_id": user_id, "movie_id": movie_id, "watched": watched})
+
+    return results, rows, ratings_removed
+
+
+def similarity_changes(results, ratings_removed):
+    """
+    :return: dict of movie_id -> interaction weight before the change, for SimilarityIndex.record
+    """
+    changes = {movie_id: 0.0 for movie_id, result in results.items() if result == "added"}
+    changes.update((movie_id, interaction_weight(rating)) for movie_id, rating in ratings_removed.items())
+    return changes
+
+
+def trending_events(changes, results, watched_before):
+    """
+    :param watched_before: set of the movie ids the user had already marked as watched
+    :return: dict of movie_id -> trending weight of the changes, for Leaderboards.record_activity
+    """
+    events = {}
+    for movie_id, result in results.items():
+        if result == "not_found":
+            continue
+        weight = TRENDING_WEIGHTS["added"] if result == "added" else 0.0
+        if changes[movie_id] and movie_id not in watched_before:
+            weight += TRENDING_WEIGHTS["watched"]
+        if weight:
+            events[movie_id] = weight
+    return events
+
+
+def watchlist_upsert_statement(session):
+    """
+    Multi-row INSERT ... ON CONFLICT (user_id, movie_id) DO UPDATE of the watched flag, executed with the planned rows
+    and the change version of the write.
+    """
+    statement = dialect_insert(session, user_movie)
+    return statement.on_conflict_do_update(
+        index_elements=[user_movie.c.user_id, user_movie.c.movie_id],
+        set_={
+            "watched": statement.excluded.watched,
+            "version": statement.excluded.version,
+            "user_rating": case((statement.excluded.watched, user_movie.c.user_rating), else_=None)
+        }
+    )
@@ -0,0 +1,371 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from sqlalchemy import bindparam, select, tuple_, update
+
+from models.user import user_movie
+from utils.adapters import str_to_bool
+from utils.cache import response_cache
+from utils.changes import next_version_statement
+from utils.leaderboards import TRENDING_WEIGHTS, leaderboards
+from utils.metrics import request_metrics
+from utils.ratings import aggregate_change_statement, as_rating
+from utils.recommendations import interaction_weight, similarity_index
+from utils.shards import ShardMoving, ShardedSession, shard_router
+
+ACK_COMMIT = "commit"
+ACK_ENQUEUE = "enqueue"
+DEFAULT_INTERVAL_MS = 50
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_TIMEOUT = 5.0
+
+
+class WriteBehindBusy(Exception):
+    pass
+
+
+class PendingWrite:
+    """
+    Coalesced rating / watched mutations of one (user_id, movie_id), the latest value of each field wins.
+    """
+    __slots__ = ("user_id", "movie_id", "rating", "watched", "queued_at", "futures")
+
+    def __init__(self, user_id, movie_id):
+        self.user_id = user_id
+        self.movie_id = movie_id
+        self.rating = None
+        self.watched = None
+        self.queued_at = time.monotonic()
+        self.futures = []
+
+
+class WriteOutcome:
+    """
+    What a flush did to one pending write: result is "applied", "not_watched" (a rating of a movie that is
+    not watched by then) or "not_found" (the watchlist row is gone).
+    """
+    __slots__ = ("result", "local_rating")
+
+    def __init__(self, result, local_rating=None):
+        self.result = result
+        self.local_rating = local_rating
+
+
+def pending_rows_statement(keys):
+    """
+    SELECT ... FOR UPDATE of the watchlist rows of a batch, the aggregate deltas are computed from them
+    """
+    return select(user_movie.c.user_id, user_movie.c.movie_id, user_movie.c.watched, user_movie.c.user_rating).where(
+        tuple_(user_movie.c.user_id, user_movie.c.movie_id).in_(keys)
+    ).order_by(user_movie.c.user_id, user_movie.c.movie_id).with_for_update()
+
+
+def batch_update_statement():
+    return update(user_movie).where(
+        (user_movie.c.user_id == bindparam("b_user_id")) & (user_movie.c.movie_id == bindparam("b_movie_id"))
+    ).values(watched=bindparam("b_watched"), user_rating=bindparam("b_user_rating"), version=bindparam("b_version"))
+
+
+def plan_pending_writes(writes, current):
+    """
+    Decides what a batch of coalesced writes does against the current watchlist rows, without touching the database.
+
+    :param current: dict of (user_id, movie_id) -> (watched, user_rating) of the rows that exist
+    :return: (dict of (user_id, movie_id) -> result, rows for batch_update_statement,
+              dict of movie_id -> [rating sum delta, rating count delta] of the movies with rating writes,
+              dict of movie_id -> trending weight, dict of user_id -> {movie_id: weight before} for similarity)
+    """
+    results = {}
+    rows = []
+    deltas = {}
+    events = {}
+    similarity = {}
+
+    for write in writes:
+        key = (write.user_id, write.movie_id)
+        if key not in current:
+            results[key] = "not_found"
+            continue
+
+        old_watched, old_rating = current[key]
+        watched = bool(old_watched) or bool(write.watched)
+        rating = old_rating
+        results[key] = "applied"
+
+        if write.rating is not None:
+            if not watched:
+                results[key] = "not_watched"
+            else:
+                rating = write.rating
+                delta = deltas.setdefault(write.movie_id, [0, 0])
+                delta[0] += rating - (old_rating or 0)
+                delta[1] += old_rating is None
+                events[write.movie_id] = events.get(write.movie_id, 0.0) + TRENDING_WEIGHTS["rated"]
+
+        if watched and not old_watched:
+            events[write.movie_id] = events.get(write.movie_id, 0.0) + TRENDING_WEIGHTS["watched"]
+
+        if watched != bool(old_watched) or rating != old_rating:
+            rows.append({"b_user_id": write.user_id, "b_movie_id": write.movie_id, "b_watched": watched,
+                         "b_user_rating": rating})
+            if rating != old_rating:
+                similarity.setdefault(write.user_id, {})[write.movie_id] = interaction_weight(old_rating)
+
+    return results, rows, deltas, events, similarity
+
+
+def apply_pending_writes(session, writes):
+    """
+    Applies a batch of coalesced writes in the session's transaction: one change version per user, one executemany
+    of the watchlist rows, then one aggregate update per touched movie. Does not commit.
+
+    :return: (dict of (user_id, movie_id) -> WriteOutcome, list of movie ids whose rating changed)
+    """
+    # one change version per user of the batch, taken in user order before the rows are read: the synchronous
+    # watchlist writes take it first too, so none of them commits between the read and the update below
+    # (SQLite has no FOR UPDATE, the upsert starts the write transaction there)
+    versions = {user_id: session.execute(next_version_statement(session, user_id)).scalar()
+                for user_id in sorted({write.user_id for write in writes})}
+
+    keys = [(write.user_id, write.movie_id) for write in writes]
+    current = {(row.user_id, row.movie_id): (row.watched, row.user_rating)
+               for row in session.execute(pending_rows_statement(keys))}
+
+    results, rows, deltas, events, similarity = plan_pending_writes(writes, current)
+
+    if rows:
+        updated = session.execute(
+            batch_update_statement(), [{**row, "b_version": versions[row["b_user_id"]]} for row in rows]
+        )
+        # the deltas assume every planned row was updated, a row gone anyway rolls the whole batch back
+        if session.get_bind().dialect.supports_sane_multi_rowcount and updated.rowcount != len(rows):
+            raise RuntimeError(f"{len(rows) - updated.rowcount} watchlist rows changed during the flush")
+
+    local_ratings = {}
+    for movie_id, (sum_delta, count_delta) in deltas.items():
+        local_ratings[movie_id] = as_rating(session.execute(
+            aggregate_change_statement(movie_id, sum_delta, count_delta)
+        ).scalar())
+
+    leaderboards.refresh_top_rated(session, list(deltas))
+    leaderboards.record_activity(session, events)
+    for user_id, changed in similarity.items():
+        similarity_index.record(session, user_id, changed)
+
+    outcomes = {key: WriteOutcome(result, local_ratings.get(key[1])) for key, result in results.items()}
+    return outcomes, list(deltas)
+
+
+class WriteBehind:
+    """
+    Opt-in write-behind of rate_movie and change_movie_status: validated mutations are queued in process,
+    coalesced per (user_id, movie_id) and applied by a flusher thread in batched transactions, so a burst
+    of votes costs one commit per batch instead of one per request.
+
+    Configured from WRITE_BEHIND, WRITE_BEHIND_ACK ("commit" answers once the batch is committed, "enqueue"
+    answers 202 right away and loses the queue on a crash), WRITE_BEHIND_INTERVAL_MS and WRITE_BEHIND_BATCH_SIZE
+    (a batch is flushed when either is reached), WRITE_BEHIND_QUEUE_SIZE (pending (user, movie) pairs before
+    new ones are refused) and WRITE_BEHIND_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.ack = ACK_COMMIT
+        self.interval = DEFAULT_INTERVAL_MS / 1000
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.queue_size = DEFAULT_QUEUE_SIZE
+        self.timeout = DEFAULT_TIMEOUT
+        self.engine = None
+        self.logger = logging.getLogger(__name__)
+        self._pending = {}
+        # the batch being flushed, until it is committed
+        self._in_flight = {}
+        self._condition = threading.Condition()
+        self._flusher = None
+        self._flusher_pid = None
+        self._stopping = False
+
+    def init_app(self, app, engine):
+        """
+        :param engine: sync engine the flusher thread writes with
+        """
+        self.enabled = bool(str_to_bool(str(app.config.get("WRITE_BEHIND", "false"))))
+        self.ack = app.config.get("WRITE_BEHIND_ACK", ACK_COMMIT)
+        if self.ack not in (ACK_COMMIT, ACK_ENQUEUE):
+            raise ValueError(f"Unknown WRITE_BEHIND_ACK '{self.ack}'")
+        self.interval = float(app.config.get("WRITE_BEHIND_INTERVAL_MS", DEFAULT_INTERVAL_MS)) / 1000
+        self.batch_size = int(app.config.get("WRITE_BEHIND_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        self.queue_size = int(app.config.get("WRITE_BEHIND_QUEUE_SIZE", DEFAULT_QUEUE_SIZE))
+        self.timeout = float(app.config.get("WRITE_BEHIND_TIMEOUT", DEFAULT_TIMEOUT))
+        self.engine = engine
+        self.logger = app.logger
+
+    def _ensure_flusher(self):
+        # started lazily and per process, a thread does not survive a gunicorn fork
+        with self._condition:
+            if self._flusher is None or self._flusher_pid != os.getpid() or not self._flusher.is_alive():
+                if self._flusher_pid is None:
+                    atexit.register(self.shutdown)
+                if self._flusher_pid != os.getpid():
+                    # the parent's queue, its writes are flushed by the parent
+                    self._pending = {}
+                    self._in_flight = {}
+                self._stopping = False
+                self._flusher = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._flusher_pid = os.getpid()
+                self._flusher.start()
+
+    def submit(self, user_id, movie_id, rating=None, watched=None):
+        """
+        Queues a validated mutation. Raises WriteBehindBusy when the queue is full.
+
+        :return: Future resolved with the WriteOutcome once its batch is committed
+        """
+        self._ensure_flusher()
+        future = Future()
+        with self._condition:
+            write = self._pending.get((user_id, movie_id))
+            if write is None:
+                if len(self._pending) >= self.queue_size:
+                    request_metrics.increment("write_behind_rejected_total", "write_behind")
+                    raise WriteBehindBusy("Too many pending writes")
+                write = self._pending[(user_id, movie_id)] = PendingWrite(user_id, movie_id)
+            if rating is not None:
+                write.rating = rating
+            if watched is not None:
+                write.watched = watched
+            write.futures.append(future)
+            self._condition.notify()
+
+        request_metrics.increment("write_behind_writes_total", "write_behind")
+        return future
+
+    def pending_watched(self, user_id, movie_id):
+        """
+        True when a queued or uncommitted write marks the movie as watched, so the user may already rate it.
+        Call it before reading the watchlist row: a write leaves the queue only once it is committed.
+        """
+        with self._condition:
+            for writes in (self._pending, self._in_flight):
+                write = writes.get((user_id, movie_id))
+                if write is not None and write.watched:
+                    return True
+            return False
+
+    def wait(self, future):
+        """
+        :return: the WriteOutcome of future, None with WRITE_BEHIND_ACK=enqueue
+        """
+        if self.ack == ACK_ENQUEUE:
+            return None
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # the write stays queued, retrying it is harmless as ratings and the watched flag are idempotent
+            raise WriteBehindBusy("Write was not committed in time")
+
+    async def wait_async(self, future):
+        if self.ack == ACK_ENQUEUE:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise WriteBehindBusy("Write was not committed in time")
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending and not self._stopping:
+                self._condition.wait()
+
+            # flush once the oldest write waited an interval or a full batch is queued
+            while not self._stopping and len(self._pending) < self.batch_size:
+                remaining = next(iter(self._pending.values())).queued_at + self.interval - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            keys = list(self._pending)[:self.batch_size]
+            self._in_flight = {key: self._pending.pop(key) for key in keys}
+            return list(self._in_flight.values())
+
+    def _run(self):
+        while True:
+            writes = self._next_batch()
+            if writes:
+                try:
+                    self.flush(writes)
+                except Exception as err:
+                    # a failed batch must not end the thread, its writes fail and later ones are still flushed
+                    self.logger.exception(f"Write-behind flush of {len(writes)} writes failed")
+                    request_metrics.increment("write_behind_failed_total", "write_behind")
+                    for write in writes:
+                        for future in write.futures:
+                            if not future.done():
+                                future.set_exception(err)
+                finally:
+                    with self._condition:
+                        self._in_flight = {}
+            elif self._stopping:
+                return
+
+    def flush(self, writes):
+        """
+        Applies writes in one transaction per shard of their users and resolves their futures.
+        """
+        groups = {}
+        for write in writes:
+            try:
+                location = shard_router.location(write.user_id, write=True) if shard_router.enabled else None
+            except ShardMoving as err:
+                for future in write.futures:
+                    future.set_exception(WriteBehindBusy(str(err)))
+                continue
+            groups.setdefault(location, []).append(write)
+
+        for location, group in groups.items():
+            with shard_router.routed_to(location):
+                self._flush(group)
+
+    def _flush(self, writes):
+        try:
+            with ShardedSession(self.engine) as session:
+                outcomes, rated_movies = apply_pending_writes(session, writes)
+                session.commit()
+        except Exception as err:
+            self.logger.exception(f"Write-behind batch of {len(writes)} writes failed")
+            request_metrics.increment("write_behind_failed_total", "write_behind")
+            for write in writes:
+                for future in write.futures:
+                    future.set_exception(err)
+            return
+
+        request_metrics.increment("write_behind_batches_total", "write_behind")
+        # like the synchronous rate_movie, the cache is invalidated before the writes are answered,
+        # so a read right after the answer never gets the body from before the write
+        for movie_id in rated_movies:
+            response_cache.invalidate_movie(movie_id)
+        for write in writes:
+            for future in write.futures:
+                future.set_result(outcomes[(write.user_id, write.movie_id)])
+
+    def shutdown(self):
+        """
+        Flushes what is queued and stops the flusher, e.g. on worker exit.
+        """
+        with self._condition:
+            flusher = self._flusher
+            if flusher is None or self._flusher_pid != os.getpid():
+                return
+            self._stopping = True
+            self._condition.notify()
+        flusher.join(timeout=self.timeout)
+        self._flusher = None
+
+
+write_behind = WriteBehind()